@@ -0,0 +1,175 @@
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+AGGREGATION_MODES = ('off', 'window', 'deadband')
+
+
+class _DeviceState:
+    """Состояние одного устройства: фиксированный набор полей, O(1) памяти"""
+    __slots__ = ('window_start', 'count', 'total', 'minimum', 'maximum',
+                 'last_value', 'last_emit', 'last_seen')
+
+    def __init__(self):
+        self.window_start = 0.0
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.last_value: Optional[float] = None
+        self.last_emit = 0.0
+        self.last_seen = 0.0
+
+
+class TemperatureAggregator:
+    """Агрегация потока температуры по device_id перед записью в InfluxDB.
+
+    window   - выровненные окна фиксированной длины, на окно одна точка с min/max/mean;
+    deadband - запись только при изменении больше порога, плюс heartbeat
+               не реже одного раза в heartbeat секунд, чтобы пропуски данных были видны.
+    """
+
+    def __init__(self,
+                 encode: Callable[[str, Dict[str, Any], int], Any],
+                 sink: Callable[[Any], bool],
+                 mode: str = 'window',
+                 window: float = 60.0,
+                 deadband: float = 0.1,
+                 heartbeat: float = 300.0,
+                 idle_timeout: Optional[float] = None):
+        if mode not in AGGREGATION_MODES:
+            raise ValueError(f"Unknown aggregation mode: {mode}")
+
+        self.encode = encode
+        self.sink = sink
+        self.mode = mode
+        self.window = window
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        # Устройства без данных дольше этого срока забываются
+        self.idle_timeout = idle_timeout or 10 * max(window, heartbeat)
+
+        self._devices: Dict[str, _DeviceState] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            'messages_in': 0,
+            'points_out': 0,
+            'suppressed': 0,
+            'heartbeats': 0,
+            'non_finite': 0,
+        }
+
+    def handle(self, data: Dict[str, Any]) -> List[Any]:
+        """Обработчик топика sensor/temperature для MessageDispatcher"""
+        return self.process(str(data.get("device", "unknown")), float(data["temperature"]))
+
+    def process(self, device: str, value: float, now: Optional[float] = None) -> List[Any]:
+        now = time.time() if now is None else now
+        value = float(value)
+        with self._lock:
+            self.metrics['messages_in'] += 1
+            if not math.isfinite(value):
+                # nan/inf испортили бы min/max/mean окна до его закрытия
+                self.metrics['non_finite'] += 1
+                return []
+            state = self._devices.get(device)
+            if state is None:
+                state = self._devices[device] = _DeviceState()
+            state.last_seen = now
+
+            if self.mode == 'off':
+                return self._emit(device, {"temperature": value}, now)
+            if self.mode == 'deadband':
+                return self._process_deadband(device, state, value, now)
+            return self._process_window(device, state, value, now)
+
+    def _process_deadband(self, device: str, state: _DeviceState, value: float, now: float) -> List[Any]:
+        if state.last_value is not None and abs(value - state.last_value) < self.deadband:
+            if now - state.last_emit < self.heartbeat:
+                self.metrics['suppressed'] += 1
+                return []
+            self.metrics['heartbeats'] += 1
+            # Heartbeat повторяет последнее записанное значение
+            value = state.last_value
+        state.last_value = value
+        state.last_emit = now
+        return self._emit(device, {"temperature": value}, now)
+
+    def _process_window(self, device: str, state: _DeviceState, value: float, now: float) -> List[Any]:
+        records = []
+        window_start = now - now % self.window
+        if state.count and window_start != state.window_start:
+            records = self._close_window(device, state)
+        if not state.count:
+            state.window_start = window_start
+            state.minimum = state.maximum = value
+        else:
+            self.metrics['suppressed'] += 1
+        state.count += 1
+        state.total += value
+        state.minimum = min(state.minimum, value)
+        state.maximum = max(state.maximum, value)
+        return records
+
+    def _close_window(self, device: str, state: _DeviceState) -> List[Any]:
+        fields = {
+            "temperature": state.total / state.count,
+            "temperature_min": state.minimum,
+            "temperature_max": state.maximum,
+            "samples": state.count,
+        }
+        records = self._emit(device, fields, state.window_start)
+        state.count = 0
+        state.total = 0.0
+        return records
+
+    def _emit(self, device: str, fields: Dict[str, Any], ts: float) -> List[Any]:
+        self.metrics['points_out'] += 1
+        return [self.encode(device, fields, int(ts * 1e9))]
+
+    def flush_expired(self, now: Optional[float] = None, force: bool = False) -> int:
+        """Закрытие завершившихся окон и удаление неактивных устройств"""
+        now = time.time() if now is None else now
+        records = []
+        with self._lock:
+            for device, state in list(self._devices.items()):
+                if state.count and (force or now >= state.window_start + self.window):
+                    records.extend(self._close_window(device, state))
+                if now - state.last_seen > self.idle_timeout:
+                    del self._devices[device]
+        for record in records:
+            self.sink(record)
+        return len(records)
+
+    def _run(self):
+        # Окна закрываются вовремя; в остальных режимах поток только забывает неактивные устройства
+        interval = min(self.window, 1.0) if self.mode == 'window' else min(self.idle_timeout / 10, 60.0)
+        while not self._stop.wait(interval):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                logging.error(f"Aggregation flush error: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="aggregation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка с записью незакрытых окон"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush_expired(force=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['devices'] = len(self._devices)
+        messages = stats['messages_in']
+        stats['reduction_ratio'] = messages / stats['points_out'] if stats['points_out'] else 0.0
+        return stats
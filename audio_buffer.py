@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Кольцевой буфер float32 фиксированного размера для аудио.
+
+    audio_callback копирует блок напрямую в заранее выделенный массив (без
+    промежуточных Python-объектов), поток обработки ждёт окно на Condition.
+    Позиции записи и чтения - абсолютные номера отсчётов.
+    """
+
+    def __init__(self, capacity: int, dtype=np.float32):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._write_pos = 0
+        self._read_pos = 0
+        # Момент последней записи (time.monotonic) - часы захвата для позиций отсчётов
+        self._write_time = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Отсчёты, перезаписанные до чтения (обработка не успевает за записью)
+        self.overrun_samples = 0
+
+    @property
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    @property
+    def write_position(self) -> int:
+        return self._write_pos
+
+    @property
+    def read_position(self) -> int:
+        return self._read_pos
+
+    def capture_time(self, position: int, rate: int) -> float:
+        """Момент захвата отсчёта position (time.monotonic), отсчитанный от последней записи"""
+        with self._cond:
+            return self._write_time - (self._write_pos - position) / rate
+
+    def write(self, samples: np.ndarray):
+        """Запись блока (вызывается из callback sounddevice)"""
+        count = len(samples)
+        if count > self.capacity:
+            samples = samples[-self.capacity:]
+            count = self.capacity
+
+        with self._cond:
+            start = self._write_pos % self.capacity
+            first = min(count, self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            if first < count:
+                self._data[:count - first] = samples[first:]
+            self._write_pos += count
+            self._write_time = time.monotonic()
+
+            # Самые старые данные перезаписаны - сдвигаем позицию чтения
+            overrun = self._write_pos - self._read_pos - self.capacity
+            if overrun > 0:
+                self._read_pos += overrun
+                self.overrun_samples += overrun
+            self._cond.notify_all()
+
+    def _copy(self, start_pos: int, size: int, out: Optional[np.ndarray]) -> np.ndarray:
+        if out is None:
+            out = np.empty(size, dtype=self._data.dtype)
+        start = start_pos % self.capacity
+        first = min(size, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        if first < size:
+            out[first:size] = self._data[:size - first]
+        return out[:size]
+
+    def read_window(self, size: int, step: Optional[int] = None, timeout: Optional[float] = None,
+                    out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """Ожидание окна из size отсчётов; позиция чтения сдвигается на step.
+
+        step < size даёт перекрытие окон на size - step отсчётов. Возвращает None
+        по таймауту или после close(). out - массив для повторного использования.
+        """
+        step = size if step is None else step
+        if step <= 0:
+            # Позиция чтения не сдвигалась бы - одно и то же окно бесконечно
+            raise ValueError(f"Window step must be positive: size={size}, step={step}")
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or self.available >= size, timeout):
+                return None
+            if self.available < size:
+                return None
+            window = self._copy(self._read_pos, size, out)
+            self._read_pos += step
+            return window
+
+    def close(self):
+        """Пробуждение ожидающих читателей при остановке"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,88 @@
+import wave
+from typing import Iterator, Tuple
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+
+def resample(audio: np.ndarray, source_rate: int, rate: int) -> np.ndarray:
+    """Линейная передискретизация (для речи в Whisper достаточно)"""
+    if source_rate == rate or not len(audio):
+        return audio.astype(np.float32, copy=False)
+    duration = len(audio) / source_rate
+    positions = np.arange(int(duration * rate)) * (source_rate / rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def _read_wave(path: str):
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported without soundfile: {path}")
+        frames = f.readframes(f.getnframes())
+        audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        channels = f.getnchannels()
+        if channels > 1:
+            audio = audio.reshape(-1, channels).mean(axis=1)
+        return audio, f.getframerate()
+
+
+def read_audio(path: str, rate: int = 16000) -> np.ndarray:
+    """Файл целиком как float32 моно с частотой rate.
+
+    WAV читается стандартной библиотекой, FLAC и прочие форматы - через soundfile.
+    """
+    if soundfile is not None:
+        audio, source_rate = soundfile.read(path, dtype='float32', always_2d=True)
+        audio = audio.mean(axis=1)
+    else:
+        audio, source_rate = _read_wave(path)
+    return resample(audio, source_rate, rate)
+
+
+def _wave_blocks(path: str, block: int) -> Iterator[Tuple[np.ndarray, int]]:
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"Only 16-bit PCM WAV is supported without soundfile: {path}")
+        channels = f.getnchannels()
+        while True:
+            frames = f.readframes(block)
+            if not frames:
+                break
+            audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+            if channels > 1:
+                audio = audio.reshape(-1, channels).mean(axis=1)
+            yield audio, f.getframerate()
+
+
+def _soundfile_blocks(path: str, block: int) -> Iterator[Tuple[np.ndarray, int]]:
+    source_rate = soundfile.info(path).samplerate
+    for audio in soundfile.blocks(path, blocksize=block, dtype='float32', always_2d=True):
+        yield audio.mean(axis=1), source_rate
+
+
+def iter_audio_blocks(path: str, block_size: int, rate: int = 16000) -> Iterator[np.ndarray]:
+    """Потоковое чтение файла блоками ровно по block_size отсчётов (последний - короче).
+
+    Файл не загружается целиком; передискретизация - по блокам исходного файла.
+    """
+    reader = _soundfile_blocks if soundfile is not None else _wave_blocks
+    pending = np.empty(0, dtype=np.float32)
+    for audio, source_rate in reader(path, block_size * 16):
+        pending = np.concatenate((pending, resample(audio, source_rate, rate)))
+        while len(pending) >= block_size:
+            yield pending[:block_size]
+            pending = pending[block_size:]
+    if len(pending):
+        yield pending
+
+
+def audio_duration(path: str) -> float:
+    """Длительность файла в секундах без чтения данных"""
+    if soundfile is not None:
+        return soundfile.info(path).duration
+    with wave.open(path, 'rb') as f:
+        return f.getnframes() / f.getframerate()
@@ -0,0 +1,302 @@
+"""Пакетное распознавание архивных записей (WAV/FLAC) из каталога.
+
+Файлы читаются потоково и режутся на фразы тем же детектором речи, что и
+живой поток (параметры VAD_* из окружения). Фразы распределяются по пулу
+процессов; модель загружается в каждом процессе один раз (TRANSCRIPTION_ENGINE,
+WHISPER_* как в speech_processor.py).
+
+Результат - JSONL, одна строка на файл:
+
+    {"file": "2024-05-01/mic1.wav", "duration": 3600.0,
+     "segments": [{"start": 1.23, "end": 4.56, "text": "..."}, ...]}
+
+Строка файла пишется только после распознавания всех его фраз, поэтому
+после прерывания повторный запуск пропускает уже записанные файлы. Файл с
+нераспознанными фразами не записывается и обрабатывается при следующем запуске;
+упавший процесс пула (BrokenProcessPool) заменяется новым, а его фразы
+отправляются повторно (до --retries раз).
+
+    python batch_transcribe.py recordings/ --output transcripts.jsonl --workers 4
+    MQTT_TLS=0 MQTT_BROKER=localhost MQTT_PORT=1883 \\
+        python batch_transcribe.py recordings/ --mqtt-topic speech/archive
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from audio_files import audio_duration, iter_audio_blocks
+from vad import create_segmenter
+
+RATE = 16000
+EXTENSIONS = ('.wav', '.flac')
+
+# Движок процесса пула, создаётся в initializer
+_engine = None
+
+
+def _init_worker(threads: int, engine_options: Dict[str, Any]):
+    global _engine
+    if threads:
+        # До импорта torch/ctranslate2: иначе N процессов займут N * все ядра
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+    from transcription_engines import create_engine_from_env
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    _engine = create_engine_from_env(cpu_threads=threads, **engine_options)
+
+
+def _transcribe(audio: np.ndarray, language: str) -> str:
+    return _engine.transcribe(audio, language=language).strip()
+
+
+class FileJob:
+    """Файл в работе: фразы, отправленные в пул, и их результаты"""
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.segments: List[Dict[str, Any]] = []
+        self.remaining = 0
+        self.failed = 0
+        self.read_done = False
+
+    @property
+    def complete(self) -> bool:
+        return self.read_done and self.remaining == 0
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            'file': self.name,
+            'duration': audio_duration(self.path),
+            'segments': self.segments,
+        }
+
+
+def find_files(directory: str) -> List[str]:
+    found = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def load_done(path: str) -> Set[str]:
+    """Файлы, уже записанные в результат; оборванная последняя строка игнорируется"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['file'])
+            except (ValueError, KeyError):
+                continue
+        # Дописываем перевод строки, чтобы новая запись не склеилась с оборванной
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    return done
+
+
+class BatchTranscriber:
+    def __init__(self, args):
+        self.args = args
+        self.output = open(args.output, 'a', encoding='utf-8')
+        self.inflight: Dict[Future, tuple] = {}
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.mqtt_client = self._connect_mqtt() if args.mqtt_topic else None
+        self.metrics = {
+            'files': 0,
+            'files_failed': 0,
+            'segments': 0,
+            'errors': 0,
+            'retries': 0,
+            'pool_restarts': 0,
+            'audio_seconds': 0.0,
+            'speech_seconds': 0.0,
+        }
+        self.started = time.monotonic()
+        self.next_report = self.started + args.report_interval
+
+    def _connect_mqtt(self):
+        from mqtt_publisher import connect_client
+
+        return connect_client("batch")
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context('spawn')
+        engine_options = {'name': self.args.engine} if self.args.engine else {}
+        return ProcessPoolExecutor(max_workers=self.args.workers, mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(self.args.threads, engine_options))
+
+    def _submit(self, job: FileJob, segment: Dict[str, Any], audio: np.ndarray, attempt: int = 0):
+        future = self.pool.submit(_transcribe, audio, self.args.language)
+        self.inflight[future] = (job, segment, audio, attempt, self.pool)
+
+    def _finish_file(self, job: FileJob):
+        if job.failed:
+            # Не записываем: при повторном запуске файл будет распознан заново
+            self.metrics['files_failed'] += 1
+            logging.error(f"{job.name}: {job.failed} of {len(job.segments)} segments failed, "
+                          f"file will be retried on the next run")
+            return
+        job.segments.sort(key=lambda segment: segment['start'])
+        record = job.record()
+        # Одна строка на файл и flush - файл либо записан целиком, либо будет обработан заново
+        self.output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.output.flush()
+        os.fsync(self.output.fileno())
+
+        if self.mqtt_client is not None:
+            for segment in job.segments:
+                if segment.get('text'):
+                    self.mqtt_client.publish(self.args.mqtt_topic, json.dumps(
+                        dict(segment, file=job.name), ensure_ascii=False), qos=1)
+
+        self.metrics['files'] += 1
+        self.metrics['audio_seconds'] += record['duration']
+        logging.info(f"{job.name}: {len(job.segments)} segments")
+
+    def _collect(self, futures):
+        for future in futures:
+            job, segment, audio, attempt, pool = self.inflight.pop(future)
+            try:
+                segment['text'] = future.result()
+            except BrokenProcessPool as e:
+                if pool is self.pool:
+                    # Процесс пула упал (OOM, сбой движка) - пул непригоден, создаём новый
+                    logging.error(f"Worker process died, restarting pool: {e}")
+                    pool.shutdown(wait=False)
+                    self.pool = self._create_pool()
+                    self.metrics['pool_restarts'] += 1
+                if attempt < self.args.retries:
+                    self.metrics['retries'] += 1
+                    self._submit(job, segment, audio, attempt + 1)
+                    continue
+                self._segment_failed(job, segment, e)
+            except Exception as e:
+                self._segment_failed(job, segment, e)
+            job.remaining -= 1
+            if job.complete:
+                self._finish_file(job)
+
+    def _segment_failed(self, job: FileJob, segment: Dict[str, Any], error: Exception):
+        logging.error(f"{job.name} @ {segment['start']:.1f}s: {error}")
+        job.failed += 1
+        self.metrics['errors'] += 1
+
+    def _wait(self, limit: int):
+        while len(self.inflight) > limit:
+            done, _ = wait(list(self.inflight), return_when=FIRST_COMPLETED)
+            self._collect(done)
+        if time.monotonic() >= self.next_report:
+            self.report()
+            self.next_report = time.monotonic() + self.args.report_interval
+
+    def submit_file(self, path: str, name: str):
+        job = FileJob(path, name)
+        segmenter = create_segmenter(RATE)
+        max_inflight = self.args.workers * 4
+
+        def submit(utterance):
+            segment = {
+                'start': round(utterance.start / RATE, 2),
+                'end': round(utterance.end / RATE, 2),
+            }
+            job.segments.append(segment)
+            job.remaining += 1
+            self.metrics['segments'] += 1
+            self.metrics['speech_seconds'] += len(utterance.audio) / RATE
+            self._submit(job, segment, utterance.audio)
+            # Ограничение памяти: не больше max_inflight фраз в очереди пула
+            self._wait(max_inflight)
+
+        for frame in iter_audio_blocks(path, segmenter.frame_size, RATE):
+            if len(frame) < segmenter.frame_size:
+                break
+            # Время по аудио, а не по часам: задержки живого потока здесь не нужны
+            utterance = segmenter.push(frame, now=segmenter.position / RATE)
+            if utterance is not None:
+                submit(utterance)
+        utterance = segmenter.flush()
+        if utterance is not None:
+            submit(utterance)
+
+        job.read_done = True
+        if job.complete:
+            self._finish_file(job)
+
+    def report(self):
+        wall = time.monotonic() - self.started
+        audio_hours = self.metrics['audio_seconds'] / 3600
+        speech = self.metrics['speech_seconds'] / max(self.metrics['audio_seconds'], 1e-9)
+        logging.info(
+            f"files {self.metrics['files']} ({self.metrics['files_failed']} failed), "
+            f"segments {self.metrics['segments']}, errors {self.metrics['errors']}, "
+            f"pool restarts {self.metrics['pool_restarts']}, "
+            f"audio {audio_hours:.2f} h ({speech:.0%} speech), "
+            f"{audio_hours / (wall / 3600):.1f} audio-hours per wall-hour"
+        )
+
+    def run(self, files: List[str]):
+        self.pool = self._create_pool()
+        try:
+            for path in files:
+                self.submit_file(path, os.path.relpath(path, self.args.directory))
+            self._wait(0)
+        finally:
+            self.pool.shutdown()
+        self.report()
+
+    def close(self):
+        self.output.close()
+        if self.mqtt_client is not None:
+            self.mqtt_client.loop_stop()
+            self.mqtt_client.disconnect()
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help="каталог с записями (рекурсивно)")
+    parser.add_argument('--output', default="transcripts.jsonl")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--threads', type=int, default=0,
+                        help="потоки на процесс, 0 - поровну делить ядра между процессами")
+    parser.add_argument('--engine', help="переопределяет TRANSCRIPTION_ENGINE")
+    parser.add_argument('--language', default="pl")
+    parser.add_argument('--retries', type=int, default=2,
+                        help="повторов фразы после падения процесса пула")
+    parser.add_argument('--mqtt-topic', help="публиковать фразы в этот топик")
+    parser.add_argument('--report-interval', type=float, default=30.0)
+    args = parser.parse_args(argv)
+    if not args.threads:
+        args.threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    done = load_done(args.output)
+    files = [path for path in find_files(args.directory)
+             if os.path.relpath(path, args.directory) not in done]
+    logging.info(f"{len(files)} files to transcribe, {len(done)} already done")
+
+    transcriber = BatchTranscriber(args)
+    try:
+        transcriber.run(files)
+    except KeyboardInterrupt:
+        logging.info("Interrupted, finished files are saved")
+    finally:
+        transcriber.close()
+
+
+if __name__ == "__main__":
+    main()
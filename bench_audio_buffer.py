@@ -0,0 +1,105 @@
+"""Сравнение накопления аудио: список Python (старый process_audio) против AudioRingBuffer.
+
+Имитирует callback sounddevice блоками по CHUNK отсчётов и считает для каждого
+варианта время на окно, пиковую память (tracemalloc), пиковое число живых
+блоков аллокатора Python и срабатывания сборщика мусора поколения 0.
+
+Запуск: python bench_audio_buffer.py [--seconds 60]
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio_buffer import AudioRingBuffer
+
+RATE = 16000
+CHUNK = 1024 * 2
+BUFFER_SECONDS = 5
+
+
+def make_chunks(seconds):
+    rng = np.random.default_rng(42)
+    count = int(RATE * seconds) // CHUNK
+    return [rng.uniform(-0.5, 0.5, (CHUNK, 1)).astype(np.float32) for _ in range(count)]
+
+
+def run_list_path(chunks, window_size, step, probe):
+    """Прежняя логика: очередь копий, extend в список float, np.array и срез списка"""
+    windows = 0
+    queue = []
+    buffer = []
+    for indata in chunks:
+        queue.append(indata.copy())
+        while queue and len(buffer) < window_size:
+            buffer.extend(queue.pop(0).flatten())
+        if len(buffer) >= window_size:
+            np.array(buffer[:window_size], dtype=np.float32)
+            buffer = buffer[step:]
+            windows += 1
+        probe()
+    return windows
+
+
+def run_ring_path(chunks, window_size, step, probe):
+    ring = AudioRingBuffer(window_size * 4)
+    window = np.empty(window_size, dtype=np.float32)
+    windows = 0
+    for indata in chunks:
+        ring.write(indata.reshape(-1))
+        while ring.read_window(window_size, step, timeout=0, out=window) is not None:
+            windows += 1
+        probe()
+    return windows
+
+
+def measure(runner, chunks, window_size, step):
+    gc.collect()
+    base_blocks = sys.getallocatedblocks()
+    peak_blocks = [0]
+
+    def probe():
+        # Каждый float в списке - отдельный блок аллокатора
+        peak_blocks[0] = max(peak_blocks[0], sys.getallocatedblocks() - base_blocks)
+
+    # Время без tracemalloc, память и GC - отдельным прогоном
+    start = time.perf_counter()
+    windows = runner(chunks, window_size, step, lambda: None)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    collections = gc.get_stats()[0]['collections']
+    tracemalloc.start()
+    runner(chunks, window_size, step, probe)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'windows': windows,
+        'ms_per_window': elapsed * 1000 / max(windows, 1),
+        'peak_mb': peak / 1e6,
+        'peak_blocks': peak_blocks[0],
+        'gc_gen0': gc.get_stats()[0]['collections'] - collections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=60.0, help="длительность имитируемого звука")
+    parser.add_argument('--overlap', type=float, default=0.0, help="перекрытие окон в секундах")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.seconds)
+    window_size = RATE * BUFFER_SECONDS
+    step = window_size - int(RATE * args.overlap)
+
+    for name, runner in (('list', run_list_path), ('ring', run_ring_path)):
+        r = measure(runner, chunks, window_size, step)
+        print(f"{name:>5}: {r['windows']} windows, {r['ms_per_window']:.2f} ms/window, "
+              f"peak {r['peak_mb']:.1f} MB, peak blocks {r['peak_blocks']}, gc gen0 {r['gc_gen0']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Сравнение бэкендов детектора на одном ролике: точность относительно эталона и FPS.
+
+Первые --frames кадров ролика прогоняются через каждую конфигурацию
+backend:imgsz[:int8] по одному кадру (как VideoAnalyzer с одной камерой).
+Разметки у ролика нет, поэтому эталон - первая конфигурация (по умолчанию
+torch:640), точность - совпадение с её детекциями:
+
+  precision/recall - доля рамок, совпавших с эталонными (тот же класс, IoU >= 0.5);
+  count MAE        - средняя ошибка числа объектов по меткам на кадр (то, что уходит в MQTT).
+
+Каждая конфигурация выполняется в отдельном процессе (spawn), экспорт в
+ONNX/OpenVINO кэшируется (DETECTOR_CACHE_DIR) и в FPS не входит.
+
+    python bench_detector.py --clip fixtures/street.mp4
+    python bench_detector.py --clip fixtures/street.mp4 --configs torch:640 onnx:640 onnx:640:int8 \\
+        openvino:640 openvino:640:int8 openvino:416:int8 --output bench_results/detector.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+from bench_ingest import git_commit, peak_rss_mb, percentile
+
+IOU_THRESHOLD = 0.5
+
+
+def parse_config(config: str) -> Dict[str, Any]:
+    """backend:imgsz[:int8] -> параметры Detector"""
+    parts = config.split(':')
+    return {
+        'backend': parts[0],
+        'imgsz': int(parts[1]) if len(parts) > 1 else 640,
+        'int8': len(parts) > 2 and parts[2] == 'int8',
+    }
+
+
+def read_clip(path: str, limit: int):
+    import cv2
+
+    video = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        success, frame = video.read()
+        if not success:
+            break
+        frames.append(frame)
+    video.release()
+    return frames
+
+
+def run_config(config: str, clip: str, limit: int, model_file: str, min_score: float,
+               threads: int) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе"""
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    import cv2
+    from detector_backends import Detector
+    from video_tracking import summarize_predictions
+
+    frames = read_clip(clip, limit)
+    detector = Detector(model_file, **parse_config(config))
+    latencies = []
+    detections = []
+    for frame in frames:
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        start = time.perf_counter()
+        predictions = detector(rgb, verbose=False)
+        latencies.append(time.perf_counter() - start)
+        detections.append(summarize_predictions(predictions, min_score)[1])
+
+    total = sum(latencies)
+    return {
+        'config': config,
+        'detector': detector.describe(),
+        'frames': len(frames),
+        'fps': len(frames) / total if total else 0.0,
+        'inference_ms': {
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+        },
+        'load_s': detector.load_seconds,
+        'warmup_s': detector.warmup_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'detections': detections,
+    }
+
+
+def compare(reference: List[list], detections: List[list]) -> Dict[str, float]:
+    """Совпадение детекций с эталоном по кадрам (жадно по IoU внутри класса)"""
+    from video_tracking import iou
+
+    matched = predicted = expected = 0
+    count_error = 0
+    for ref_frame, frame in zip(reference, detections):
+        pairs = sorted(((iou(r, d), i, j) for i, r in enumerate(ref_frame) for j, d in enumerate(frame)
+                        if r[4] == d[4]), reverse=True)
+        used_ref, used = set(), set()
+        for overlap, i, j in pairs:
+            if overlap < IOU_THRESHOLD:
+                break
+            if i not in used_ref and j not in used:
+                used_ref.add(i)
+                used.add(j)
+        matched += len(used)
+        predicted += len(frame)
+        expected += len(ref_frame)
+
+        counts: Dict[str, int] = {}
+        for detection in ref_frame:
+            counts[detection[5]] = counts.get(detection[5], 0) + 1
+        for detection in frame:
+            counts[detection[5]] = counts.get(detection[5], 0) - 1
+        count_error += sum(abs(value) for value in counts.values())
+
+    return {
+        'precision': matched / predicted if predicted else 1.0,
+        'recall': matched / expected if expected else 1.0,
+        'count_mae': count_error / max(len(reference), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clip', required=True, help="видеофайл")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--configs', nargs='+',
+                        default=['torch:640', 'onnx:640', 'openvino:640', 'openvino:640:int8', 'openvino:416:int8'],
+                        help="backend:imgsz[:int8], первая - эталон точности")
+    parser.add_argument('--model', default='yolov8n.pt')
+    parser.add_argument('--min-score', type=float, default=0.5)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--output', help="JSON с результатами")
+    args = parser.parse_args()
+
+    results = []
+    reference = None
+    context = multiprocessing.get_context('spawn')
+    for config in args.configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result = pool.submit(run_config, config, args.clip, args.frames, args.model,
+                                     args.min_score, args.threads).result()
+            except Exception as e:
+                print(f"{config:>20}: failed: {e}")
+                continue
+        detections = result.pop('detections')
+        if reference is None:
+            reference = detections
+        result.update(compare(reference, detections))
+        results.append(result)
+        print(f"{config:>20}: {result['fps']:.1f} FPS, inference p50 {result['inference_ms']['p50']:.1f} ms "
+              f"p95 {result['inference_ms']['p95']:.1f} ms, precision {result['precision']:.1%}, "
+              f"recall {result['recall']:.1%}, count MAE {result['count_mae']:.2f}, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.time(), 'config': vars(args),
+                       'reference': results[0]['config'] if results else None, 'results': results}, f, indent=2)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
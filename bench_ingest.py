@@ -0,0 +1,370 @@
+"""Бенчмарк приёма данных SensorDataCollector на синтетическом или записанном трафике.
+
+Коллектор запускается в этом же процессе и пишет в поддельный InfluxDB (HTTP
+сервер в отдельном потоке). Трафик подаётся либо напрямую в _on_message
+(--transport direct, брокер не нужен), либо через локальный брокер без TLS
+(--transport broker, например mosquitto: docker compose --profile local up mosquitto).
+
+В каждое сообщение встраивается порядковый номер, поэтому поддельный InfluxDB
+сопоставляет записанные строки с моментом отправки и считает сквозную задержку
+до подтверждения записи. Агрегация температуры на время бенчмарка отключается.
+
+    python bench_ingest.py --rate 5000 --duration 30 --devices 200
+    python bench_ingest.py --transport broker --broker localhost --rate 0 --messages 200000
+    python bench_ingest.py --replay traffic.jsonl --compare bench_results/ingest-abc1234-1700000000.json
+
+Записанный трафик (--replay) - JSONL со строками {"topic": ..., "payload": {...}}.
+Результаты сохраняются в bench_results/ingest-<commit>-<время>.json.
+"""
+import argparse
+import gzip
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Порядковый номер в строках line protocol для каждого топика (Point и прямой кодировщик)
+SEQ_RE = re.compile(rb'temperature=(\d+)(?:\.0)?[ ,]|message="bench (\d+)"|person(?:=|\\": )(\d+)')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса; без /proc - пиковый"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS - байты
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit() -> str:
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', '-C', repo, 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.call(['git', '-C', repo, 'diff', '--quiet', 'HEAD'], stderr=subprocess.DEVNULL)
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class FakeInfluxDB:
+    """HTTP сервер, принимающий /api/v2/write и запоминающий время прихода каждой строки"""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.arrivals: Dict[int, float] = {}
+        self.lines = 0
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.fail_rate and random.random() < fake.fail_rate:
+                    with fake._lock:
+                        fake.failures += 1
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                fake.record(body)
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def record(self, body: bytes):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.lines += body.count(b'\n') + 1
+            for match in SEQ_RE.finditer(body):
+                seq = int(next(group for group in match.groups() if group))
+                self.arrivals.setdefault(seq, now)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-influx", daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeMessage:
+    """Минимальная замена paho MQTTMessage для прямой подачи"""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def synthetic_traffic(topics: Dict[str, str], devices: int, mix: Tuple[float, float, float]
+                      ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Поток (топик, payload) в пропорции temperature/display/vision"""
+    weights = list(itertools.accumulate(mix))
+    while True:
+        pick = random.random() * weights[-1]
+        if pick < weights[0]:
+            yield topics['temperature'], {"device": f"bench_{random.randrange(devices)}"}
+        elif pick < weights[1]:
+            yield topics['display'], {}
+        else:
+            yield topics['vision'], {"objects": {"car": random.randint(0, 3)}}
+
+
+def recorded_traffic(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        raise SystemExit(f"No records in {path}")
+    for record in itertools.cycle(records):
+        yield record['topic'], dict(record['payload'])
+
+
+def stamp(topics: Dict[str, str], topic: str, payload: Dict[str, Any], seq: int) -> bytes:
+    """Встраивание порядкового номера в поле, которое попадёт в InfluxDB"""
+    if topic == topics['temperature']:
+        payload["temperature"] = seq
+    elif topic == topics['display']:
+        payload["text"] = f"bench {seq}"
+    elif topic.startswith(topics['vision']):
+        payload["objects"] = dict(payload.get("objects", {}), person=seq)
+    return json.dumps(payload).encode()
+
+
+def configure_environment(args, influx_url: str, spool_dir: str):
+    """Конфигурация subscriber.py читается из окружения при импорте"""
+    os.environ.update({
+        'INFLUXDB_URL': influx_url,
+        'SPOOL_DIR': spool_dir,
+        'METRICS_PORT': str(args.metrics_port),
+        'TEMPERATURE_AGGREGATION': 'off',
+        'MQTT_TLS': '0',
+        'MQTT_BROKER': args.broker,
+        'MQTT_PORT': str(args.port),
+        'MQTT_CLIENT_ID': f"bench-collector-{os.getpid()}",
+    })
+
+
+def run(args) -> Dict[str, Any]:
+    fake = FakeInfluxDB(latency=args.influx_latency, fail_rate=args.influx_fail_rate)
+    fake.start()
+    spool_dir = tempfile.mkdtemp(prefix='bench-spool-')
+    configure_environment(args, fake.url, spool_dir)
+
+    import logging
+    import paho.mqtt.client as mqtt
+    import subscriber
+
+    logging.getLogger().setLevel(logging.WARNING)
+    topics = subscriber.MQTTConfig.TOPICS
+    collector = subscriber.SensorDataCollector()
+    collector.start_stages()
+
+    publisher = None
+    if args.transport == 'broker':
+        collector.mqtt_client.connect(args.broker, args.port)
+        collector.mqtt_client.loop_start()
+        publisher = mqtt.Client(client_id=f"bench-publisher-{os.getpid()}")
+        publisher.connect(args.broker, args.port)
+        publisher.loop_start()
+        time.sleep(1.0)  # ожидание подписки коллектора
+
+    if args.replay:
+        traffic = recorded_traffic(args.replay)
+    else:
+        traffic = synthetic_traffic(topics, args.devices, tuple(args.mix))
+
+    send_times: List[float] = []
+    rss_start = current_rss_mb()
+    start = time.monotonic()
+    deadline = start + args.duration if args.duration else None
+    interval = 1.0 / args.rate if args.rate else 0.0
+
+    for seq, (topic, payload) in enumerate(traffic):
+        if args.messages and seq >= args.messages:
+            break
+        if deadline and time.monotonic() >= deadline:
+            break
+        if interval:
+            delay = start + seq * interval - time.monotonic()
+            if delay > 0.001:
+                time.sleep(delay)
+
+        data = stamp(topics, topic, payload, seq)
+        send_times.append(time.monotonic())
+        if publisher is not None:
+            publisher.publish(topic, data, qos=args.qos)
+        else:
+            collector._on_message(None, None, FakeMessage(topic, data))
+
+    send_end = time.monotonic()
+    sent = len(send_times)
+
+    # Ожидание записи всех сообщений, пока есть прогресс
+    last_count, last_progress = -1, time.monotonic()
+    while len(fake.arrivals) < sent and time.monotonic() - last_progress < args.drain_timeout:
+        if len(fake.arrivals) != last_count:
+            last_count, last_progress = len(fake.arrivals), time.monotonic()
+        time.sleep(0.05)
+
+    rss_end = current_rss_mb()
+    stats = collector.collect_stats()
+    arrivals = dict(fake.arrivals)
+    if publisher is not None:
+        publisher.loop_stop()
+        publisher.disconnect()
+        collector.mqtt_client.loop_stop()
+        collector.mqtt_client.disconnect()
+    collector.dispatcher.stop()
+    collector.writer.close()
+    if collector.spool:
+        collector.spool.close()
+    fake.stop()
+
+    latencies = [(arrivals[seq] - sent_at) * 1000 for seq, sent_at in enumerate(send_times) if seq in arrivals]
+    last_arrival = max(arrivals.values(), default=send_end)
+    elapsed = max(last_arrival - start, 1e-9)
+
+    return {
+        'sent': sent,
+        'written': len(latencies),
+        'dropped': sent - len(latencies),
+        'offered_rate': sent / max(send_end - start, 1e-9),
+        'sustained_rate': len(latencies) / elapsed,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0),
+        },
+        'memory_mb': {
+            'rss_start': rss_start,
+            'rss_end': rss_end,
+            'growth': rss_end - rss_start,
+            'peak': peak_rss_mb(),
+        },
+        'influx': {'requests': fake.requests, 'lines': fake.lines, 'failures': fake.failures},
+        'collector': {section: values for section, values in stats.items() if section != 'latency'},
+    }
+
+
+def compare(current: Dict[str, Any], path: str):
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline['commit']} ({path}):")
+    pairs = [
+        ('sustained msgs/s', ('sustained_rate',)),
+        ('p50 ms', ('latency_ms', 'p50')),
+        ('p99 ms', ('latency_ms', 'p99')),
+        ('rss growth MB', ('memory_mb', 'growth')),
+        ('dropped', ('dropped',)),
+    ]
+    for name, keys in pairs:
+        old, new = baseline['results'], current['results']
+        for key in keys:
+            old, new = old[key], new[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {name:<18} {old:>12.2f} -> {new:>12.2f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('direct', 'broker'), default='direct')
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--rate', type=float, default=0, help="сообщений в секунду, 0 - без ограничения")
+    parser.add_argument('--duration', type=float, default=0, help="длительность отправки, с")
+    parser.add_argument('--messages', type=int, default=0, help="число сообщений")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--mix', type=float, nargs=3, default=(0.8, 0.1, 0.1),
+                        metavar=('TEMP', 'DISPLAY', 'VISION'), help="доли топиков")
+    parser.add_argument('--replay', help="JSONL с записанным трафиком")
+    parser.add_argument('--influx-latency', type=float, default=0.0, help="задержка ответа InfluxDB, с")
+    parser.add_argument('--influx-fail-rate', type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument('--drain-timeout', type=float, default=10.0)
+    parser.add_argument('--metrics-port', type=int, default=0)
+    parser.add_argument('--output-dir', default='bench_results')
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not args.duration and not args.messages:
+        args.messages = 100000
+    random.seed(args.seed)
+
+    results = run(args)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output_dir', 'compare')},
+        'env': {k: os.environ.get(k) for k in ('DISPATCH_WORKERS', 'DISPATCH_MODE', 'DISPATCH_BATCH_SIZE',
+                                               'INFLUX_ENCODER', 'WRITER_BATCH_SIZE', 'WRITER_FLUSH_INTERVAL', 'VISION_STORAGE')},
+        'results': results,
+    }
+
+    latency = results['latency_ms']
+    print(f"sent {results['sent']}, written {results['written']}, dropped {results['dropped']}")
+    print(f"offered {results['offered_rate']:,.0f} msgs/s, sustained {results['sustained_rate']:,.0f} msgs/s")
+    print(f"latency p50 {latency['p50']:.1f} ms, p90 {latency['p90']:.1f} ms, "
+          f"p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms")
+    print(f"rss {results['memory_mb']['rss_start']:.1f} -> {results['memory_mb']['rss_end']:.1f} MB "
+          f"(peak {results['memory_mb']['peak']:.1f} MB)")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"ingest-{report['commit']}-{int(report['timestamp'])}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {path}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Микробенчмарк кодирования: influxdb_client.Point против прямого line protocol.
+
+Запуск: python bench_line_protocol.py [--messages 100000]
+"""
+import argparse
+import json
+import random
+import time
+
+import line_protocol
+from subscriber import DataProcessor
+
+
+def make_payloads(count):
+    """Синтетические сообщения всех трёх топиков в пропорции трафика"""
+    payloads = []
+    for i in range(count):
+        kind = random.random()
+        if kind < 0.8:
+            payloads.append(('temperature', json.dumps(
+                {"device": f"esp8266_{i % 50}", "temperature": round(random.uniform(15, 30), 2)}).encode()))
+        elif kind < 0.9:
+            payloads.append(('display', json.dumps({"text": f"Wiadomość numer {i}"}).encode()))
+        else:
+            payloads.append(('vision', json.dumps(
+                {"objects": {"person": random.randint(0, 5), "car": random.randint(0, 3)}}).encode()))
+    return payloads
+
+
+def run_point_path(payloads):
+    handlers = {
+        'temperature': DataProcessor.process_temperature,
+        'display': DataProcessor.process_display,
+        'vision': DataProcessor.process_vision,
+    }
+    start = time.perf_counter()
+    for kind, payload in payloads:
+        handlers[kind](json.loads(payload.decode())).to_line_protocol().encode()
+    return time.perf_counter() - start
+
+
+def run_line_path(payloads):
+    handlers = {
+        'temperature': line_protocol.encode_temperature,
+        'display': line_protocol.encode_display,
+        'vision': line_protocol.encode_vision,
+    }
+    start = time.perf_counter()
+    for kind, payload in payloads:
+        handlers[kind](line_protocol.loads(payload))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    payloads = make_payloads(args.messages)
+    decoder = "orjson" if line_protocol.orjson else "json"
+
+    results = {}
+    for name, runner in (('point', run_point_path), ('line', run_line_path)):
+        best = min(runner(payloads) for _ in range(args.repeat))
+        results[name] = args.messages / best
+        print(f"{name:>6}: {results[name]:>12,.0f} msgs/s")
+
+    print(f"speedup: {results['line'] / results['point']:.1f}x (decoder: {decoder})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Время постобработки детекций на кадр: цикл по рамкам (прежний process_predictions)
+против векторного summarize_predictions.
+
+Рамки синтетические, в формате ultralytics Boxes (x1, y1, x2, y2, conf, cls);
+если ultralytics установлен, используется его класс Boxes и тензоры torch, как
+в реальном инференсе, иначе - совместимая замена на numpy. Порог min_score
+отсекает около половины рамок.
+
+Запуск: python bench_postprocess.py [--objects 10 100 300 1000] [--frames 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from video_tracking import summarize_predictions
+
+NAMES = {i: f"class_{i}" for i in range(80)}
+
+try:
+    import torch
+    from ultralytics.engine.results import Boxes
+except ImportError:
+    torch = None
+
+    class Boxes:
+        """Замена ultralytics Boxes: индексирование создаёт новый объект, как в оригинале"""
+
+        def __init__(self, boxes, orig_shape):
+            self.data = boxes[None, :] if boxes.ndim == 1 else boxes
+            self.orig_shape = orig_shape
+
+        def __len__(self):
+            return len(self.data)
+
+        def __getitem__(self, index):
+            return Boxes(self.data[index], self.orig_shape)
+
+        @property
+        def xyxy(self):
+            return self.data[:, :4]
+
+        @property
+        def conf(self):
+            return self.data[:, -2]
+
+        @property
+        def cls(self):
+            return self.data[:, -1]
+
+
+class Prediction:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.names = NAMES
+
+
+def make_predictions(objects, frames, seed=0):
+    rng = np.random.default_rng(seed)
+    predictions = []
+    for _ in range(frames):
+        corners = np.sort(rng.uniform(0, 640, (objects, 2, 2)), axis=1).reshape(objects, 4)
+        conf = rng.uniform(0.0, 1.0, (objects, 1))
+        cls = rng.integers(0, len(NAMES), (objects, 1))
+        data = np.hstack((corners, conf, cls)).astype(np.float32)
+        if torch is not None:
+            data = torch.from_numpy(data)
+        predictions.append([Prediction(Boxes(data, (480, 640)))])
+    return predictions
+
+
+def loop_predictions(predictions, min_score):
+    """Прежняя логика: обращение к тензорам на каждую рамку"""
+    data = {}
+    detections = []
+
+    for pred in predictions:
+        boxes = pred.boxes
+        for box in boxes:
+            score = float(box.conf[0])
+            if score < min_score:
+                continue
+
+            coords = map(int, box.xyxy[0])
+            x1, y1, x2, y2 = coords
+            class_id = int(box.cls[0])
+            label = pred.names[class_id]
+
+            data[label] = data.get(label, 0) + 1
+            detections.append((x1, y1, x2, y2, class_id, label, score))
+
+    return data, detections
+
+
+def measure(runner, frames):
+    start = time.perf_counter()
+    for predictions in frames:
+        runner(predictions)
+    return (time.perf_counter() - start) * 1000 / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, nargs='+', default=[10, 100, 300, 1000],
+                        help="рамок на кадр до порога")
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--min-score', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"boxes: {'ultralytics + torch' if torch is not None else 'numpy stand-in'}")
+    for objects in args.objects:
+        frames = make_predictions(objects, args.frames)
+
+        # Результаты должны совпадать (порядок меток в словаре не важен)
+        old_data, old_detections = loop_predictions(frames[0], args.min_score)
+        new_data, new_detections = summarize_predictions(frames[0], args.min_score)
+        assert old_data == new_data and len(old_detections) == len(new_detections)
+        assert all(a[:6] == b[:6] and abs(a[6] - b[6]) < 1e-6 for a, b in zip(old_detections, new_detections))
+
+        loop_ms = measure(lambda p: loop_predictions(p, args.min_score), frames)
+        vector_ms = measure(lambda p: summarize_predictions(p, args.min_score), frames)
+        counts_ms = measure(lambda p: summarize_predictions(p, args.min_score, boxes=False), frames)
+        print(f"{objects:>5} boxes: loop {loop_ms:.3f} ms/frame, vectorized {vector_ms:.3f} ms/frame "
+              f"({loop_ms / vector_ms:.0f}x), counts only {counts_ms:.3f} ms/frame ({loop_ms / counts_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
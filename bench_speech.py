@@ -0,0 +1,288 @@
+"""Бенчмарк речевого конвейера AudioProcessor: RTF, задержка, память и WER.
+
+Записи с польской речью подаются в audio_callback блоками по CHUNK отсчётов
+из потока-имитатора вместо sd.InputStream (с темпом реального времени или
+быстрее, --speed), MQTT заменён заглушкой. Работает process_audio как есть:
+кольцевой буфер, VAD, движок, при --streaming - промежуточные результаты.
+
+Каталог --fixtures: пары запись.wav / запись.txt (эталонный текст). Каждая
+конфигурация выполняется в отдельном процессе (spawn), поэтому пиковый RSS
+относится к ней одной. Сеть не нужна: модели whisper должны быть в кэше
+(~/.cache/whisper), faster-whisper читается из models/.
+
+    python bench_speech.py --fixtures fixtures/pl
+    python bench_speech.py --fixtures fixtures/pl --configs whisper:base faster-whisper:int8 \\
+        --streaming --output bench_results/speech.json
+
+Метрики:
+  RTF           - время распознавания / длительность аудио;
+  capture->publish - от подачи последнего отсчёта речи во фразе до публикации итогового
+                  текста (включает ожидание VAD_HANGOVER_MS);
+  first word    - от начала речи до первой публикации (только --streaming);
+  WER           - доля ошибок по словам относительно эталона (после нормализации).
+"""
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from audio_files import read_audio
+from bench_ingest import git_commit, peak_rss_mb, percentile
+from bench_transcription import engine_options
+
+RATE = 16000
+CHUNK = 1024 * 2
+# Тишина после каждой записи, чтобы VAD закрыл последнюю фразу
+TAIL_SECONDS = 2.0
+
+
+def normalize_words(text: str) -> List[str]:
+    return re.sub(r"[^\w\s]", ' ', text.lower()).split()
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """Расстояние Левенштейна по словам (замены, вставки, удаления)"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1]
+
+
+def load_fixtures(directory: str) -> List[Tuple[str, str, str]]:
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        reference = os.path.join(directory, stem + '.txt')
+        if ext.lower() in ('.wav', '.flac') and os.path.exists(reference):
+            with open(reference, encoding='utf-8') as f:
+                fixtures.append((stem, os.path.join(directory, name), f.read().strip()))
+    return fixtures
+
+
+class StubMQTT:
+    """Заглушка paho-клиента: запоминает публикации с моментом отправки"""
+
+    def __init__(self):
+        self.messages: List[Tuple[float, str, bool]] = []
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self._lock:
+            self.messages.append((time.monotonic(), json.loads(payload)["text"], retain))
+        return SimpleNamespace(rc=0)
+
+    def final_texts(self, since: int) -> List[str]:
+        with self._lock:
+            return [text for _, text, final in self.messages[since:] if final]
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class TimedEngine:
+    """Обёртка движка с подсчётом времени распознавания"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.seconds = 0.0
+
+    def transcribe(self, audio, language="pl", initial_prompt=None):
+        start = time.perf_counter()
+        try:
+            return self.engine.transcribe(audio, language=language, initial_prompt=initial_prompt)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def describe(self):
+        return self.engine.describe()
+
+
+class FakeAudioSource:
+    """Подача записи в audio_callback блоками CHUNK с заданным темпом"""
+
+    def __init__(self, processor, speed: float):
+        self.processor = processor
+        self.speed = speed
+        self.positions: List[int] = []
+        self.times: List[float] = []
+        self.position = 0
+
+    def capture_time(self, position: int) -> float:
+        """Момент подачи блока, содержащего отсчёт position"""
+        index = bisect.bisect_left(self.positions, position)
+        return self.times[min(index, len(self.times) - 1)]
+
+    def play(self, audio: np.ndarray):
+        block_time = CHUNK / RATE / self.speed
+        next_block = time.monotonic()
+        for start in range(0, len(audio), CHUNK):
+            block = audio[start:start + CHUNK]
+            self.processor.audio_callback(block.reshape(-1, 1), len(block), None, None)
+            self.position += len(block)
+            self.positions.append(self.position)
+            self.times.append(time.monotonic())
+            next_block += block_time
+            delay = next_block - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def wait_idle(processor, busy: threading.Event, timeout: float = 600.0):
+    """Ожидание, пока process_audio разберёт буфер и распознает последнюю фразу"""
+    def idle():
+        return (processor.audio_buffer.available < processor.segmenter.frame_size
+                and not processor.segmenter.in_speech and not busy.is_set())
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # Повторная проверка: фраза могла закрыться, но ещё не попасть в распознавание
+        if idle():
+            time.sleep(0.2)
+            if idle():
+                return
+        time.sleep(0.05)
+
+
+def run_config(config: str, fixtures: List[Tuple[str, str, str]], speed: float,
+               streaming: bool, threads: int, beam_size: int) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе"""
+    os.environ['SPEECH_STREAMING'] = "1" if streaming else "0"
+    os.environ['SEGMENTATION'] = "vad"
+    os.environ.setdefault('SPEECH_STATS_INTERVAL', "3600")
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    import speech_processor
+    from transcription_engines import create_engine
+
+    options = engine_options(config, threads, beam_size)
+    engine = TimedEngine(create_engine(options.pop('name'), **options))
+    mqtt_client = StubMQTT()
+    processor = speech_processor.AudioProcessor(engine=engine, mqtt_client=mqtt_client)
+    source = FakeAudioSource(processor, speed)
+
+    latencies: List[float] = []
+    busy = threading.Event()
+    transcribe_utterance = processor.transcribe_utterance
+
+    def timed_utterance(utterance):
+        busy.set()
+        try:
+            # Последний отсчёт речи: конец фразы без тишины VAD_HANGOVER_MS
+            speech_end = utterance.end
+            if not utterance.forced:
+                speech_end -= processor.segmenter.hangover_frames * processor.segmenter.frame_size
+            captured = source.capture_time(speech_end)
+            published_before = len(mqtt_client.messages)
+            transcribe_utterance(utterance)
+            if len(mqtt_client.messages) > published_before:
+                latencies.append(time.monotonic() - captured)
+        finally:
+            busy.clear()
+
+    processor.transcribe_utterance = timed_utterance
+    worker = threading.Thread(target=processor.process_audio, daemon=True)
+    worker.start()
+
+    audio_seconds = 0.0
+    errors = reference_words = 0
+    per_fixture = []
+    tail = np.zeros(int(RATE * TAIL_SECONDS), dtype=np.float32)
+    for name, path, reference in fixtures:
+        audio = read_audio(path, RATE)
+        audio_seconds += len(audio) / RATE
+        since = len(mqtt_client.messages)
+        source.play(audio)
+        source.play(tail)
+        wait_idle(processor, busy)
+
+        hypothesis = ' '.join(mqtt_client.final_texts(since))
+        ref = normalize_words(reference)
+        fixture_errors = word_errors(ref, normalize_words(hypothesis))
+        errors += fixture_errors
+        reference_words += len(ref)
+        per_fixture.append({'fixture': name, 'wer': fixture_errors / max(len(ref), 1), 'text': hypothesis})
+
+    processor.running = False
+    worker.join(timeout=5)
+    first_word = processor.streamer.first_word_latency if processor.streamer is not None else None
+
+    return {
+        'config': config,
+        'engine': engine.describe(),
+        'streaming': streaming,
+        'audio_seconds': audio_seconds,
+        'rtf': engine.seconds / audio_seconds if audio_seconds else 0.0,
+        'latency_s': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0),
+        },
+        'first_word_p50_s': first_word.quantile(0.5) if first_word is not None else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'wer': errors / max(reference_words, 1),
+        'fixtures': per_fixture,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', required=True, help="каталог с парами .wav/.txt")
+    parser.add_argument('--configs', nargs='+', default=['whisper:base', 'faster-whisper:int8'])
+    parser.add_argument('--speed', type=float, default=1.0, help="темп подачи относительно реального времени")
+    parser.add_argument('--streaming', action='store_true', help="SPEECH_STREAMING=1")
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--beam-size', type=int, default=1)
+    parser.add_argument('--output', help="JSON с результатами")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No .wav/.txt pairs in {args.fixtures}")
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for config in args.configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result = pool.submit(run_config, config, fixtures, args.speed, args.streaming,
+                                     args.threads, args.beam_size).result()
+            except Exception as e:
+                print(f"{config:>28}: failed: {e}")
+                continue
+        results.append(result)
+        latency = result['latency_s']
+        line = (f"{config:>28}: RTF {result['rtf']:.3f}, WER {result['wer']:.1%}, "
+                f"capture->publish p50 {latency['p50']:.2f} s p90 {latency['p90']:.2f} s "
+                f"p99 {latency['p99']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+        if result['first_word_p50_s'] is not None:
+            line += f", first word p50 <= {result['first_word_p50_s']:.2f} s"
+        print(line)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.time(), 'config': vars(args),
+                       'results': results}, f, indent=2, ensure_ascii=False)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Сравнение движков распознавания на одном аудио: real-time factor и память.
+
+Каждая конфигурация запускается в отдельном процессе (spawn), чтобы пиковый
+RSS относился только к её модели и библиотекам. Время загрузки модели не
+входит в RTF; первый проход на 1 с аудио - прогрев.
+
+Конфигурация: движок[:параметр], для whisper параметр - модель, для
+faster-whisper - compute_type.
+
+    python bench_transcription.py --audio sample_pl.wav
+    python bench_transcription.py --audio sample_pl.wav \\
+        --configs whisper:base faster-whisper:int8 faster-whisper:int8_float16 --threads 4 --beam-size 1
+
+RTF = время распознавания / длительность аудио (меньше 1 - быстрее реального времени).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+from audio_files import read_audio
+from bench_ingest import current_rss_mb, git_commit, peak_rss_mb
+
+RATE = 16000
+
+
+def engine_options(config: str, threads: int, beam_size: int) -> Dict[str, Any]:
+    name, _, param = config.partition(':')
+    options: Dict[str, Any] = {'cpu_threads': threads, 'beam_size': beam_size}
+    if param:
+        options['model_name' if name == 'whisper' else 'compute_type'] = param
+    return dict(options, name=name)
+
+
+def run_config(config: str, audio_path: str, threads: int, beam_size: int, repeat: int,
+               language: str) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе"""
+    from transcription_engines import create_engine
+
+    if threads:
+        # openai-whisper считает на torch, число потоков задаётся здесь
+        os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+    audio = read_audio(audio_path, RATE)
+    rss_before = current_rss_mb()
+
+    options = engine_options(config, threads, beam_size)
+    start = time.perf_counter()
+    engine = create_engine(options.pop('name'), **options)
+    load_time = time.perf_counter() - start
+    rss_loaded = current_rss_mb()
+
+    engine.transcribe(audio[:RATE], language=language)
+
+    durations = []
+    text = ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = engine.transcribe(audio, language=language)
+        durations.append(time.perf_counter() - start)
+
+    audio_seconds = len(audio) / RATE
+    return {
+        'config': config,
+        'engine': engine.describe(),
+        'audio_seconds': audio_seconds,
+        'load_seconds': load_time,
+        'rtf_best': min(durations) / audio_seconds,
+        'rtf_mean': sum(durations) / len(durations) / audio_seconds,
+        'model_rss_mb': rss_loaded - rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+        'text': text.strip(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', required=True, help="WAV/FLAC с речью")
+    parser.add_argument('--configs', nargs='+', default=['whisper:base', 'faster-whisper:int8'])
+    parser.add_argument('--threads', type=int, default=0, help="потоки CPU, 0 - по умолчанию движка")
+    parser.add_argument('--beam-size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--language', default="pl")
+    parser.add_argument('--output', help="JSON с результатами")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for config in args.configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result = pool.submit(run_config, config, args.audio, args.threads, args.beam_size,
+                                     args.repeat, args.language).result()
+            except Exception as e:
+                print(f"{config:>28}: failed: {e}")
+                continue
+        results.append(result)
+        print(f"{config:>28}: RTF {result['rtf_best']:.3f} (mean {result['rtf_mean']:.3f}), "
+              f"load {result['load_seconds']:.1f} s, model {result['model_rss_mb']:.0f} MB, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        print(f"{'':>28}  {result['text'][:100]}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.time(),
+                       'config': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Бенчмарк конвейера VideoAnalyzer на записанных роликах: время стадий, FPS, CPU и память.
+
+Ролики (--clips, по источнику на ролик) подаются в VideoAnalyzer вместо камеры
+с темпом --fps кадров в секунду (0 - без ограничения: каждый кадр читается,
+как только конвейер забрал предыдущий, без потерь). MQTT заменён заглушкой,
+окна нет, но кадры рисуются, как на машине с монитором (--headless - без
+отрисовки). Детектор движения работает как в VideoAnalyzer, --no-gate -
+детекция на каждом кадре. Камера не нужна.
+
+Конфигурация детектора - backend:imgsz[:int8] (см. detector_backends.py),
+перебираются все сочетания --models x --configs; каждое выполняется в
+отдельном процессе (spawn), поэтому CPU и пиковый RSS относятся к нему одному.
+
+    python bench_video.py --clips fixtures/street.mp4
+    python bench_video.py --clips fixtures/street.mp4 fixtures/yard.mp4 --fps 15 \\
+        --models yolov8n.pt yolov8s.pt --configs torch:640 openvino:416:int8 \\
+        --output bench_results/video.json
+
+Стадии (мс на кадр, p50/p95/p99):
+  convert     - cvtColor BGR->RGB;
+  inference   - детектор (время пакета / размер пакета);
+  postprocess - порог и подсчёт объектов;
+  draw        - рамки, подписи и счётчики на кадре;
+  publish     - send_data (сериализация и постановка в очередь публикатора, MQTT - заглушка);
+  frame_age   - от захвата кадра до готового результата.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from bench_detector import parse_config
+from bench_ingest import git_commit, peak_rss_mb, percentile
+from video_pipeline import StageTimings
+
+STAGES = ('capture', 'convert', 'inference', 'batch', 'postprocess', 'draw', 'publish', 'frame_age')
+
+
+class StubMQTT:
+    """Заглушка paho-клиента: считает публикации"""
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+        return SimpleNamespace(rc=0)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class RecordingTimings(StageTimings):
+    """StageTimings, сохраняющий все значения - для точных перцентилей"""
+
+    def __init__(self):
+        super().__init__()
+        self.values: Dict[str, List[float]] = {}
+        self._values_lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        super().observe(stage, seconds)
+        with self._values_lock:
+            self.values.setdefault(stage, []).append(seconds)
+
+
+class PacedCapture:
+    """Чтение ролика с темпом fps, repeat раз подряд.
+
+    fps=0 - без ограничения и без потерь: следующий кадр читается, когда
+    конвейер забрал предыдущий (wait).
+    """
+
+    def __init__(self, path: str, fps: float, repeat: int, wait=None):
+        import cv2
+
+        self.cv2 = cv2
+        self.path = path
+        self.interval = 1.0 / fps if fps else 0.0
+        self.repeat = repeat
+        self.wait = wait
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise FileNotFoundError(f"Cannot open video: {path}")
+        self.next_frame = time.monotonic()
+
+    def read(self):
+        if self.interval:
+            delay = self.next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # Отставание не накапливается: темп считается от фактического чтения
+            self.next_frame = max(self.next_frame, time.monotonic() - self.interval) + self.interval
+        elif self.wait is not None:
+            self.wait()
+        success, frame = self.video.read()
+        if not success and self.repeat > 1:
+            self.repeat -= 1
+            self.video.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.video.read()
+        return success, frame
+
+    def set(self, *args):
+        return self.video.set(*args)
+
+    def release(self):
+        self.video.release()
+
+
+def run_config(model: str, config: str, clips: List[str], fps: float, repeat: int,
+               headless: bool, motion_gate: bool, threads: int) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе"""
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    from detector_backends import Detector
+    from video_to_text import VideoAnalyzer
+
+    options = parse_config(config)
+    detector = Detector(model, **options)
+    client = StubMQTT()
+    analyzer = VideoAnalyzer(client=client, detector=detector, sources=clips, headless=headless,
+                             motion_gate=motion_gate, display=False, stats_interval=3600)
+    analyzer.timings = RecordingTimings()
+    for source in analyzer.sources:
+        source.video.release()
+        source.video = PacedCapture(source.uri, fps, repeat,
+                                    wait=lambda source=source: analyzer.frame_slot.wait_taken(source))
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    start = time.monotonic()
+    # Завершается, когда закончатся все ролики
+    analyzer.run()
+    wall = time.monotonic() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - cpu_start
+
+    stats = analyzer.stats()
+    processed = sum(source.frames for source in analyzer.sources)
+    stages = {}
+    for stage in STAGES:
+        values = analyzer.timings.values.get(stage)
+        if values:
+            stages[stage] = {
+                'p50_ms': percentile(values, 0.5) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'count': len(values),
+            }
+    return {
+        'model': model,
+        'config': config,
+        'backend': options['backend'],
+        'imgsz': options['imgsz'],
+        'int8': options['int8'],
+        'detector': detector.describe(),
+        'sources': len(clips),
+        'wall_s': wall,
+        'frames_captured': stats['frames_captured'],
+        'frames_processed': processed,
+        'frames_dropped': stats['frames_dropped'],
+        'fps': processed / wall if wall else 0.0,
+        'batch_size': stats['batch_size'],
+        'cpu_cores': cpu / wall if wall else 0.0,
+        'cpu_percent': cpu / wall / (os.cpu_count() or 1) * 100 if wall else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'published': client.published,
+        'mqtt': stats['mqtt'],
+        'gate_skipped_ratio': stats['gate']['skipped_ratio'] if 'gate' in stats else None,
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', nargs='+', required=True, help="видеофайлы, по источнику на файл")
+    parser.add_argument('--fps', type=float, default=0.0, help="темп подачи кадров, 0 - без ограничения")
+    parser.add_argument('--repeat', type=int, default=1, help="сколько раз проиграть ролики")
+    parser.add_argument('--models', nargs='+', default=['yolov8n.pt'])
+    parser.add_argument('--configs', nargs='+', default=['torch:640'], help="backend:imgsz[:int8]")
+    parser.add_argument('--headless', action='store_true', help="без отрисовки кадров")
+    parser.add_argument('--no-gate', action='store_true', help="детекция на каждом кадре")
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--output', help="JSON с результатами")
+    args = parser.parse_args()
+
+    for clip in args.clips:
+        if not os.path.exists(clip):
+            raise SystemExit(f"No such clip: {clip}")
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for model in args.models:
+        for config in args.configs:
+            name = f"{os.path.basename(model)} {config}"
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result = pool.submit(run_config, model, config, args.clips, args.fps, args.repeat,
+                                         args.headless, not args.no_gate, args.threads).result()
+                except Exception as e:
+                    print(f"{name:>32}: failed: {e}")
+                    continue
+            results.append(result)
+            stages = ', '.join(f"{stage} p50 {s['p50_ms']:.1f} p95 {s['p95_ms']:.1f} p99 {s['p99_ms']:.1f} ms"
+                               for stage, s in result['stages'].items())
+            print(f"{name:>32}: {result['fps']:.1f} FPS ({result['frames_processed']}/{result['frames_captured']} "
+                  f"frames), CPU {result['cpu_cores']:.2f} cores, peak RSS {result['peak_rss_mb']:.0f} MB")
+            print(f"{'':>32}  {stages}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.time(), 'config': vars(args),
+                       'results': results}, f, indent=2)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+# Бэкенд детектора: torch (веса .pt как есть), onnx (ONNX Runtime) или openvino.
+# Экспорт выполняется один раз, результат кэшируется в DETECTOR_CACHE_DIR
+DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', "torch")
+DETECTOR_IMGSZ = int(os.getenv('DETECTOR_IMGSZ', "640"))
+DETECTOR_INT8 = os.getenv('DETECTOR_INT8', "0") == "1"
+DETECTOR_CACHE_DIR = os.getenv('DETECTOR_CACHE_DIR', os.path.join(MODELS_DIR, "exported"))
+# Калибровочный набор для int8 OpenVINO (NNCF), формат датасета ultralytics
+DETECTOR_CALIBRATION_DATA = os.getenv('DETECTOR_CALIBRATION_DATA', "coco8.yaml")
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def export_path(model_file: str, backend: str, imgsz: int, int8: bool,
+                cache_dir: str = DETECTOR_CACHE_DIR) -> str:
+    """Путь экспортированной модели в кэше: имя весов, размер входа, квантование"""
+    stem = os.path.splitext(os.path.basename(model_file))[0]
+    name = f"{stem}_{imgsz}{'_int8' if int8 else ''}"
+    if backend == 'onnx':
+        return os.path.join(cache_dir, name + ".onnx")
+    return os.path.join(cache_dir, name + "_openvino_model")
+
+
+def _quantize_onnx(source: str, target: str):
+    """Динамическое int8-квантование весов (без калибровочного набора)"""
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    # Метаданные ultralytics (имена классов, imgsz) - в квантованную модель
+    quantized = onnx.load(target)
+    if not quantized.metadata_props:
+        quantized.metadata_props.extend(onnx.load(source).metadata_props)
+        onnx.save(quantized, target)
+
+
+def export_model(model_file: str, backend: str, imgsz: int = 640, int8: bool = False,
+                 cache_dir: str = DETECTOR_CACHE_DIR, calibration_data: str = DETECTOR_CALIBRATION_DATA) -> str:
+    """Экспорт весов .pt в ONNX/OpenVINO; готовый файл из кэша используется повторно.
+
+    Кэш считается устаревшим, если веса новее экспортированной модели.
+    """
+    target = export_path(model_file, backend, imgsz, int8, cache_dir)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(model_file):
+        return target
+
+    from ultralytics import YOLO
+
+    os.makedirs(cache_dir, exist_ok=True)
+    logging.info(f"Exporting {model_file} to {backend} (imgsz={imgsz}, int8={int8})...")
+    start = time.monotonic()
+    # dynamic - переменный размер пакета (несколько камер в одном вызове детектора)
+    options = {'imgsz': imgsz, 'dynamic': True}
+    if backend == 'openvino' and int8:
+        options.update(int8=True, data=calibration_data)
+    exported = YOLO(model_file).export(format=backend, **options)
+
+    # ultralytics пишет результат рядом с весами - переносим в кэш под своим именем
+    temporary = target + ".tmp"
+    if backend == 'onnx' and int8:
+        _quantize_onnx(exported, temporary)
+        os.remove(exported)
+    else:
+        shutil.move(exported, temporary)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(temporary, target)
+    logging.info(f"Exported {target} in {time.monotonic() - start:.1f}s")
+    return target
+
+
+class Detector:
+    """YOLO с выбранным бэкендом; вызывается как модель ultralytics: detector(frames, verbose=False).
+
+    Для onnx/openvino веса экспортируются при первом запуске (export_model),
+    после загрузки выполняется прогрев - первые кадры не ждут инициализации бэкенда.
+    """
+
+    def __init__(self, model_file: str = 'yolov8n.pt', backend: str = 'torch', imgsz: int = 640,
+                 int8: bool = False, cache_dir: str = DETECTOR_CACHE_DIR, warmup: int = 2):
+        from ultralytics import YOLO
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown detector backend: {backend}")
+        if backend == 'torch' and int8:
+            logging.warning("int8 is only supported by onnx/openvino backends, using float32")
+            int8 = False
+
+        self.model_file = model_file
+        self.backend = backend
+        self.imgsz = imgsz
+        self.int8 = int8
+        path = model_file if backend == 'torch' else export_model(model_file, backend, imgsz, int8, cache_dir)
+        start = time.monotonic()
+        self.model = YOLO(path, task='detect')
+        self.load_seconds = time.monotonic() - start
+        self.warmup_seconds = self.warmup(warmup) if warmup else 0.0
+        logging.info(f"Detector {self.describe()}: loaded in {self.load_seconds:.1f}s, "
+                     f"warmup {self.warmup_seconds:.1f}s")
+
+    def __call__(self, frames, **options):
+        options.setdefault('imgsz', self.imgsz)
+        return self.model(frames, **options)
+
+    def warmup(self, runs: int = 2) -> float:
+        """runs прогонов на пустом кадре; возвращает затраченное время"""
+        frame = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        start = time.monotonic()
+        for _ in range(runs):
+            self(frame, verbose=False)
+        return time.monotonic() - start
+
+    def describe(self) -> str:
+        return f"{self.backend}:{os.path.basename(self.model_file)} imgsz={self.imgsz}{' int8' if self.int8 else ''}"
+
+
+def create_detector_from_env(model_file: str = 'yolov8n.pt', **overrides) -> Detector:
+    """Детектор с параметрами из окружения (DETECTOR_BACKEND, DETECTOR_IMGSZ, DETECTOR_INT8)"""
+    options = {
+        'backend': DETECTOR_BACKEND,
+        'imgsz': DETECTOR_IMGSZ,
+        'int8': DETECTOR_INT8,
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return Detector(model_file, **options)
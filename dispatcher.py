@@ -0,0 +1,292 @@
+import json
+import logging
+import queue
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import MetricsRegistry
+
+EXECUTION_MODES = ('thread', 'process')
+
+# Быстрое извлечение идентификатора устройства без полного разбора JSON
+_DEVICE_RE = re.compile(rb'"device(?:_id)?"\s*:\s*"([^"]*)"')
+
+_STOP = object()
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """Сопоставление топика с фильтром MQTT (+ и #)"""
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def run_handler(handler: Callable[[Dict[str, Any]], Any], payload: bytes,
+                decode: Callable[[bytes], Any] = json.loads,
+                return_data: bool = False) -> Tuple[float, Any, Any]:
+    """Декодирование и обработка сообщения (выполняется в пуле).
+
+    Возвращает момент окончания декодирования (time.monotonic, общий для процессов),
+    результат и, если return_data, декодированное сообщение для наблюдателей.
+    """
+    data = decode(payload)
+    return time.monotonic(), handler(data), data if return_data else None
+
+
+def run_batch(items: List[Tuple[Callable[[Dict[str, Any]], Any], bytes]],
+              decode: Callable[[bytes], Any] = json.loads,
+              return_data: bool = False) -> List[Tuple[Optional[str], Any]]:
+    """run_handler для пакета сообщений за один вызов процесса.
+
+    Ошибка одного сообщения не прерывает пакет: для каждого сообщения
+    (None, результат run_handler) или (тип исключения, текст).
+    """
+    outcomes = []
+    for handler, payload in items:
+        try:
+            outcomes.append((None, run_handler(handler, payload, decode, return_data)))
+        except Exception as e:
+            outcomes.append((type(e).__name__, str(e)))
+    return outcomes
+
+
+class MessageDispatcher:
+    """Распределение сообщений MQTT по пулу обработчиков с сохранением порядка по устройству"""
+
+    def __init__(self,
+                 sink: Callable[[Any], bool],
+                 workers: int = 4,
+                 mode: str = 'thread',
+                 queue_size: int = 10000,
+                 decode: Callable[[bytes], Any] = json.loads,
+                 metrics: Optional[MetricsRegistry] = None,
+                 batch_size: int = 256):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {mode}")
+
+        self.sink = sink
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.queue_size = queue_size
+        # Режим process: сообщений шарда за один обмен с процессом (сериализация и IPC
+        # на пакет, а не на сообщение)
+        self.batch_size = max(1, batch_size)
+        self.decode = decode
+        self.registry = metrics
+
+        self._handlers: Dict[str, Tuple[Callable[[Dict[str, Any]], Any], bool]] = {}
+        self._resolved: Dict[str, Optional[Tuple[Callable[[Dict[str, Any]], Any], bool]]] = {}
+        self._lock = threading.Lock()
+        self._queues: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        self._executors: List[ProcessPoolExecutor] = []
+        self._observers: List[Callable[[str, Any], None]] = []
+
+        self.metrics = {
+            'messages_received': 0,
+            'messages_processed': 0,
+            'messages_dropped': 0,
+            'messages_unhandled': 0,
+            'handler_errors': 0,
+            'sink_rejected': 0,
+            'messages_skipped': 0,
+        }
+
+    def register(self, topic: str, handler: Callable[[Dict[str, Any]], Any], local: bool = False):
+        """Регистрация обработчика для топика или фильтра с + и #.
+
+        local=True - обработчик со своим состоянием, всегда выполняется в потоке шарда,
+        даже в режиме process.
+        """
+        with self._lock:
+            self._handlers[topic] = (handler, local)
+            self._resolved.clear()
+
+    def add_observer(self, observer: Callable[[str, Any], None]):
+        """Наблюдатель получает (топик, декодированное сообщение) в потоке шарда"""
+        self._observers.append(observer)
+
+    def handler(self, topic: str, local: bool = False):
+        """Декоратор для регистрации обработчика"""
+        def decorator(func):
+            self.register(topic, func, local)
+            return func
+        return decorator
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self._handlers)
+
+    def resolve(self, topic: str) -> Optional[Tuple[Callable[[Dict[str, Any]], Any], bool]]:
+        """Поиск обработчика: точное совпадение, затем фильтры"""
+        try:
+            return self._resolved[topic]
+        except KeyError:
+            pass
+
+        handler = self._handlers.get(topic)
+        if handler is None:
+            for pattern, candidate in self._handlers.items():
+                if topic_matches(pattern, topic):
+                    handler = candidate
+                    break
+        self._resolved[topic] = handler
+        return handler
+
+    def start(self):
+        """Запуск рабочих потоков (и процессов в режиме process)"""
+        for i in range(self.workers):
+            shard_queue = queue.Queue(maxsize=self.queue_size)
+            executor = None
+            if self.mode == 'process':
+                # Один процесс на шард сохраняет порядок сообщений внутри шарда
+                executor = ProcessPoolExecutor(max_workers=1)
+                self._executors.append(executor)
+            thread = threading.Thread(target=self._worker, args=(shard_queue, executor),
+                                      name=f"dispatch-{i}", daemon=True)
+            self._queues.append(shard_queue)
+            self._threads.append(thread)
+            thread.start()
+        logging.info(f"Dispatcher started: {self.workers} {self.mode} workers")
+
+    def shard_for(self, topic: str, payload: bytes) -> int:
+        """Выбор шарда по device_id, для сообщений без устройства - по топику"""
+        match = _DEVICE_RE.search(payload)
+        key = match.group(1) if match else topic.encode()
+        return zlib.crc32(key) % self.workers
+
+    def submit(self, topic: str, payload: bytes, received: Optional[float] = None) -> bool:
+        """Дешёвая постановка сообщения в очередь (вызывается из потока paho)"""
+        received = time.monotonic() if received is None else received
+        self.metrics['messages_received'] += 1
+        entry = self.resolve(topic)
+        if entry is None:
+            self.metrics['messages_unhandled'] += 1
+            return False
+
+        shard = self.shard_for(topic, payload)
+        try:
+            self._queues[shard].put_nowait((entry, topic, payload, received))
+            return True
+        except queue.Full:
+            self.metrics['messages_dropped'] += 1
+            if self.registry:
+                self.registry.inc('errors_total', stage='dispatch', type='QueueFull')
+            return False
+
+    def _take(self, shard_queue: queue.Queue) -> Tuple[List[tuple], bool]:
+        """Ожидание сообщения и всё, что уже накопилось в очереди (до batch_size)"""
+        items = []
+        item = shard_queue.get()
+        while item is not _STOP:
+            items.append(item)
+            if len(items) >= self.batch_size:
+                return items, False
+            try:
+                item = shard_queue.get_nowait()
+            except queue.Empty:
+                return items, False
+        return items, True
+
+    def _worker(self, shard_queue: queue.Queue, executor: Optional[ProcessPoolExecutor]):
+        observe = bool(self._observers)
+        stopping = False
+        while not stopping:
+            items, stopping = self._take(shard_queue)
+            start = 0
+            while start < len(items):
+                # Подряд идущие сообщения для процесса - одним вызовом, порядок шарда сохраняется
+                end = start
+                if executor is not None:
+                    while end < len(items) and not items[end][0][1]:
+                        end += 1
+                if end == start:
+                    # Режим thread или local-обработчик - в потоке шарда
+                    (handler, _), _, payload, _ = items[start]
+                    try:
+                        outcome = (None, run_handler(handler, payload, self.decode, observe))
+                    except Exception as e:
+                        outcome = (type(e).__name__, str(e))
+                    self._finish(items[start], outcome)
+                    start += 1
+                    continue
+                batch = [(handler, payload) for (handler, _), _, payload, _ in items[start:end]]
+                try:
+                    outcomes = executor.submit(run_batch, batch, self.decode, observe).result()
+                except Exception as e:
+                    outcomes = [(type(e).__name__, str(e))] * len(batch)
+                for item, outcome in zip(items[start:end], outcomes):
+                    self._finish(item, outcome)
+                start = end
+
+    def _finish(self, item: tuple, outcome: Tuple[Optional[str], Any]):
+        """Метрики, наблюдатели и запись результата одного сообщения"""
+        _, topic, _, received = item
+        error, value = outcome
+        if error is not None:
+            self._count('handler_errors')
+            if self.registry:
+                self.registry.inc('errors_total', stage='handler', type=error)
+            logging.error(f"Message processing error: {value}")
+            return
+        decoded, result, data = value
+
+        if self.registry:
+            processed = time.monotonic()
+            self.registry.observe('stage_latency_seconds', decoded - received, topic=topic, stage='decode')
+            self.registry.observe('stage_latency_seconds', processed - decoded, topic=topic, stage='point')
+
+        for observer in self._observers:
+            try:
+                observer(topic, data)
+            except Exception as e:
+                logging.error(f"Observer error: {e}")
+
+        self._count('messages_processed')
+        if result is None:
+            # Обработчик не построил точку (например, nan в единственном поле)
+            self._count('messages_skipped')
+        for record in self._as_records(result):
+            if not self.sink(record, topic):
+                self._count('sink_rejected')
+
+    @staticmethod
+    def _as_records(result: Any) -> Tuple[Any, ...]:
+        if result is None:
+            return ()
+        if isinstance(result, (list, tuple)):
+            return tuple(result)
+        return (result,)
+
+    def _count(self, metric: str, value: int = 1):
+        with self._lock:
+            self.metrics[metric] += value
+
+    def stats(self) -> Dict[str, Any]:
+        """Снимок счётчиков и глубины очередей"""
+        with self._lock:
+            stats = dict(self.metrics)
+        depths = [q.qsize() for q in self._queues]
+        stats['queue_depth'] = sum(depths)
+        stats['max_shard_depth'] = max(depths) if depths else 0
+        return stats
+
+    def stop(self, timeout: float = 10.0):
+        """Остановка с обработкой уже поставленных сообщений"""
+        for shard_queue in self._queues:
+            shard_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        for executor in self._executors:
+            executor.shutdown(wait=True)
@@ -0,0 +1,267 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import SIZE_BUCKETS, MetricsRegistry
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+# Ответы InfluxDB, после которых повтор с теми же данными может пройти
+RETRYABLE_STATUSES = (408, 429)
+# Ошибки содержимого запроса: отвергнутые строки можно отделить от остальных делением пакета
+DATA_ERROR_STATUSES = (400, 422)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """4xx (кроме 408 и 429) - запрос не пройдёт и при повторе; ошибки соединения и 5xx временные"""
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+
+def isolate_rejected(write_fn: Callable[[List[Any]], None], batch: List[Any], error: Exception) -> List[Any]:
+    """Записи пакета, отвергнутые InfluxDB навсегда; остальные записываются.
+
+    При ошибке содержимого (400, 422) пакет делится пополам, пока отвергнутые
+    строки не будут найдены; при остальных постоянных ошибках (401, 403, ...)
+    отвергнут весь пакет. Временная ошибка по пути пробрасывается.
+    """
+    if getattr(error, 'status', None) not in DATA_ERROR_STATUSES or len(batch) == 1:
+        return list(batch)
+    rejected = []
+    middle = len(batch) // 2
+    for half in (batch[:middle], batch[middle:]):
+        try:
+            write_fn(half)
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise
+            rejected.extend(isolate_rejected(write_fn, half, e))
+    return rejected
+
+
+class BatchWriter:
+    """Буферизованная пакетная запись в InfluxDB из отдельного потока"""
+
+    def __init__(self,
+                 write_fn: Callable[[List[Any]], None],
+                 queue_size: int = 10000,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 max_retries: int = 5,
+                 retry_backoff: float = 0.5,
+                 retry_backoff_max: float = 30.0,
+                 overflow_policy: str = 'block',
+                 block_timeout: float = 5.0,
+                 spill: Optional[Callable[[List[Any]], None]] = None,
+                 reject: Optional[Callable[[List[Any]], None]] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """reject - куда деть записи, которые InfluxDB отвергает навсегда (карантин), иначе они теряются"""
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if overflow_policy == 'spill' and spill is None:
+            raise ValueError("Overflow policy 'spill' requires a spill handler")
+
+        self.write_fn = write_fn
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill = spill
+        self.reject = reject
+        self.registry = metrics
+        if metrics:
+            metrics.define('batch_size', "Records per InfluxDB write", SIZE_BUCKETS)
+            metrics.define('flush_latency_seconds', "InfluxDB batch write latency including retries")
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closing = threading.Event()
+
+        self.metrics = {
+            'records_queued': 0,
+            'records_written': 0,
+            'records_dropped': 0,
+            'records_spilled': 0,
+            'records_rejected': 0,
+            'batches_written': 0,
+            'batches_failed': 0,
+            'write_retries': 0,
+            'last_batch_size': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record: Any, tag: Optional[str] = None) -> bool:
+        """Постановка записи в очередь с учётом политики переполнения.
+
+        tag - метка (топик) для гистограммы задержки от постановки до подтверждения записи.
+        """
+        spilled = None
+        with self._lock:
+            if self._closing.is_set():
+                self.metrics['records_dropped'] += 1
+                return False
+
+            if len(self._queue) >= self.queue_size:
+                if self.overflow_policy == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.queue_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or self._closing.is_set():
+                            self.metrics['records_dropped'] += 1
+                            return False
+                        self._not_full.wait(remaining)
+                elif self.overflow_policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self.metrics['records_dropped'] += 1
+                else:
+                    spilled = [self._queue.popleft()[0]
+                               for _ in range(min(self.batch_size, len(self._queue)))]
+
+            self._queue.append((record, tag, time.monotonic()))
+            self.metrics['records_queued'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._not_empty.notify()
+
+        if spilled:
+            self._spill(spilled)
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        """Снимок счётчиков записи"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['queue_depth'] = len(self._queue)
+        batches = stats['batches_written']
+        stats['avg_batch_size'] = stats['records_written'] / batches if batches else 0.0
+        return stats
+
+    def _take_batch(self) -> List[tuple]:
+        """Ожидание пакета по размеру или по интервалу"""
+        with self._lock:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._closing.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._closing.is_set():
+                break
+
+    def _flush(self, entries: List[tuple]):
+        """Запись пакета с повторными попытками и экспоненциальной задержкой"""
+        batch = [entry[0] for entry in entries]
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_fn(batch)
+                latency = time.perf_counter() - start
+                if self.registry:
+                    self._observe_ack(entries, latency)
+                with self._lock:
+                    self.metrics['records_written'] += len(batch)
+                    self.metrics['batches_written'] += 1
+                    self.metrics['last_batch_size'] = len(batch)
+                    self.metrics['last_flush_latency'] = latency
+                    self.metrics['max_flush_latency'] = max(self.metrics['max_flush_latency'], latency)
+                return
+            except Exception as e:
+                if self.registry:
+                    self.registry.inc('errors_total', stage='write', type=type(e).__name__)
+                if is_permanent_error(e):
+                    # Повтор и журнал не помогут: отвергнутые записи - в карантин, остальные записаны
+                    try:
+                        rejected = isolate_rejected(self.write_fn, batch, e)
+                    except Exception as retry_error:
+                        e = retry_error
+                    else:
+                        with self._lock:
+                            self.metrics['records_written'] += len(batch) - len(rejected)
+                        self._reject(rejected, e)
+                        return
+                if attempt == self.max_retries:
+                    logging.error(f"Batch write failed after {attempt + 1} attempts: {e}")
+                    break
+                delay = min(self.retry_backoff * (2 ** attempt), self.retry_backoff_max)
+                logging.warning(f"Batch write error: {e}, retry in {delay:.1f}s")
+                with self._lock:
+                    self.metrics['write_retries'] += 1
+                # При остановке не ждём полную задержку, но пробуем ещё раз
+                self._closing.wait(delay)
+
+        with self._lock:
+            self.metrics['batches_failed'] += 1
+        if self.spill is not None:
+            self._spill(batch)
+        else:
+            with self._lock:
+                self.metrics['records_dropped'] += len(batch)
+
+    def _reject(self, records: List[Any], error: Exception):
+        logging.error(f"InfluxDB rejected {len(records)} records permanently: {error}")
+        with self._lock:
+            self.metrics['records_rejected'] += len(records)
+        if self.reject is None:
+            with self._lock:
+                self.metrics['records_dropped'] += len(records)
+            return
+        try:
+            self.reject(records)
+        except Exception as e:
+            logging.error(f"Quarantine error, {len(records)} records lost: {e}")
+            with self._lock:
+                self.metrics['records_dropped'] += len(records)
+
+    def _observe_ack(self, entries: List[tuple], latency: float):
+        acked = time.monotonic()
+        self.registry.observe('batch_size', len(entries))
+        self.registry.observe('flush_latency_seconds', latency)
+        for _, tag, enqueued in entries:
+            self.registry.observe('stage_latency_seconds', acked - enqueued, topic=tag or 'unknown', stage='write')
+
+    def _spill(self, batch: List[Any]):
+        try:
+            self.spill(batch)
+            with self._lock:
+                self.metrics['records_spilled'] += len(batch)
+        except Exception as e:
+            logging.error(f"Spill error, {len(batch)} records lost: {e}")
+            with self._lock:
+                self.metrics['records_dropped'] += len(batch)
+
+    def close(self, timeout: float = 10.0):
+        """Остановка с записью оставшихся данных"""
+        with self._lock:
+            self._closing.set()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"Writer did not finish in {timeout}s, {len(self._queue)} records pending")
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+SeriesKey = Tuple[str, str]
+
+
+class _Series:
+    """Кольцо последних значений одного устройства в одном топике"""
+    __slots__ = ('values', 'updated')
+
+    def __init__(self, history: int):
+        self.values = deque(maxlen=history)
+        self.updated = 0.0
+
+
+class LastValueCache:
+    """Последние значения и короткая история по (топик, устройство) в памяти.
+
+    Память ограничена: не больше max_series рядов (вытесняются давно не обновлявшиеся),
+    не больше history значений в ряду, ряды старше ttl секунд удаляются.
+    """
+
+    def __init__(self, history: int = 60, ttl: float = 3600.0, max_series: int = 10000):
+        self.history = history
+        self.ttl = ttl
+        self.max_series = max_series
+        self._series: 'OrderedDict[SeriesKey, _Series]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {
+            'updates': 0,
+            'reads': 0,
+            'evicted': 0,
+        }
+
+    @staticmethod
+    def device_of(data: Dict[str, Any]) -> str:
+        """Идентификатор источника: device для сенсоров, source для камер"""
+        return str(data.get("device") or data.get("source") or "default")
+
+    def observe(self, topic: str, data: Any):
+        """Наблюдатель MessageDispatcher: вызывается с уже декодированным сообщением"""
+        if isinstance(data, dict):
+            self.update(topic, self.device_of(data), data)
+
+    def update(self, topic: str, device: str, value: Any, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        key = (topic, device)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.history)
+                while len(self._series) > self.max_series:
+                    self._series.popitem(last=False)
+                    self.metrics['evicted'] += 1
+            else:
+                self._series.move_to_end(key)
+            series.values.append((ts, value))
+            series.updated = ts
+            self.metrics['updates'] += 1
+
+    def _matching(self, topic: Optional[str], device: Optional[str], now: float):
+        for (series_topic, series_device), series in self._series.items():
+            if topic is not None and series_topic != topic:
+                continue
+            if device is not None and series_device != device:
+                continue
+            if now - series.updated > self.ttl:
+                continue
+            yield series_topic, series_device, series
+
+    def latest(self, topic: Optional[str] = None, device: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Последнее значение каждого подходящего ряда"""
+        now = time.time()
+        with self._lock:
+            self.metrics['reads'] += 1
+            return [{'topic': t, 'device': d, 'timestamp': s.values[-1][0], 'value': s.values[-1][1]}
+                    for t, d, s in self._matching(topic, device, now)]
+
+    def get_history(self, topic: str, device: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """История ряда от старых значений к новым"""
+        now = time.time()
+        with self._lock:
+            self.metrics['reads'] += 1
+            series = self._series.get((topic, device))
+            if series is None or now - series.updated > self.ttl:
+                return []
+            values = list(series.values)
+        if limit:
+            values = values[-limit:]
+        return [{'timestamp': ts, 'value': value} for ts, value in values]
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [key for key, series in self._series.items() if now - series.updated > self.ttl]
+            for key in expired:
+                del self._series[key]
+            self.metrics['evicted'] += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['series'] = len(self._series)
+        return stats
+
+    # Маршруты для MetricsServer
+
+    @staticmethod
+    def _param(query: Dict[str, List[str]], name: str) -> Optional[str]:
+        values = query.get(name)
+        return values[0] if values else None
+
+    def handle_latest(self, query: Dict[str, List[str]]) -> Tuple[int, str, str]:
+        """GET /latest?topic=...&device=..."""
+        result = self.latest(self._param(query, 'topic'), self._param(query, 'device'))
+        return 200, 'application/json', json.dumps(result)
+
+    def handle_history(self, query: Dict[str, List[str]]) -> Tuple[int, str, str]:
+        """GET /history?topic=...&device=...&limit=..."""
+        topic, device = self._param(query, 'topic'), self._param(query, 'device')
+        if topic is None or device is None:
+            return 400, 'application/json', json.dumps({'error': "topic and device are required"})
+        limit = self._param(query, 'limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return 400, 'application/json', json.dumps({'error': "limit must be a positive integer"})
+            # Больше history значений в ряду не хранится
+            limit = min(limit, self.history)
+        result = self.get_history(topic, device, limit)
+        return 200, 'application/json', json.dumps(result)
@@ -0,0 +1,183 @@
+import json
+import math
+import time
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    # Необязательная зависимость: orjson декодирует в несколько раз быстрее json
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+
+    def loads(payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+_TAG_ESCAPES = str.maketrans({'\\': '\\\\', ',': '\\,', '=': '\\=', ' ': '\\ ',
+                              '\n': '\\n', '\t': '\\t', '\r': '\\r'})
+_STRING_ESCAPES = str.maketrans({'"': '\\"', '\\': '\\\\'})
+_TAG_CACHE_LIMIT = 10000
+
+# Классы COCO, которые выдаёт yolov8n.pt
+COCO_LABELS = (
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
+    'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog',
+    'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella',
+    'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite',
+    'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle',
+    'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange',
+    'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant',
+    'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone',
+    'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors',
+    'teddy bear', 'hair drier', 'toothbrush',
+)
+
+
+def escape_tag(value: str) -> bytes:
+    """Экранирование значения тега по правилам influxdb_client"""
+    return value.translate(_TAG_ESCAPES).encode()
+
+
+def escape_string_field(value: str) -> bytes:
+    """Экранирование строкового поля: кавычки и обратный слэш"""
+    return b'"' + value.translate(_STRING_ESCAPES).encode() + b'"'
+
+
+def format_float(value: Any) -> bytes:
+    return repr(float(value)).encode()
+
+
+def is_finite(value: Any) -> bool:
+    """nan и inf line protocol не принимает; Point такие поля отбрасывает"""
+    return isinstance(value, int) or math.isfinite(float(value))
+
+
+def format_field(value: Any) -> bytes:
+    """Значение поля: int с суффиксом i, остальное как float"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return b"%di" % value
+    return format_float(value)
+
+
+def field_key(label: str) -> str:
+    """Имя поля для метки: нижний регистр, пробелы и спецсимволы заменены на _"""
+    return ''.join(c if c.isalnum() else '_' for c in label.strip().lower())
+
+
+class LabelVocabulary:
+    """Ограниченный словарь меток: всё, что вне словаря, попадает в поле other"""
+
+    def __init__(self, labels: Iterable[str] = COCO_LABELS, other: str = 'other'):
+        self.other = other
+        self.fields = {label: field_key(label) for label in labels}
+
+    def counts(self, objects: Dict[str, Any]) -> Dict[str, int]:
+        """Количество объектов по полям словаря"""
+        counts: Dict[str, int] = {}
+        for label, count in objects.items():
+            key = self.fields.get(label, self.other)
+            counts[key] = counts.get(key, 0) + int(count)
+        return counts
+
+
+class LineProtocolEncoder:
+    """Прямое кодирование декодированных сообщений в line protocol без Point"""
+
+    TEMPERATURE_MEASUREMENT = b"temperature_measurements"
+    TEMPERATURE_SUFFIX = b",sensor_type=dallas temperature="
+    DISPLAY_PREFIX = b"display_messages,type=lcd message="
+    VISION_MEASUREMENT = b"vision_data,source="
+    VISION_COUNTS_MEASUREMENT = b"vision_objects,source="
+
+    def __init__(self):
+        self._tag_cache: Dict[str, bytes] = {}
+
+    def tag(self, value: str) -> bytes:
+        """Экранированное значение тега, вычисляется один раз на значение"""
+        try:
+            return self._tag_cache[value]
+        except KeyError:
+            if len(self._tag_cache) >= _TAG_CACHE_LIMIT:
+                self._tag_cache.clear()
+            escaped = self._tag_cache[value] = escape_tag(value)
+            return escaped
+
+    @staticmethod
+    def timestamp(ts_ns: Optional[int] = None) -> bytes:
+        return b" %d" % (time.time_ns() if ts_ns is None else ts_ns)
+
+    def temperature(self, data: Dict[str, Any], ts_ns: Optional[int] = None) -> Optional[bytes]:
+        value = float(data["temperature"])
+        if not math.isfinite(value):
+            # Единственное поле отброшено - точки нет (как у Point без полей)
+            return None
+        device = self.tag(str(data.get("device", "unknown")))
+        # Теги с пустым значением опускаются, как в Point
+        return (self.TEMPERATURE_MEASUREMENT
+                + (b",device_id=" + device if device else b"")
+                + self.TEMPERATURE_SUFFIX
+                + format_float(value)
+                + self.timestamp(ts_ns))
+
+    def temperature_fields(self, device: str, fields: Dict[str, Any],
+                           ts_ns: Optional[int] = None) -> Optional[bytes]:
+        """Точка температуры с произвольным набором полей (агрегаты, heartbeat)"""
+        fields = {name: value for name, value in fields.items() if is_finite(value)}
+        if not fields:
+            return None
+        device = self.tag(device)
+        return (self.TEMPERATURE_MEASUREMENT
+                + (b",device_id=" + device if device else b"")
+                + b",sensor_type=dallas "
+                + b",".join(name.encode() + b"=" + format_field(value) for name, value in fields.items())
+                + self.timestamp(ts_ns))
+
+    def display(self, data: Dict[str, Any], ts_ns: Optional[int] = None) -> bytes:
+        return (self.DISPLAY_PREFIX
+                + escape_string_field(str(data.get("text", "")))
+                + self.timestamp(ts_ns))
+
+    def vision(self, data: Dict[str, Any], ts_ns: Optional[int] = None) -> bytes:
+        return (self.VISION_MEASUREMENT
+                + self.tag(str(data.get("source") or "camera"))
+                + b" detected_objects="
+                + escape_string_field(json.dumps(data.get("objects", {})))
+                + self.timestamp(ts_ns))
+
+    def vision_counts(self, data: Dict[str, Any], vocabulary: LabelVocabulary,
+                      ts_ns: Optional[int] = None) -> bytes:
+        """Числовое поле на каждую метку, источник камеры в теге"""
+        counts = vocabulary.counts(data.get("objects", {}))
+        counts["total"] = sum(counts.values())
+        return (self.VISION_COUNTS_MEASUREMENT
+                + self.tag(str(data.get("source") or "camera"))
+                + b" "
+                + b",".join(b"%s=%di" % (key.encode(), count) for key, count in sorted(counts.items()))
+                + self.timestamp(ts_ns))
+
+
+# Общие экземпляры для обработчиков (в режиме process у каждого процесса свои)
+encoder = LineProtocolEncoder()
+default_vocabulary = LabelVocabulary()
+
+
+def encode_temperature(data: Dict[str, Any]) -> Optional[bytes]:
+    return encoder.temperature(data)
+
+
+def encode_temperature_fields(device: str, fields: Dict[str, Any], ts_ns: int) -> Optional[bytes]:
+    return encoder.temperature_fields(device, fields, ts_ns)
+
+
+def encode_display(data: Dict[str, Any]) -> bytes:
+    return encoder.display(data)
+
+
+def encode_vision(data: Dict[str, Any]) -> bytes:
+    return encoder.vision(data)
+
+
+def encode_vision_counts(data: Dict[str, Any], vocabulary: Optional[LabelVocabulary] = None) -> bytes:
+    return encoder.vision_counts(data, vocabulary or default_vocabulary)
@@ -1,6 +1,44 @@
-import subprocess
+"""Запуск speech_processor.py и video_to_text.py под наблюдением супервизора.
+
+Супервизор перезапускает упавшие процессы с нарастающей задержкой, а
+процессы, чьи метрики не обновлялись дольше --stall-timeout секунд, считает
+зависшими и тоже перезапускает (до первой записи метрик процесс не проверяется:
+загрузка или экспорт модели может быть долгой). Штатно завершившийся процесс
+(код 0, например конец ролика в VIDEO_SOURCES), проработавший не меньше
+--min-uptime секунд, запускается заново сразу; более раннее завершение
+перезапускается с задержкой, как сбой.
+
+Ядра делятся между воркерами: каждый получает число потоков OMP/MKL/torch
+(OMP_NUM_THREADS и др., для faster-whisper - WHISPER_CPU_THREADS) по своей
+доле ядер, с --affinity - ещё и собственные ядра. Без разделения Whisper и
+YOLO запускают потоки на все ядра и вытесняют друг друга.
+
+Каждые --report-interval секунд в лог: жив ли воркер, CPU (в ядрах), RSS и
+пропускная способность (video - кадров/с, speech - секунд аудио в секунду,
+при нехватке CPU растут потери аудио и задержка публикации).
+
+    python main.py
+    python main.py --speech-share 0.25 --affinity
+    VIDEO_SOURCES=ролик.mp4 python main.py --duration 300 --output bench_results/main_partitioned.json
+    VIDEO_SOURCES=ролик.mp4 python main.py --duration 300 --no-partition --output bench_results/main_shared.json
+"""
+import argparse
+import json
+import logging
 import os
+import subprocess
 import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Переменные, которыми библиотеки (torch, numpy/BLAS, ONNX Runtime с OpenMP) ограничивают число потоков
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Воркер: скрипт и счётчик работы в его файле метрик (раздел, поле)
+WORKERS = {
+    'speech': ('speech_processor.py', ('speech', 'audio_seconds')),
+    'video': ('video_to_text.py', ('video', 'frames_processed')),
+}
 
 
 def get_venv_python():
@@ -10,55 +48,294 @@ def get_venv_python():
     return os.path.join(".venv", "bin", "python")
 
 
-def run_scripts():
+def proc_usage(pid: int) -> Optional[Tuple[float, float]]:
+    """(процессорное время в секундах, RSS в МБ) процесса из /proc; None без /proc"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Имя процесса в скобках может содержать пробелы - поля считаются после ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu, rss_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_budgets(names: List[str], args) -> Dict[str, Tuple[int, Optional[List[int]]]]:
+    """Потоки и ядра каждого воркера; (0, None) - без ограничений"""
+    if args.no_partition:
+        return {name: (0, None) for name in names}
+    cores = available_cores()
+    if len(names) == 1 or len(cores) == 1:
+        return {name: (len(cores), cores if args.affinity else None) for name in names}
+    speech = max(1, min(len(cores) - 1, round(len(cores) * args.speech_share)))
+    shares = {'speech': cores[:speech], 'video': cores[speech:]}
+    return {name: (len(shares[name]), shares[name] if args.affinity else None) for name in names}
+
+
+class Worker:
+    """Процесс-воркер под наблюдением: перезапуск, бюджет CPU, метрики"""
+
+    def __init__(self, name: str, python: str, args, threads: int = 0, cores: Optional[List[int]] = None):
+        script, self.counter = WORKERS[name]
+        self.name = name
+        self.script = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        self.python = python
+        self.args = args
+        self.threads = threads
+        self.cores = cores
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.completions = 0
+        self.backoff = args.min_backoff
+        self.next_start = 0.0
+        self.started_at = 0.0
+
+        # Накопленные за всё время (между перезапусками) значения для итогов
+        self.cpu_seconds = 0.0
+        self.work = 0.0
+        self.peak_rss_mb = 0.0
+        self._last_cpu: Optional[Tuple[float, float]] = None
+        self._last_work: Optional[Tuple[float, float]] = None
+        self.cpu_rate = 0.0
+        self.throughput = 0.0
+        self.last_stats: Dict[str, Any] = {}
+
+    @property
+    def metrics_file(self) -> str:
+        return os.path.join(self.args.run_dir, f"{self.name}.json")
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            'METRICS_FILE': self.metrics_file,
+            'SPEECH_STATS_INTERVAL': str(self.args.report_interval),
+            'VIDEO_STATS_INTERVAL': str(self.args.report_interval),
+        })
+        if self.threads:
+            for variable in THREAD_VARIABLES:
+                env[variable] = str(self.threads)
+            env['WHISPER_CPU_THREADS'] = str(self.threads)
+        return env
+
+    def start(self):
+        # Метрики прошлого процесса не должны считаться признаком жизни нового
+        if os.path.exists(self.metrics_file):
+            os.remove(self.metrics_file)
+        cores = set(self.cores or ())
+
+        def pin():
+            # Привязка до exec: потоки torch/OpenMP наследуют её при создании
+            os.sched_setaffinity(0, cores)
+
+        self.process = subprocess.Popen([self.python, self.script], env=self.env(),
+                                        preexec_fn=pin if cores else None)
+        self.started_at = time.monotonic()
+        self._last_cpu = None
+        # Счётчик нового процесса начинается с нуля
+        self._last_work = (0.0, time.time())
+        budget = f"{self.threads} потоков" if self.threads else "без ограничения потоков"
+        if self.cores:
+            budget += f", ядра {self.cores}"
+        logging.info(f"Запущен {self.name} (pid {self.process.pid}, {budget})")
+
+    def read_metrics(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.metrics_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def heartbeat_age(self) -> Optional[float]:
+        """Секунд с последней записи метрик; None, если процесс ещё не записал метрики"""
+        try:
+            return time.time() - os.path.getmtime(self.metrics_file)
+        except OSError:
+            return None
+
+    def check(self):
+        """Перезапуск упавшего или зависшего процесса с экспоненциальной задержкой"""
+        now = time.monotonic()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                age = self.heartbeat_age()
+                if not self.args.stall_timeout or age is None or age <= self.args.stall_timeout:
+                    # Проработал достаточно долго - сбрасываем задержку
+                    if now - self.started_at > self.args.max_backoff:
+                        self.backoff = self.args.min_backoff
+                    return
+                logging.warning(f"{self.name}: нет метрик {age:.0f} с, процесс считается зависшим")
+                self.stop()
+                code = "stalled"
+            self.sample()
+            self.process = None
+            self.cpu_rate = self.throughput = 0.0
+            if code == 0 and now - self.started_at >= self.args.min_uptime:
+                # Штатное завершение (например, кончился ролик) - не сбой: заново сразу, без задержки.
+                # Быстрый выход с кодом 0 (нет камеры, пустой файл) так не зациклится
+                logging.info(f"{self.name} завершился штатно, повторный запуск")
+                self.completions += 1
+                self.backoff = self.args.min_backoff
+                self.next_start = now
+            else:
+                logging.warning(f"{self.name} завершился (код {code}), перезапуск через {self.backoff:.0f} с")
+                self.restarts += 1
+                self.next_start = now + self.backoff
+                self.backoff = min(self.backoff * 2, self.args.max_backoff)
+
+        if now >= self.next_start:
+            self.start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def sample(self):
+        """CPU и RSS из /proc, пропускная способность из файла метрик"""
+        if self.process is not None:
+            usage = proc_usage(self.process.pid)
+            if usage is not None:
+                cpu, rss = usage
+                now = time.monotonic()
+                if self._last_cpu is not None:
+                    self.cpu_seconds += cpu - self._last_cpu[0]
+                    self.cpu_rate = (cpu - self._last_cpu[0]) / max(now - self._last_cpu[1], 1e-9)
+                self._last_cpu = (cpu, now)
+                self.peak_rss_mb = max(self.peak_rss_mb, rss)
+                self.last_stats['rss_mb'] = rss
+
+        data = self.read_metrics()
+        if data is None:
+            return
+        section, counter = self.counter
+        stats = data['stats'].get(section, {})
+        value, timestamp = stats.get(counter, 0.0), data['timestamp']
+        if self._last_work is not None and timestamp > self._last_work[1]:
+            delta = value - self._last_work[0]
+            self.work += delta
+            self.throughput = delta / (timestamp - self._last_work[1])
+        if self._last_work is None or timestamp > self._last_work[1]:
+            self._last_work = (value, timestamp)
+        self.last_stats.update(stats)
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        return {
+            'threads': self.threads,
+            'cores': self.cores,
+            'restarts': self.restarts,
+            'completions': self.completions,
+            'cpu_cores': self.cpu_seconds / duration if duration else 0.0,
+            'peak_rss_mb': self.peak_rss_mb,
+            'throughput': self.work / duration if duration else 0.0,
+            'throughput_unit': self.counter[1] + "/s",
+            'last_stats': self.last_stats,
+        }
+
+
+def report(workers: List[Worker]):
+    for worker in workers:
+        worker.sample()
+        state = "жив" if worker.alive else "перезапуск"
+        unit = "кадров/с" if worker.name == 'video' else "с аудио/с"
+        extra = ""
+        if worker.name == 'speech' and 'overrun_samples' in worker.last_stats:
+            extra = (f", потеряно отсчётов {worker.last_stats['overrun_samples']}, "
+                     f"публикация p50 {worker.last_stats.get('publish_latency_p50', 0):.2f} с")
+        age = worker.heartbeat_age()
+        heartbeat = "метрик ещё нет" if age is None else f"метрики {age:.0f} с назад"
+        logging.info(f"{worker.name}: {state}, перезапусков {worker.restarts}, CPU {worker.cpu_rate:.2f} ядра, "
+                     f"RSS {worker.last_stats.get('rss_mb', 0):.0f} МБ, {worker.throughput:.2f} {unit}, "
+                     f"{heartbeat}{extra}")
+
+
+def run_scripts(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', nargs='+', choices=list(WORKERS), default=list(WORKERS))
+    parser.add_argument('--python', help="интерпретатор воркеров, по умолчанию из .venv")
+    parser.add_argument('--speech-share', type=float, default=0.5, help="доля ядер для распознавания речи")
+    parser.add_argument('--no-partition', action='store_true', help="не ограничивать потоки воркеров")
+    parser.add_argument('--affinity', action='store_true', help="закрепить воркеры за своими ядрами")
+    parser.add_argument('--run-dir', default="run", help="каталог для файлов метрик воркеров")
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    parser.add_argument('--min-backoff', type=float, default=1.0)
+    parser.add_argument('--max-backoff', type=float, default=60.0)
+    parser.add_argument('--min-uptime', type=float, default=30.0,
+                        help="завершение с кодом 0 раньше N с перезапускается с задержкой")
+    parser.add_argument('--stall-timeout', type=float, default=180.0,
+                        help="перезапуск воркера, не обновлявшего метрики N с (0 - не проверять)")
+    parser.add_argument('--duration', type=float, default=0.0, help="остановиться через N с и вывести итоги")
+    parser.add_argument('--output', help="JSON с итогами (для сравнения конфигураций)")
+    args = parser.parse_args(argv)
+
     # Получаем абсолютный путь к директории проекта
     project_dir = os.path.dirname(os.path.abspath(__file__))
 
     # Путь к Python в виртуальном окружении
-    venv_python = os.path.join(project_dir, get_venv_python())
+    python = args.python or os.path.join(project_dir, get_venv_python())
 
     # Проверяем существование виртуального окружения
-    if not os.path.exists(venv_python):
-        print(f"Ошибка: Виртуальное окружение не найдено по пути: {venv_python}")
+    if not os.path.exists(python):
+        print(f"Ошибка: Виртуальное окружение не найдено по пути: {python}")
         return
 
-    # Пути к скриптам
-    scripts = [
-        os.path.join(project_dir, 'speech_processor.py'),
-        os.path.join(project_dir, 'video_to_text.py')
-    ]
+    if args.affinity and not hasattr(os, 'sched_setaffinity'):
+        logging.warning("Привязка к ядрам не поддерживается на этой платформе")
+        args.affinity = False
 
-    processes = []
+    os.makedirs(args.run_dir, exist_ok=True)
+    budgets = plan_budgets(args.workers, args)
+    workers = [Worker(name, python, args, *budgets[name]) for name in args.workers]
+    started = time.monotonic()
+    next_report = started + args.report_interval
 
     try:
-        # Запускаем каждый скрипт с использованием Python из виртуального окружения
-        for script in scripts:
-            process = subprocess.Popen([venv_python, script])
-            processes.append(process)
-            print(f"Запущен скрипт: {os.path.basename(script)}")
-
-        # Ожидаем завершения всех процессов
-        for p in processes:
-            p.wait()
-
+        while not args.duration or time.monotonic() - started < args.duration:
+            for worker in workers:
+                worker.check()
+            if time.monotonic() >= next_report:
+                report(workers)
+                next_report = time.monotonic() + args.report_interval
+            time.sleep(0.5)
     except KeyboardInterrupt:
         print("\nПолучен сигнал завершения. Останавливаем скрипты...")
-        for p in processes:
-            p.terminate()
-
-        # Ждем корректного завершения процессов
-        for p in processes:
-            try:
-                p.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                p.kill()
-
+    finally:
+        for worker in workers:
+            worker.sample()
+        duration = time.monotonic() - started
+        for worker in workers:
+            worker.stop()
         print("Все скрипты остановлены")
 
-    except Exception as e:
-        print(f"Произошла ошибка: {e}")
-        for p in processes:
-            p.terminate()
+    summary = {worker.name: worker.summary(duration) for worker in workers}
+    for name, result in summary.items():
+        logging.info(f"Итого {name}: {result['throughput']:.2f} {result['throughput_unit']}, "
+                     f"CPU {result['cpu_cores']:.2f} ядра, пиковый RSS {result['peak_rss_mb']:.0f} МБ, "
+                     f"перезапусков {result['restarts']}, штатных завершений {result['completions']}")
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': time.time(), 'duration': duration, 'config': vars(args),
+                       'workers': summary}, f, indent=2)
+        logging.info(f"Итоги сохранены в {args.output}")
 
 
 if __name__ == "__main__":
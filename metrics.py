@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Границы корзин задержки в секундах
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# (имя, метки, значение) для метрик, вычисляемых при выгрузке
+Sample = Tuple[str, Dict[str, Any], float]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe - бинарный поиск и три сложения"""
+    __slots__ = ('bounds', 'counts', 'total', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(self.bounds, counts):
+            seen += bucket
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ''
+    escaped = (k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """Счётчики и гистограммы с метками и выгрузка в текстовом формате Prometheus"""
+
+    def __init__(self, prefix: str = 'collector'):
+        self.prefix = prefix
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._help: Dict[str, str] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def define(self, name: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        """Описание метрики и (для гистограмм) границ корзин"""
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    key, Histogram(self._buckets.get(name, LATENCY_BUCKETS)))
+        return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Источник gauge-метрик, вызываемый при каждой выгрузке"""
+        self._collectors.append(collector)
+
+    def quantiles(self, name: str, qs: Tuple[float, ...] = (0.5, 0.99)) -> Dict[str, float]:
+        """Квантили гистограммы по всем наборам меток (для логов)"""
+        result = {}
+        for (hist_name, labels), histogram in list(self._histograms.items()):
+            if hist_name != name or not histogram.count:
+                continue
+            label = ':'.join(str(v) for _, v in labels)
+            for q in qs:
+                result[f"{label}_p{int(q * 100)}"] = histogram.quantile(q)
+        return result
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus 0.0.4"""
+        lines = []
+        typed = set()
+
+        def header(name: str, kind: str):
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                typed.add(full)
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        for (name, labels), value in counters:
+            full = header(name, 'counter')
+            lines.append(f"{full}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            full = header(name, 'histogram')
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds, counts):
+                cumulative += bucket
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{full}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{full}_count{_format_labels(labels)} {count}")
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logging.error(f"Metrics collector error: {e}")
+                continue
+            for name, labels, value in samples:
+                full = header(name, 'gauge')
+                lines.append(f"{full}{_format_labels(tuple(sorted(labels.items())))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class RateMeter:
+    """Скорость роста счётчика между соседними вызовами"""
+
+    def __init__(self):
+        self._last: Dict[str, Tuple[float, float]] = {}
+
+    def rate(self, name: str, value: float) -> float:
+        now = time.monotonic()
+        previous = self._last.get(name)
+        self._last[name] = (value, now)
+        if previous is None or now <= previous[1]:
+            return 0.0
+        return (value - previous[0]) / (now - previous[1])
+
+
+# Обработчик маршрута: параметры запроса -> (код, content-type, тело)
+RouteHandler = Callable[[Dict[str, List[str]]], Tuple[int, str, str]]
+
+
+class MetricsServer:
+    """Лёгкий HTTP сервер: /metrics и дополнительные маршруты"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '0.0.0.0', port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, RouteHandler] = {
+            '/metrics': lambda query: (200, 'text/plain; version=0.0.4', self.registry.render()),
+        }
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def add_route(self, path: str, handler: RouteHandler):
+        self.routes[path] = handler
+
+    def start(self):
+        routes = self.routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                route = routes.get(url.path)
+                if route is None:
+                    status, content_type, body = 404, 'text/plain', 'not found\n'
+                else:
+                    try:
+                        status, content_type, body = route(parse_qs(url.query))
+                    except Exception as e:
+                        status, content_type, body = 500, 'text/plain', f"{e}\n"
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Metrics endpoint on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def dump_metrics_file(path: str, stats: Dict[str, Dict[str, Any]]):
+    """Атомарная запись метрик процесса в файл для наблюдающего процесса (лаунчера)"""
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'timestamp': time.time(), 'pid': os.getpid(), 'stats': stats}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.error(f"Failed to write metrics file: {e}")
@@ -0,0 +1,120 @@
+"""Перенос vision_data (строка detected_objects в JSON) в vision_objects (числовое поле на метку).
+
+Точки читаются порциями по времени и записываются пакетами с исходными
+метками времени, поэтому повторный запуск безопасен: те же серии и время
+перезаписываются. Примеры:
+
+    python migrate_vision.py --start -90d --dry-run
+    python migrate_vision.py --start 2024-01-01T00:00:00Z --delete-old
+
+--delete-old не удаляет vision_data, если какие-то точки не удалось разобрать
+(они остались бы только там), пока не указан --force.
+"""
+import argparse
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+import line_protocol
+from subscriber import InfluxDBConfig, VisionConfig
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+QUERY = '''
+from(bucket: "{bucket}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == "vision_data" and r._field == "detected_objects")
+'''
+
+
+def parse_time(value: str) -> datetime:
+    """Абсолютное время ISO 8601 или относительное вида -30d / -12h"""
+    if value == 'now':
+        return datetime.now(timezone.utc)
+    if value.startswith('-') and value[-1] in 'dhm':
+        units = {'d': 'days', 'h': 'hours', 'm': 'minutes'}
+        return datetime.now(timezone.utc) - timedelta(**{units[value[-1]]: int(value[1:-1])})
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def to_ns(moment: datetime) -> int:
+    return (moment - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def iter_chunks(start: datetime, stop: datetime, step: timedelta):
+    while start < stop:
+        end = min(start + step, stop)
+        yield start, end
+        start = end
+
+
+def migrate(args):
+    client = InfluxDBClient(url=InfluxDBConfig.URL, token=InfluxDBConfig.TOKEN, org=InfluxDBConfig.ORG)
+    query_api = client.query_api()
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    encoder = line_protocol.LineProtocolEncoder()
+
+    totals = {'read': 0, 'written': 0, 'skipped': 0}
+    batch = []
+
+    def flush():
+        if batch and not args.dry_run:
+            write_api.write(bucket=InfluxDBConfig.BUCKET, record=batch)
+        totals['written'] += len(batch)
+        batch.clear()
+
+    start, stop = parse_time(args.start), parse_time(args.stop)
+    for chunk_start, chunk_stop in iter_chunks(start, stop, timedelta(hours=args.chunk_hours)):
+        query = QUERY.format(bucket=InfluxDBConfig.BUCKET,
+                             start=chunk_start.isoformat(), stop=chunk_stop.isoformat())
+        for record in query_api.query_stream(query):
+            totals['read'] += 1
+            try:
+                objects = json.loads(record.get_value())
+            except (TypeError, ValueError):
+                totals['skipped'] += 1
+                continue
+
+            data = {"objects": objects, "source": record.values.get("source")}
+            batch.append(encoder.vision_counts(data, VisionConfig.VOCABULARY, to_ns(record.get_time())))
+            if len(batch) >= args.batch_size:
+                flush()
+        flush()
+        logging.info(f"{chunk_start:%Y-%m-%d %H:%M} - {chunk_stop:%Y-%m-%d %H:%M}: "
+                     f"read {totals['read']}, written {totals['written']}, skipped {totals['skipped']}")
+
+    if args.delete_old and not args.dry_run and totals['skipped'] and not args.force:
+        # Непереносимые точки остались бы только в vision_data
+        logging.warning(f"{totals['skipped']} points were not migrated, vision_data is kept "
+                        f"(--force to delete anyway)")
+    elif args.delete_old and not args.dry_run:
+        client.delete_api().delete(start, stop, '_measurement="vision_data"',
+                                   bucket=InfluxDBConfig.BUCKET, org=InfluxDBConfig.ORG)
+        logging.info("Old vision_data points deleted")
+
+    client.close()
+    return totals
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--start', default='-365d', help="начало диапазона (ISO 8601 или -30d)")
+    parser.add_argument('--stop', default='now', help="конец диапазона")
+    parser.add_argument('--chunk-hours', type=int, default=24, help="размер порции запроса")
+    parser.add_argument('--batch-size', type=int, default=5000, help="точек в одном запросе записи")
+    parser.add_argument('--dry-run', action='store_true', help="только посчитать, без записи")
+    parser.add_argument('--delete-old', action='store_true', help="удалить vision_data после переноса")
+    parser.add_argument('--force', action='store_true',
+                        help="с --delete-old: удалить, даже если часть точек не перенесена")
+    args = parser.parse_args()
+
+    totals = migrate(args)
+    logging.info(f"Done: {totals}")
+
+
+if __name__ == "__main__":
+    main()
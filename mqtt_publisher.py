@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import paho.mqtt.client as mqtt
+
+from metrics import Histogram
+
+# Подключение - те же переменные, что у subscriber.py
+MQTT_BROKER = os.getenv('MQTT_BROKER', "jcddef63.ala.eu-central-1.emqxsl.com")
+MQTT_PORT = int(os.getenv('MQTT_PORT', "8883"))
+MQTT_USERNAME = os.getenv('MQTT_USERNAME', "mqtt_user")
+MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', "mqtt_pass")
+MQTT_CERT_PATH = os.getenv('MQTT_CERT_PATH', "emqxsl-ca.crt")
+# Для локального брокера без TLS (например mosquitto): MQTT_TLS=0
+MQTT_TLS = os.getenv('MQTT_TLS', "1") == "1"
+# Общий префикс ID клиента; у каждого производителя свой суффикс, пусто - случайный ID
+MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', "")
+
+# Очередь публикаций: сообщений в ожидании на процесс
+PUBLISH_QUEUE_SIZE = int(os.getenv('PUBLISH_QUEUE_SIZE', "1000"))
+# Сообщения в топик чаще этого интервала сливаются - уходит последнее
+PUBLISH_COALESCE_MS = float(os.getenv('PUBLISH_COALESCE_MS', "200"))
+# Не больше сообщений в секунду на топик; ESP8266 прокручивает строку LCD раз в 800 мс
+PUBLISH_RATE = float(os.getenv('PUBLISH_RATE', "1"))
+
+
+def connect_client(name: str, on_connect=None, on_disconnect=None) -> mqtt.Client:
+    """Клиент paho с параметрами из окружения (MQTT_*), подключённый и с запущенным циклом.
+
+    name - суффикс ID клиента (<MQTT_CLIENT_ID>-<name>): брокер отключает клиента,
+    если другой подключился с тем же ID.
+    """
+    client = mqtt.Client(client_id=f"{MQTT_CLIENT_ID}-{name}" if MQTT_CLIENT_ID else "")
+    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    if MQTT_TLS:
+        client.tls_set(ca_certs=MQTT_CERT_PATH if os.path.exists(MQTT_CERT_PATH) else None)
+    if on_connect is not None:
+        client.on_connect = on_connect
+    if on_disconnect is not None:
+        client.on_disconnect = on_disconnect
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT)
+    except Exception as e:
+        # Повторное подключение выполняет loop_start
+        logging.error(f"MQTT connection error: {e}")
+        client.connect_async(MQTT_BROKER, MQTT_PORT)
+    client.loop_start()
+    return client
+
+
+class _Message:
+    __slots__ = ('payload', 'qos', 'retain', 'enqueued', 'coalesce')
+
+    def __init__(self, payload, qos, retain, coalesce):
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.enqueued = time.monotonic()
+        self.coalesce = coalesce
+
+
+class CoalescingPublisher:
+    """Публикация MQTT из отдельного потока: последнее значение на топик и ограничение частоты.
+
+    publish не блокирует производителя: сообщение встаёт в очередь своего топика.
+    Пока предыдущее сообщение топика ждёт отправки, новое его заменяет (coalesced).
+    Топик отправляется не чаще раза в max(coalesce_interval, 1 / rate) секунд;
+    первое сообщение после паузы уходит сразу. rates - частота для отдельных
+    топиков (имя топика -> сообщений в секунду, 0 - без ограничения).
+    """
+
+    def __init__(self, client: Any, queue_size: int = PUBLISH_QUEUE_SIZE,
+                 coalesce_interval: float = PUBLISH_COALESCE_MS / 1000, rate: float = PUBLISH_RATE,
+                 rates: Optional[Dict[str, float]] = None):
+        self.client = client
+        self.queue_size = queue_size
+        self.coalesce_interval = coalesce_interval
+        self.rate = rate
+        self.rates = dict(rates or {})
+
+        self._pending: Dict[str, deque] = {}
+        self._next_send: Dict[str, float] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closing = False
+        self.latency = Histogram()
+
+        self.metrics = {
+            'queued': 0,
+            'published': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'errors': 0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self._thread.start()
+
+    def min_interval(self, topic: str) -> float:
+        rate = self.rates.get(topic, self.rate)
+        return max(self.coalesce_interval, 1.0 / rate if rate > 0 else 0.0)
+
+    def publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False,
+                coalesce: bool = True) -> bool:
+        """Постановка сообщения в очередь; False - очередь полна или публикатор остановлен.
+
+        coalesce=False - сообщение само не заменяется следующим (окончательный текст),
+        но ожидающее сообщение топика заменяет; частота топика соблюдается.
+        """
+        with self._lock:
+            if self._closing:
+                self.metrics['dropped'] += 1
+                return False
+
+            pending = self._pending.setdefault(topic, deque())
+            if pending and pending[-1].coalesce:
+                # Время постановки остаётся от заменённого: задержка считается от первого значения
+                message = pending[-1]
+                message.payload, message.qos, message.retain = payload, qos, retain
+                message.coalesce = coalesce
+                self.metrics['coalesced'] += 1
+                return True
+
+            if self._size >= self.queue_size:
+                self.metrics['dropped'] += 1
+                return False
+            pending.append(_Message(payload, qos, retain, coalesce))
+            self._size += 1
+            self.metrics['queued'] += 1
+            self._changed.notify()
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, Any]:
+        """Снимок счётчиков публикации"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['queue_depth'] = self._size
+        stats['latency_p50'] = self.latency.quantile(0.5)
+        stats['latency_p95'] = self.latency.quantile(0.95)
+        return stats
+
+    def _take(self):
+        """Ожидание сообщения, топик которого уже можно отправлять"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                due_topic, due = None, None
+                for topic, pending in self._pending.items():
+                    if pending:
+                        ready = self._next_send.get(topic, 0.0)
+                        if due is None or ready < due:
+                            due_topic, due = topic, ready
+                if due_topic is not None and (due <= now or self._closing):
+                    message = self._pending[due_topic].popleft()
+                    self._size -= 1
+                    self._next_send[due_topic] = now + self.min_interval(due_topic)
+                    return due_topic, message
+                if due_topic is None and self._closing:
+                    return None, None
+                self._changed.wait(None if due is None else due - now)
+
+    def _run(self):
+        while True:
+            topic, message = self._take()
+            if topic is None:
+                break
+            try:
+                result = self.client.publish(topic, message.payload, qos=message.qos, retain=message.retain)
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    raise RuntimeError(f"rc={result.rc}")
+                self.latency.observe(time.monotonic() - message.enqueued)
+                with self._lock:
+                    self.metrics['published'] += 1
+            except Exception as e:
+                logging.error(f"MQTT publish error on {topic}: {e}")
+                with self._lock:
+                    self.metrics['errors'] += 1
+
+    def close(self, timeout: float = 5.0):
+        """Остановка с отправкой оставшихся сообщений (без ограничения частоты)"""
+        with self._lock:
+            self._closing = True
+            self._changed.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"Publisher did not finish in {timeout}s, {self._size} messages pending")
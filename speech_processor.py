@@ -1,72 +1,103 @@
 import numpy as np
-import whisper
 import threading
-import queue
 import time
 import re
-import sounddevice as sd
 import json
 import logging
 import sys
-import torch
 import paho.mqtt.client as mqtt
 import os
 from datetime import datetime
 from collections import deque
 
-# Конфигурация MQTT
-MQTT_BROKER = os.getenv('MQTT_BROKER', "jcddef63.ala.eu-central-1.emqxsl.com")
-MQTT_PORT = int(os.getenv('MQTT_PORT', "8883"))
-MQTT_USERNAME = os.getenv('MQTT_USERNAME', "mqtt_user")
-MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', "mqtt_pass")
-MQTT_CERT_PATH = os.getenv('MQTT_CERT_PATH', "emqxsl-ca.crt")
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    # Нет sounddevice или PortAudio (сервер без звука) - только подача аудио извне (bench_speech.py)
+    sd = None
+
+from audio_buffer import AudioRingBuffer
+from metrics import Histogram, dump_metrics_file
+from mqtt_publisher import CoalescingPublisher, connect_client
+from streaming import StreamingTranscriber
+from transcription_engines import create_engine_from_env
+from vad import VAD_MAX_SEGMENT_SECONDS, create_segmenter
+
+# Конфигурация MQTT (подключение - MQTT_* в mqtt_publisher.py)
 MQTT_TOPIC = "display/text"
+# Сообщений в секунду на LCD: чаще дисплей не успевает прокручивать текст
+DISPLAY_RATE = float(os.getenv('DISPLAY_RATE', "1"))
 
 # Аудио конфигурация
 CHANNELS = 1
 RATE = 16000
 CHUNK = 1024 * 2  # Увеличиваем размер чанка
 BUFFER_SECONDS = 5  # Увеличиваем буфер
+OVERLAP_SECONDS = float(os.getenv('AUDIO_OVERLAP_SECONDS', "0"))  # Перекрытие соседних окон
+
+# Нарезка: vad - фразы по детектору речи (параметры VAD_* в vad.py), fixed - окна по BUFFER_SECONDS
+SEGMENTATION = os.getenv('SEGMENTATION', "vad")
+STATS_INTERVAL = float(os.getenv('SPEECH_STATS_INTERVAL', "60"))
+# Файл метрик для супервизора main.py (пусто - не писать)
+METRICS_FILE = os.getenv('METRICS_FILE', "")
+
+# Потоковый режим: промежуточный текст на дисплей, пока фраза ещё звучит (только с SEGMENTATION=vad)
+STREAMING = os.getenv('SPEECH_STREAMING', "0") == "1"
+STREAMING_STEP_SECONDS = float(os.getenv('SPEECH_STREAMING_STEP', "0.5"))  # Период перераспознавания
+PROMPT_CHARS = int(os.getenv('SPEECH_PROMPT_CHARS', "200"))  # Контекст предыдущих фраз для initial_prompt
+
+RING_SECONDS = max(BUFFER_SECONDS, VAD_MAX_SEGMENT_SECONDS) * 4  # Запас кольцевого буфера на время распознавания
 
 
 class AudioProcessor:
-    def __init__(self):
+    def __init__(self, engine=None, mqtt_client=None):
+        """engine и mqtt_client можно передать готовыми (бенчмарк, тесты)"""
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s',
             stream=sys.stdout
         )
 
-        self.setup_mqtt()
+        # Перекрытие не меньше окна остановило бы чтение на одном окне
+        if SEGMENTATION == "fixed" and not 0 <= OVERLAP_SECONDS < BUFFER_SECONDS:
+            raise ValueError(f"AUDIO_OVERLAP_SECONDS must be in [0, {BUFFER_SECONDS}): {OVERLAP_SECONDS}")
 
-        logging.info("Загрузка модели Whisper...")
-        self.model = whisper.load_model("base")  # Используем базовую модель для начала
-        logging.info("Модель загружена.")
+        # Свой клиент публикует через очередь с ограничением частоты дисплея;
+        # переданный - синхронно (бенчмарк измеряет задержку до публикации)
+        self.publisher = None
+        if mqtt_client is not None:
+            self.mqtt_client = mqtt_client
+        else:
+            self.setup_mqtt()
+            self.publisher = CoalescingPublisher(self.mqtt_client, rates={MQTT_TOPIC: DISPLAY_RATE})
+
+        self.engine = engine if engine is not None else create_engine_from_env()
+        logging.info(f"Модель загружена: {self.engine.describe()}")
 
-        self.audio_queue = queue.Queue()
+        self.audio_buffer = AudioRingBuffer(int(RATE * RING_SECONDS))
         self.running = True
         self.last_process_time = time.time()
 
-        # Настройка устройства
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logging.info(f"Используется устройство: {self.device}")
+        self.segmenter = create_segmenter(RATE)
+        # Конец речи -> публикация текста
+        self.publish_latency = Histogram()
+        self.reported_overrun = 0
+        self.metrics = {
+            'audio_seconds': 0.0,
+            'published': 0,
+            'errors': 0,
+        }
+
+        self.streamer = None
+        if STREAMING and SEGMENTATION != "fixed":
+            self.streamer = StreamingTranscriber(
+                self.engine, self.publish_text, language="pl", rate=RATE,
+                step=STREAMING_STEP_SECONDS, prompt_chars=PROMPT_CHARS,
+            )
 
     def setup_mqtt(self):
         """Настройка MQTT клиента"""
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-        self.mqtt_client.tls_set(ca_certs=MQTT_CERT_PATH)
-
-        # Добавляем обработчики
-        self.mqtt_client.on_connect = self._on_connect
-        self.mqtt_client.on_disconnect = self._on_disconnect
-
-        try:
-            self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT)
-            self.mqtt_client.loop_start()
-            logging.info("MQTT подключение установлено")
-        except Exception as e:
-            logging.error(f"Ошибка подключения к MQTT: {e}")
+        self.mqtt_client = connect_client("speech", on_connect=self._on_connect, on_disconnect=self._on_disconnect)
 
     def _on_connect(self, client, userdata, flags, rc):
         """Обработчик подключения к MQTT"""
@@ -94,68 +125,158 @@ class AudioProcessor:
         if status:
             logging.warning(f"Status: {status}")
         try:
-            self.audio_queue.put(indata.copy())
+            # Копирование сразу в предвыделенный буфер, без промежуточных объектов
+            self.audio_buffer.write(indata.reshape(-1))
         except Exception as e:
             logging.error(f"Ошибка в callback: {e}")
 
-    def transcribe_audio(self, audio_data):
-        try:
-            result = self.model.transcribe(
-                audio_data,
-                language="pl",
-                fp16=(self.device == "cuda"),
-                temperature=0.2
-            )
+    def publish_text(self, text, final=True):
+        text = self.clean_text(text).strip()
+        if not text:
+            return False
+
+        # Формируем сообщение в точном соответствии с форматом ESP8266
+        message = {
+            "text": text,  # Только текст, без timestamp
+        }
 
-            text = self.clean_text(result["text"]).strip()
-            if text:
-                # Формируем сообщение в точном соответствии с форматом ESP8266
-                message = {
-                    "text": text,  # Только текст, без timestamp
-                }
-
-                # Отладочная информация
-                logging.info(f"Отправляем сообщение: {json.dumps(message)}")
-
-                # Публикуем сообщение
-                mqtt_result = self.mqtt_client.publish(
-                    MQTT_TOPIC,
-                    json.dumps(message),
-                    qos=1,
-                    retain=True  # Сохраняем последнее сообщение
-                )
-
-                if mqtt_result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    logging.info(f"Сообщение успешно отправлено: {text}")
-                else:
-                    logging.error(f"Ошибка отправки MQTT: {mqtt_result.rc}")
+        # Отладочная информация
+        logging.info(f"Отправляем сообщение: {json.dumps(message)}")
+
+        # Промежуточный текст сразу заменяется следующим - без подтверждения и retain
+        options = dict(qos=1 if final else 0, retain=final)  # Сохраняем последнее окончательное сообщение
+        if self.publisher is not None:
+            # Окончательный текст не вытесняется промежуточным следующей фразы
+            sent = self.publisher.publish(MQTT_TOPIC, json.dumps(message), coalesce=not final, **options)
+        else:
+            mqtt_result = self.mqtt_client.publish(MQTT_TOPIC, json.dumps(message), **options)
+            sent = mqtt_result.rc == mqtt.MQTT_ERR_SUCCESS
+
+        if sent:
+            logging.info(f"Сообщение успешно отправлено: {text}")
+            if final:
+                self.metrics['published'] += 1
+            return True
+        logging.error("Ошибка отправки MQTT: очередь публикации переполнена" if self.publisher is not None
+                      else f"Ошибка отправки MQTT: {mqtt_result.rc}")
+        return False
 
+    def transcribe_audio(self, audio_data):
+        try:
+            return self.publish_text(self.engine.transcribe(audio_data, language="pl"))
         except Exception as e:
             logging.error(f"Ошибка распознавания: {e}")
+            self.metrics['errors'] += 1
+        return False
+
+    def check_overrun(self):
+        if self.audio_buffer.overrun_samples > self.reported_overrun:
+            logging.warning(f"Распознавание не успевает, потеряно отсчётов: "
+                            f"{self.audio_buffer.overrun_samples - self.reported_overrun}")
+            self.reported_overrun = self.audio_buffer.overrun_samples
+
+    def dump_metrics(self):
+        """Счётчики для супервизора: жив ли процесс и сколько аудио обработано"""
+        if METRICS_FILE:
+            stats = dict(self.metrics, overrun_samples=self.audio_buffer.overrun_samples,
+                         publish_latency_p50=self.publish_latency.quantile(0.5),
+                         publish_latency_p95=self.publish_latency.quantile(0.95))
+            if SEGMENTATION != "fixed":
+                stats['utterances'] = self.segmenter.stats()['utterances']
+            if self.publisher is not None:
+                stats['mqtt'] = self.publisher.stats()
+            dump_metrics_file(METRICS_FILE, {'speech': stats})
+
+    def log_stats(self):
+        stats = self.segmenter.stats()
+        logging.info(
+            f"VAD: аудио {stats['audio_seconds']:.0f} с, фраз {stats['utterances']} "
+            f"(обрезано {stats['forced_cuts']}, отброшено {stats['dropped_short']}), "
+            f"пропущено распознавания {stats['skipped_ratio']:.0%}, "
+            f"задержка конец речи -> публикация p50={self.publish_latency.quantile(0.5):.2f} с "
+            f"p95={self.publish_latency.quantile(0.95):.2f} с"
+        )
+        if self.streamer is not None:
+            stream = self.streamer.stats()
+            logging.info(
+                f"Потоковый режим: первое слово p50={stream['first_word_p50']:.2f} с "
+                f"p95={stream['first_word_p95']:.2f} с, промежуточных {stream['partials_published']}, "
+                f"вычислений на секунду речи {stream['compute_per_audio_second']:.2f} с"
+            )
+        if self.publisher is not None:
+            mqtt_stats = self.publisher.stats()
+            logging.info(
+                f"MQTT: отправлено {mqtt_stats['published']}, заменено более новыми {mqtt_stats['coalesced']}, "
+                f"отброшено {mqtt_stats['dropped']}, в очереди p50={mqtt_stats['latency_p50']:.2f} с "
+                f"p95={mqtt_stats['latency_p95']:.2f} с"
+            )
+
+    def transcribe_utterance(self, utterance):
+        if self.streamer is not None:
+            published = self.streamer.finish(utterance.audio, utterance.speech_start)
+        else:
+            published = self.transcribe_audio(utterance.audio)
+        if published:
+            self.publish_latency.observe(time.monotonic() - utterance.speech_end)
 
     def process_audio(self):
-        buffer = []
+        if SEGMENTATION == "fixed":
+            self.process_fixed_windows()
+            return
+
+        frame = np.empty(self.segmenter.frame_size, dtype=np.float32)
+        next_stats = time.monotonic() + STATS_INTERVAL
+
+        while self.running:
+            try:
+                # Короткие кадры: решение о конце фразы принимается через VAD_HANGOVER_MS
+                audio_data = self.audio_buffer.read_window(len(frame), timeout=0.5, out=frame)
+                if audio_data is None:
+                    continue
+                self.check_overrun()
+                self.metrics['audio_seconds'] += len(audio_data) / RATE
+
+                # Время кадра - по часам захвата, а не обработки: начало и конец речи и
+                # задержки не зависят от того, насколько обработка отстала от микрофона
+                captured = self.audio_buffer.capture_time(self.audio_buffer.read_position, RATE)
+                utterance = self.segmenter.push(audio_data, now=captured)
+                if utterance is not None:
+                    self.transcribe_utterance(utterance)
+                elif self.streamer is not None and self.segmenter.in_speech:
+                    self.streamer.feed(self.segmenter.current_audio(), self.segmenter.speech_start)
+
+                if time.monotonic() >= next_stats:
+                    self.log_stats()
+                    self.dump_metrics()
+                    next_stats = time.monotonic() + STATS_INTERVAL
+
+            except Exception as e:
+                logging.error(f"Ошибка обработки аудио: {e}")
+                time.sleep(0.1)
+
+    def process_fixed_windows(self):
         samples_per_buffer = int(RATE * BUFFER_SECONDS)
+        step = samples_per_buffer - int(RATE * OVERLAP_SECONDS)
+        window = np.empty(samples_per_buffer, dtype=np.float32)
+        next_stats = time.monotonic() + STATS_INTERVAL
 
         while self.running:
             try:
-                # Собираем аудио данные
-                while len(buffer) < samples_per_buffer:
-                    if not self.audio_queue.empty():
-                        chunk = self.audio_queue.get()
-                        buffer.extend(chunk.flatten())
-                    else:
-                        time.sleep(0.1)
-                        continue
-
-                # Преобразуем в numpy массив
-                audio_data = np.array(buffer[:samples_per_buffer], dtype=np.float32)
-                buffer = buffer[samples_per_buffer:]  # Очищаем использованные данные
+                # Блокирующее ожидание полного окна вместо опроса очереди
+                audio_data = self.audio_buffer.read_window(samples_per_buffer, step, timeout=0.5, out=window)
+                if audio_data is None:
+                    continue
+                self.check_overrun()
+                self.metrics['audio_seconds'] += step / RATE
 
                 # Проверяем на тишину
                 if not self.is_silence(audio_data):
                     self.transcribe_audio(audio_data)
 
+                if time.monotonic() >= next_stats:
+                    self.dump_metrics()
+                    next_stats = time.monotonic() + STATS_INTERVAL
+
             except Exception as e:
                 logging.error(f"Ошибка обработки аудио: {e}")
                 time.sleep(0.1)
@@ -201,6 +322,12 @@ class AudioProcessor:
 
     def cleanup(self):
         self.running = False
+        self.audio_buffer.close()
+        if SEGMENTATION != "fixed":
+            self.log_stats()
+        if self.publisher is not None:
+            self.publisher.close()
+        self.dump_metrics()
         self.mqtt_client.loop_stop()
         self.mqtt_client.disconnect()
         logging.info("Ресурсы освобождены")
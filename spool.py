@@ -0,0 +1,256 @@
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from influx_writer import is_permanent_error, isolate_rejected
+
+_LENGTH = struct.Struct('>I')
+SEGMENT_SUFFIX = '.seg'
+# Записи, которые InfluxDB отвергает навсегда: line protocol построчно, для разбора вручную
+QUARANTINE_FILE = 'rejected.lp'
+
+
+def encode_record(record: Any) -> bytes:
+    """Преобразование записи (Point, str или bytes) в line protocol"""
+    if isinstance(record, bytes):
+        return record
+    if isinstance(record, str):
+        return record.encode()
+    return record.to_line_protocol().encode()
+
+
+class WriteSpool:
+    """Дисковый журнал неудавшихся записей с повторной отправкой старых данных первыми.
+
+    Пакет, отвергнутый InfluxDB навсегда (4xx, кроме 408/429), не задерживает
+    журнал: отвергнутые записи переносятся в QUARANTINE_FILE, отправка идёт дальше.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 write_fn: Callable[[List[bytes]], None],
+                 max_bytes: int = 512 * 1024 * 1024,
+                 segment_bytes: int = 8 * 1024 * 1024,
+                 replay_rate: float = 5000.0,
+                 replay_batch: int = 1000,
+                 retry_interval: float = 5.0,
+                 encode: Callable[[Any], bytes] = encode_record):
+        self.directory = directory
+        self.write_fn = write_fn
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.replay_rate = replay_rate
+        self.replay_batch = replay_batch
+        self.retry_interval = retry_interval
+        self.encode = encode
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._segments: List[str] = sorted(
+            name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self._sizes: Dict[str, int] = {
+            name: os.path.getsize(os.path.join(directory, name)) for name in self._segments}
+        self._seq = max((int(name.split('-')[0]) for name in self._segments), default=0)
+        self._active = None
+        self._active_name: Optional[str] = None
+        # Позиция повторной отправки внутри самого старого сегмента
+        self._replay_offset = 0
+
+        self.metrics = {
+            'records_spooled': 0,
+            'records_replayed': 0,
+            'records_discarded': 0,
+            'replay_errors': 0,
+            'records_quarantined': 0,
+        }
+
+        if self._segments:
+            logging.info(f"Spool contains {len(self._segments)} segments, {self.size_bytes} bytes to replay")
+
+        self._thread = threading.Thread(target=self._replay_loop, name="spool-replay", daemon=True)
+        self._thread.start()
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def append(self, records: List[Any]):
+        """Добавление пакета в текущий сегмент"""
+        data = b''.join(_LENGTH.pack(len(line)) + line for line in map(self.encode, records))
+        with self._lock:
+            if self._active is None or self._sizes[self._active_name] >= self.segment_bytes:
+                self._rotate()
+            self._active.write(data)
+            self._active.flush()
+            self._sizes[self._active_name] += len(data)
+            self.metrics['records_spooled'] += len(records)
+            self._enforce_cap()
+        self._wakeup.set()
+
+    def quarantine(self, records: List[Any]):
+        """Запись отвергнутых InfluxDB записей в файл карантина"""
+        data = b''.join(self.encode(record) + b'\n' for record in records)
+        with self._lock:
+            with open(self._path(QUARANTINE_FILE), 'ab') as f:
+                f.write(data)
+            self.metrics['records_quarantined'] += len(records)
+        logging.warning(f"{len(records)} records moved to {self._path(QUARANTINE_FILE)}")
+
+    def _rotate(self):
+        """Закрытие текущего сегмента и открытие нового"""
+        if self._active is not None:
+            self._active.close()
+        self._seq += 1
+        self._active_name = f"{self._seq:012d}-{int(time.time())}{SEGMENT_SUFFIX}"
+        self._active = open(self._path(self._active_name), 'ab')
+        self._segments.append(self._active_name)
+        self._sizes[self._active_name] = 0
+
+    def _enforce_cap(self):
+        """Удаление самых старых сегментов при превышении лимита"""
+        while self.size_bytes > self.max_bytes and len(self._segments) > 1:
+            name = self._segments[0]
+            discarded = sum(1 for _ in self._read_records(name))
+            self._remove(name)
+            self._replay_offset = 0
+            self.metrics['records_discarded'] += discarded
+            logging.warning(f"Spool over {self.max_bytes} bytes, discarded {discarded} records from {name}")
+
+    def _remove(self, name: str):
+        self._segments.remove(name)
+        del self._sizes[name]
+        try:
+            os.remove(self._path(name))
+        except OSError as e:
+            logging.error(f"Failed to remove spool segment {name}: {e}")
+
+    def _read_records(self, name: str) -> List[bytes]:
+        """Чтение сегмента; обрезанная последняя запись игнорируется"""
+        with open(self._path(name), 'rb') as f:
+            data = f.read()
+        records = []
+        pos = 0
+        while pos + _LENGTH.size <= len(data):
+            (length,) = _LENGTH.unpack_from(data, pos)
+            pos += _LENGTH.size
+            if pos + length > len(data):
+                break
+            records.append(data[pos:pos + length])
+            pos += length
+        return records
+
+    def _next_segment(self) -> Optional[str]:
+        """Самый старый сегмент; активный закрывается перед чтением"""
+        with self._lock:
+            if not self._segments:
+                return None
+            name = self._segments[0]
+            if name == self._active_name:
+                self._active.close()
+                self._active = None
+                self._active_name = None
+            return name
+
+    def _replay_loop(self):
+        while not self._stop.is_set():
+            name = self._next_segment()
+            if name is None:
+                self._wakeup.wait(self.retry_interval)
+                self._wakeup.clear()
+                continue
+
+            if not self._replay_segment(name):
+                self._stop.wait(self.retry_interval)
+
+    def _replay_segment(self, name: str) -> bool:
+        """Отправка сегмента пакетами с ограничением скорости"""
+        try:
+            records = self._read_records(name)
+        except OSError as e:
+            logging.error(f"Failed to read spool segment {name}: {e}")
+            with self._lock:
+                self._remove(name)
+            return True
+
+        while self._replay_offset < len(records) and not self._stop.is_set():
+            with self._lock:
+                if not self._segments or self._segments[0] != name:
+                    # Сегмент удалён из-за превышения лимита
+                    return True
+            batch = records[self._replay_offset:self._replay_offset + self.replay_batch]
+            start = time.monotonic()
+            rejected = []
+            try:
+                self.write_fn(batch)
+            except Exception as e:
+                with self._lock:
+                    self.metrics['replay_errors'] += 1
+                error = e
+                if is_permanent_error(e):
+                    # Повтор не поможет - отвергнутые записи в карантин, остальные записаны
+                    try:
+                        rejected = isolate_rejected(self.write_fn, batch, e)
+                        self.quarantine(rejected)
+                        error = None
+                    except Exception as retry_error:
+                        error = retry_error
+                if error is not None:
+                    logging.warning(f"Spool replay failed, {len(records) - self._replay_offset} "
+                                    f"records pending: {error}")
+                    return False
+
+            with self._lock:
+                self.metrics['records_replayed'] += len(batch) - len(rejected)
+                if not self._segments or self._segments[0] != name:
+                    return True
+                self._replay_offset += len(batch)
+
+            # Ограничение скорости, чтобы не вытеснять текущий трафик
+            if self.replay_rate > 0:
+                delay = len(batch) / self.replay_rate - (time.monotonic() - start)
+                if delay > 0:
+                    self._stop.wait(delay)
+
+        if self._replay_offset >= len(records):
+            with self._lock:
+                if self._segments and self._segments[0] == name:
+                    self._remove(name)
+                self._replay_offset = 0
+            logging.info(f"Spool segment {name} replayed ({len(records)} records)")
+        return True
+
+    def replay_lag(self) -> float:
+        """Возраст самого старого неотправленного сегмента в секундах"""
+        with self._lock:
+            if not self._segments:
+                return 0.0
+            created = int(self._segments[0].split('-')[1].split('.')[0])
+        return max(0.0, time.time() - created)
+
+    def stats(self) -> Dict[str, Any]:
+        """Снимок состояния журнала"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['spool_bytes'] = self.size_bytes
+            stats['spool_segments'] = len(self._segments)
+        stats['replay_lag'] = self.replay_lag()
+        return stats
+
+    def close(self, timeout: float = 5.0):
+        """Остановка повторной отправки; несохранённые данные остаются на диске"""
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+                self._active_name = None
@@ -0,0 +1,135 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import Histogram
+from transcription_engines import TranscriptionEngine
+
+
+def _normalize(word: str) -> str:
+    return word.strip('.,!?;:"\'').lower()
+
+
+class LocalAgreement:
+    """Фиксация стабильного префикса (local agreement из whisper_streaming).
+
+    Слово считается окончательным, когда две последние гипотезы для растущего
+    окна совпадают до него включительно. Зафиксированные слова не меняются.
+    """
+
+    def __init__(self):
+        self.committed: List[str] = []
+        self._previous: List[str] = []
+
+    def update(self, words: List[str]) -> List[str]:
+        """Новая гипотеза; возвращает только что зафиксированные слова"""
+        start = len(self.committed)
+        agreed = start
+        limit = min(len(words), len(self._previous))
+        while agreed < limit and _normalize(words[agreed]) == _normalize(self._previous[agreed]):
+            agreed += 1
+        self._previous = words
+        new_words = words[start:agreed]
+        self.committed.extend(new_words)
+        return new_words
+
+    def reset(self):
+        self.committed = []
+        self._previous = []
+
+
+class StreamingTranscriber:
+    """Потоковое распознавание фразы, пока она ещё звучит.
+
+    Пока VAD держит фразу открытой, растущее окно перераспознаётся не чаще
+    раза в step секунд и не чаще, чем длилось предыдущее распознавание
+    (доля процессора на перераспознавание - не больше половины). Стабильный
+    префикс публикуется как промежуточный текст. В конце фразы - финальное
+    распознавание, а её текст становится initial_prompt следующей фразы.
+    """
+
+    def __init__(self, engine: TranscriptionEngine, publish: Callable[[str, bool], bool],
+                 language: str = "pl", rate: int = 16000, step: float = 0.5,
+                 min_audio: float = 0.5, prompt_chars: int = 200):
+        self.engine = engine
+        self.publish = publish
+        self.language = language
+        self.rate = rate
+        self.step = step
+        self.min_samples = int(rate * min_audio)
+        self.prompt_chars = prompt_chars
+        self.agreement = LocalAgreement()
+        self.prompt: Optional[str] = None
+        self._next_decode = 0.0
+        self._first_published = False
+        # Начало речи -> первая опубликованная часть фразы
+        self.first_word_latency = Histogram()
+        self.metrics = {
+            'partial_decodes': 0,
+            'final_decodes': 0,
+            'partials_published': 0,
+            'decode_seconds': 0.0,
+            'audio_seconds': 0.0,
+        }
+
+    def _decode(self, audio: np.ndarray) -> List[str]:
+        start = time.monotonic()
+        text = self.engine.transcribe(audio, language=self.language, initial_prompt=self.prompt)
+        elapsed = time.monotonic() - start
+        self.metrics['decode_seconds'] += elapsed
+        self._next_decode = time.monotonic() + max(self.step, elapsed)
+        return text.split()
+
+    def feed(self, audio: np.ndarray, speech_start: float):
+        """Текущее содержимое незаконченной фразы (вызывается на каждом кадре)"""
+        if len(audio) < self.min_samples or time.monotonic() < self._next_decode:
+            return
+        self.metrics['partial_decodes'] += 1
+        if self.agreement.update(self._decode(audio)):
+            self._publish_partial(speech_start)
+
+    def _publish_partial(self, speech_start: float):
+        if self.publish(' '.join(self.agreement.committed), False):
+            self.metrics['partials_published'] += 1
+            if not self._first_published:
+                self._first_published = True
+                self.first_word_latency.observe(time.monotonic() - speech_start)
+
+    def finish(self, audio: np.ndarray, speech_start: float) -> bool:
+        """Финальное распознавание законченной фразы"""
+        self.metrics['final_decodes'] += 1
+        self.metrics['audio_seconds'] += len(audio) / self.rate
+        try:
+            words = self._decode(audio)
+        except Exception as e:
+            logging.error(f"Ошибка распознавания: {e}")
+            words = []
+        # Зафиксированное ранее уже показано - окончательный текст не должен его терять
+        committed = self.agreement.committed
+        if len(words) < len(committed):
+            words = committed
+        text = ' '.join(words)
+
+        published = bool(text) and self.publish(text, True)
+        if published and not self._first_published:
+            self.first_word_latency.observe(time.monotonic() - speech_start)
+        if text:
+            prompt = (self.prompt + ' ' if self.prompt else '') + text
+            if len(prompt) > self.prompt_chars:
+                prompt = prompt[-self.prompt_chars:].split(' ', 1)[-1]
+            self.prompt = prompt
+        self.agreement.reset()
+        self._first_published = False
+        self._next_decode = 0.0
+        return published
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self.metrics)
+        audio_seconds = stats['audio_seconds']
+        # Секунд вычислений на секунду речи (включая перераспознавания)
+        stats['compute_per_audio_second'] = stats['decode_seconds'] / audio_seconds if audio_seconds else 0.0
+        stats['first_word_p50'] = self.first_word_latency.quantile(0.5)
+        stats['first_word_p95'] = self.first_word_latency.quantile(0.95)
+        return stats
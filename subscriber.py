@@ -1,14 +1,25 @@
 import json
 import logging
+import math
 import os
+import signal
 import time
 from datetime import datetime
-from typing import Dict, Any
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import paho.mqtt.client as mqtt
 from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 
+import line_protocol
+from aggregation import TemperatureAggregator
+from dispatcher import MessageDispatcher
+from influx_writer import BatchWriter
+from last_value_cache import LastValueCache
+from metrics import MetricsRegistry, MetricsServer, RateMeter, dump_metrics_file
+from spool import WriteSpool
+
 # Конфигурация логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -27,7 +38,14 @@ class MQTTConfig:
         'display': "display/text",
         'vision': "vision/objects"
     }
-    CERT_PATH = "emqxsl-ca.crt"
+    # Камеры публикуют в vision/objects/<источник>; фильтр '#' включает и сам vision/objects
+    VISION_FILTER = TOPICS['vision'] + "/#"
+    CERT_PATH = os.getenv('MQTT_CERT_PATH', "emqxsl-ca.crt")
+    # Для локального брокера без TLS (например mosquitto): MQTT_TLS=0
+    TLS = os.getenv('MQTT_TLS', "1") == "1"
+    CLIENT_ID = os.getenv('MQTT_CLIENT_ID', "")
+    # Группа shared subscription ($share/<group>/<topic>), пусто - обычная подписка
+    SHARE_GROUP = os.getenv('MQTT_SHARE_GROUP', "")
 
 
 class InfluxDBConfig:
@@ -38,17 +56,108 @@ class InfluxDBConfig:
     BUCKET = os.getenv('INFLUXDB_BUCKET', "sensor_data")
 
 
+class WriterConfig:
+    """Конфигурация буферизованной записи в InfluxDB"""
+    QUEUE_SIZE = int(os.getenv('WRITER_QUEUE_SIZE', "10000"))
+    BATCH_SIZE = int(os.getenv('WRITER_BATCH_SIZE', "500"))
+    FLUSH_INTERVAL = float(os.getenv('WRITER_FLUSH_INTERVAL', "1.0"))
+    MAX_RETRIES = int(os.getenv('WRITER_MAX_RETRIES', "5"))
+    RETRY_BACKOFF = float(os.getenv('WRITER_RETRY_BACKOFF', "0.5"))
+    RETRY_BACKOFF_MAX = float(os.getenv('WRITER_RETRY_BACKOFF_MAX', "30"))
+    # block | drop_oldest | spill
+    OVERFLOW_POLICY = os.getenv('WRITER_OVERFLOW_POLICY', "block")
+    BLOCK_TIMEOUT = float(os.getenv('WRITER_BLOCK_TIMEOUT', "5.0"))
+
+
+class SpoolConfig:
+    """Конфигурация дискового журнала на время недоступности InfluxDB"""
+    ENABLED = os.getenv('SPOOL_ENABLED', "1") == "1"
+    DIR = os.getenv('SPOOL_DIR', "spool")
+    MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(512 * 1024 * 1024)))
+    SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(8 * 1024 * 1024)))
+    # Записей в секунду при повторной отправке
+    REPLAY_RATE = float(os.getenv('SPOOL_REPLAY_RATE', "5000"))
+    REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', "1000"))
+    RETRY_INTERVAL = float(os.getenv('SPOOL_RETRY_INTERVAL', "5.0"))
+
+
+class DispatcherConfig:
+    """Конфигурация пула обработки сообщений"""
+    WORKERS = int(os.getenv('DISPATCH_WORKERS', "4"))
+    # thread | process; process окупается только для тяжёлых обработчиков - для лёгких
+    # сериализация и обмен с процессом дороже самой обработки, thread быстрее
+    MODE = os.getenv('DISPATCH_MODE', "thread")
+    QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', "10000"))
+    # Режим process: сообщений за один обмен с процессом шарда
+    BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', "256"))
+
+
+class AggregationConfig:
+    """Агрегация потока температуры перед записью"""
+    # off | window | deadband
+    MODE = os.getenv('TEMPERATURE_AGGREGATION', "off")
+    WINDOW = float(os.getenv('AGGREGATION_WINDOW', "60"))
+    DEADBAND = float(os.getenv('AGGREGATION_DEADBAND', "0.1"))
+    HEARTBEAT = float(os.getenv('AGGREGATION_HEARTBEAT', "300"))
+
+
+class VisionConfig:
+    """Формат хранения результатов детекции"""
+    # json - строка detected_objects в vision_data, counts - числовые поля в vision_objects
+    STORAGE = os.getenv('VISION_STORAGE', "json")
+    # Словарь меток через запятую, по умолчанию классы COCO
+    LABELS = [label.strip() for label in os.getenv('VISION_LABELS', "").split(',') if label.strip()]
+    VOCABULARY = line_protocol.LabelVocabulary(LABELS or line_protocol.COCO_LABELS)
+
+
+class EncoderConfig:
+    """Способ формирования записей для InfluxDB"""
+    # line - прямое кодирование в line protocol, point - через influxdb_client.Point
+    MODE = os.getenv('INFLUX_ENCODER', "line")
+
+
+class MetricsConfig:
+    """Периодический вывод метрик"""
+    INTERVAL = float(os.getenv('METRICS_INTERVAL', "30"))
+    # Файл для сбора метрик воркеров в subscriber_cluster.py
+    FILE = os.getenv('METRICS_FILE', "")
+    # HTTP endpoint в формате Prometheus, 0 - отключён
+    HOST = os.getenv('METRICS_HOST', "0.0.0.0")
+    PORT = int(os.getenv('METRICS_PORT', "9108"))
+
+
+class CacheConfig:
+    """Кэш последних значений для чтения без обращения к InfluxDB (/latest, /history)"""
+    ENABLED = os.getenv('CACHE_ENABLED', "1") == "1"
+    HISTORY = int(os.getenv('CACHE_HISTORY', "60"))
+    TTL = float(os.getenv('CACHE_TTL', "3600"))
+    MAX_SERIES = int(os.getenv('CACHE_MAX_SERIES', "10000"))
+
+
 class DataProcessor:
     """Класс для обработки данных"""
 
     @staticmethod
-    def process_temperature(data: Dict[str, Any]) -> Point:
+    def process_temperature(data: Dict[str, Any]) -> Optional[Point]:
+        value = float(data["temperature"])
+        if not math.isfinite(value):
+            # Point отбросил бы поле, а точка без полей не записывается
+            return None
         return Point("temperature_measurements") \
             .tag("sensor_type", "dallas") \
             .tag("device_id", data.get("device", "unknown")) \
-            .field("temperature", float(data["temperature"])) \
+            .field("temperature", value) \
             .time(datetime.utcnow())
 
+    @staticmethod
+    def temperature_point(device: str, fields: Dict[str, Any], ts_ns: int) -> Point:
+        point = Point("temperature_measurements") \
+            .tag("sensor_type", "dallas") \
+            .tag("device_id", device)
+        for name, value in fields.items():
+            point.field(name, value)
+        return point.time(ts_ns)
+
     @staticmethod
     def process_display(data: Dict[str, Any]) -> Point:
         return Point("display_messages") \
@@ -59,10 +168,20 @@ class DataProcessor:
     @staticmethod
     def process_vision(data: Dict[str, Any]) -> Point:
         return Point("vision_data") \
-            .tag("source", "camera") \
+            .tag("source", data.get("source") or "camera") \
             .field("detected_objects", json.dumps(data.get("objects", {}))) \
             .time(datetime.utcnow())
 
+    @staticmethod
+    def process_vision_counts(data: Dict[str, Any],
+                              vocabulary: line_protocol.LabelVocabulary = VisionConfig.VOCABULARY) -> Point:
+        counts = vocabulary.counts(data.get("objects", {}))
+        counts["total"] = sum(counts.values())
+        point = Point("vision_objects").tag("source", data.get("source") or "camera")
+        for key, count in counts.items():
+            point.field(key, count)
+        return point.time(datetime.utcnow())
+
 
 class SensorDataCollector:
     """Основной класс для сбора и обработки данных с сенсоров"""
@@ -70,8 +189,9 @@ class SensorDataCollector:
     def __init__(self):
         self._setup_metrics()
         self._init_influxdb()
-        self._init_mqtt()
         self.data_processor = DataProcessor()
+        self._init_dispatcher()
+        self._init_mqtt()
 
     def _setup_metrics(self):
         """Инициализация метрик"""
@@ -80,9 +200,20 @@ class SensorDataCollector:
             'database_writes': 0,
             'errors': 0
         }
+        self.registry = MetricsRegistry()
+        self.registry.define('stage_latency_seconds',
+                             "Per-topic stage latency: decode (receive to decoded), "
+                             "point (decoded to record), write (record to write ack)")
+        self.registry.define('errors_total', "Errors by stage and exception type")
+        self.registry.add_collector(self._gauge_samples)
+        self.rates = RateMeter()
+        self.metrics_server = None
 
     def _init_influxdb(self):
         """Инициализация подключения к InfluxDB"""
+        if WriterConfig.OVERFLOW_POLICY == 'spill' and not SpoolConfig.ENABLED:
+            # Без журнала сбрасывать записи некуда - ошибка конфигурации, а не запуска InfluxDB
+            raise ValueError("WRITER_OVERFLOW_POLICY=spill requires the disk spool (SPOOL_ENABLED=1)")
         try:
             self.influx_client = InfluxDBClient(
                 url=InfluxDBConfig.URL,
@@ -90,18 +221,98 @@ class SensorDataCollector:
                 org=InfluxDBConfig.ORG
             )
             self.write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
+            self.spool = None
+            if SpoolConfig.ENABLED:
+                self.spool = WriteSpool(
+                    SpoolConfig.DIR,
+                    self._write_batch,
+                    max_bytes=SpoolConfig.MAX_BYTES,
+                    segment_bytes=SpoolConfig.SEGMENT_BYTES,
+                    replay_rate=SpoolConfig.REPLAY_RATE,
+                    replay_batch=SpoolConfig.REPLAY_BATCH,
+                    retry_interval=SpoolConfig.RETRY_INTERVAL
+                )
+            self.writer = BatchWriter(
+                self._write_batch,
+                queue_size=WriterConfig.QUEUE_SIZE,
+                batch_size=WriterConfig.BATCH_SIZE,
+                flush_interval=WriterConfig.FLUSH_INTERVAL,
+                max_retries=WriterConfig.MAX_RETRIES,
+                retry_backoff=WriterConfig.RETRY_BACKOFF,
+                retry_backoff_max=WriterConfig.RETRY_BACKOFF_MAX,
+                overflow_policy=WriterConfig.OVERFLOW_POLICY,
+                block_timeout=WriterConfig.BLOCK_TIMEOUT,
+                spill=self.spool.append if self.spool else None,
+                reject=self.spool.quarantine if self.spool else None,
+                metrics=self.registry
+            )
             logging.info("InfluxDB connection established")
         except Exception as e:
             logging.error(f"InfluxDB initialization failed: {e}")
             raise
 
+    def _init_dispatcher(self):
+        """Инициализация пула обработки и реестра обработчиков"""
+        self.dispatcher = MessageDispatcher(
+            self._write_to_db,
+            workers=DispatcherConfig.WORKERS,
+            mode=DispatcherConfig.MODE,
+            queue_size=DispatcherConfig.QUEUE_SIZE,
+            decode=line_protocol.loads,
+            metrics=self.registry,
+            batch_size=DispatcherConfig.BATCH_SIZE
+        )
+        self.cache = None
+        if CacheConfig.ENABLED:
+            self.cache = LastValueCache(CacheConfig.HISTORY, CacheConfig.TTL, CacheConfig.MAX_SERIES)
+            self.dispatcher.add_observer(self.cache.observe)
+
+        if EncoderConfig.MODE == 'line':
+            self.register_handler(MQTTConfig.TOPICS['temperature'], line_protocol.encode_temperature)
+            self.register_handler(MQTTConfig.TOPICS['display'], line_protocol.encode_display)
+            if VisionConfig.STORAGE == 'counts':
+                self.register_handler(MQTTConfig.VISION_FILTER, partial(
+                    line_protocol.encode_vision_counts, vocabulary=VisionConfig.VOCABULARY))
+            else:
+                self.register_handler(MQTTConfig.VISION_FILTER, line_protocol.encode_vision)
+        else:
+            self.register_handler(MQTTConfig.TOPICS['temperature'], self.data_processor.process_temperature)
+            self.register_handler(MQTTConfig.TOPICS['display'], self.data_processor.process_display)
+            if VisionConfig.STORAGE == 'counts':
+                self.register_handler(MQTTConfig.VISION_FILTER, self.data_processor.process_vision_counts)
+            else:
+                self.register_handler(MQTTConfig.VISION_FILTER, self.data_processor.process_vision)
+
+        self.aggregator = None
+        if AggregationConfig.MODE != 'off':
+            self.aggregator = TemperatureAggregator(
+                line_protocol.encode_temperature_fields if EncoderConfig.MODE == 'line'
+                else self.data_processor.temperature_point,
+                partial(self._write_to_db, topic=MQTTConfig.TOPICS['temperature']),
+                mode=AggregationConfig.MODE,
+                window=AggregationConfig.WINDOW,
+                deadband=AggregationConfig.DEADBAND,
+                heartbeat=AggregationConfig.HEARTBEAT
+            )
+            # Состояние агрегатора живёт в основном процессе, поэтому local=True
+            self.register_handler(MQTTConfig.TOPICS['temperature'], self.aggregator.handle, local=True)
+
+    def register_handler(self, topic: str, handler: Callable[[Dict[str, Any]], Any], local: bool = False):
+        """Регистрация обработчика топика (в режиме process обработчик должен сериализоваться pickle)"""
+        self.dispatcher.register(topic, handler, local)
+
     def _init_mqtt(self):
         """Инициализация MQTT клиента"""
         try:
 
-            self.mqtt_client = mqtt.Client()
+            self.mqtt_client = mqtt.Client(client_id=MQTTConfig.CLIENT_ID)
             self.mqtt_client.username_pw_set(MQTTConfig.USERNAME, MQTTConfig.PASSWORD)
-            self.mqtt_client.tls_set(ca_certs=MQTTConfig.CERT_PATH)
+            if MQTTConfig.TLS:
+                self.mqtt_client.tls_set(ca_certs=MQTTConfig.CERT_PATH)
+
+            if MQTTConfig.SHARE_GROUP and self.aggregator:
+                logging.warning("Aggregation with shared subscriptions needs a broker strategy that keeps "
+                                "each device on one subscriber (EMQX hash_clientid), see Readme")
 
             self.mqtt_client.on_connect = self._on_connect
             self.mqtt_client.on_message = self._on_message
@@ -129,68 +340,131 @@ class SensorDataCollector:
         """Обработчик подключения к MQTT"""
         if rc == 0:
             logging.info("Connected to MQTT broker successfully")
-            for topic in MQTTConfig.TOPICS.values():
+            for topic in self.dispatcher.topics:
+                if MQTTConfig.SHARE_GROUP:
+                    topic = f"$share/{MQTTConfig.SHARE_GROUP}/{topic}"
                 client.subscribe(topic)
                 logging.info(f"Subscribed to {topic}")
         else:
             logging.error(f"MQTT connection failed with code {rc}")
 
     def _on_message(self, client, userdata, msg):
-        """Обработчик входящих сообщений"""
+        """Обработчик входящих сообщений: только постановка в очередь пула"""
         try:
-            payload = json.loads(msg.payload.decode())
-            self.metrics['messages_processed'] += 1
-
-            point = None
-            if msg.topic == MQTTConfig.TOPICS['temperature']:
-                point = self.data_processor.process_temperature(payload)
-            elif msg.topic == MQTTConfig.TOPICS['display']:
-                point = self.data_processor.process_display(payload)
-            elif msg.topic == MQTTConfig.TOPICS['vision']:
-                point = self.data_processor.process_vision(payload)
-
-            if point and self._write_to_db(point):
-                self.metrics['database_writes'] += 1
-
+            if not self.dispatcher.submit(msg.topic, msg.payload):
+                self.metrics['errors'] += 1
         except Exception as e:
             self.metrics['errors'] += 1
-            logging.error(f"Message processing error: {e}")
-
-    def _write_to_db(self, point: Point) -> bool:
-        """Запись данных в базу"""
-        try:
-            self.write_api.write(bucket=InfluxDBConfig.BUCKET, record=point)
-            return True
-        except Exception as e:
-            logging.error(f"Database write error: {e}")
-            return False
+            self.registry.inc('errors_total', stage='receive', type=type(e).__name__)
+            logging.error(f"Message dispatch error: {e}")
+
+    def _write_to_db(self, record: Union[Point, bytes], topic: Optional[str] = None) -> bool:
+        """Постановка записи (Point или строка line protocol) в очередь записи"""
+        return self.writer.put(record, topic)
+
+    def _write_batch(self, records: List[Any]):
+        """Запись пакета в базу (вызывается из потоков BatchWriter и WriteSpool)"""
+        self.write_api.write(bucket=InfluxDBConfig.BUCKET, record=records)
+
+    def start_stages(self):
+        """Запуск стадий обработки без подключения к MQTT (используется и в bench_ingest.py)"""
+        if MetricsConfig.PORT:
+            self.metrics_server = MetricsServer(self.registry, MetricsConfig.HOST, MetricsConfig.PORT)
+            if self.cache:
+                self.metrics_server.add_route('/latest', self.cache.handle_latest)
+                self.metrics_server.add_route('/history', self.cache.handle_history)
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                # Порт занят (другой экземпляр) - без HTTP endpoint, сбор данных продолжается
+                logging.error(f"Metrics endpoint on port {MetricsConfig.PORT} not started: {e}")
+                self.metrics_server = None
+        self.dispatcher.start()
+        if self.aggregator:
+            self.aggregator.start()
 
     def start(self):
         """Запуск коллектора"""
+        # SIGTERM (docker stop, subscriber_cluster.py) завершает работу так же, как Ctrl+C
+        signal.signal(signal.SIGTERM, self._on_sigterm)
         try:
+            self.start_stages()
             self.mqtt_client.connect(MQTTConfig.BROKER, MQTTConfig.PORT)
             self.mqtt_client.loop_start()
 
             while True:
                 self._print_metrics()
-                time.sleep(30)
+                if self.cache:
+                    self.cache.evict_expired()
+                time.sleep(MetricsConfig.INTERVAL)
 
         except KeyboardInterrupt:
             logging.info("Shutting down...")
         finally:
             self.cleanup()
 
+    @staticmethod
+    def _on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    def collect_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Снимок метрик всех стадий коллектора"""
+        stats = {
+            'collector': self.metrics,
+            'dispatcher': self.dispatcher.stats(),
+            'writer': self.writer.stats(),
+        }
+        self.metrics['messages_processed'] = stats['dispatcher']['messages_processed']
+        self.metrics['database_writes'] = stats['writer']['records_written']
+        if self.aggregator:
+            stats['aggregation'] = self.aggregator.stats()
+        if self.spool:
+            stats['spool'] = self.spool.stats()
+        if self.cache:
+            stats['cache'] = self.cache.stats()
+        stats['latency'] = self.registry.quantiles('stage_latency_seconds')
+        return stats
+
+    def _gauge_samples(self):
+        """Gauge-метрики для /metrics: все числовые значения стадий и скорости"""
+        stats = self.collect_stats()
+        stats.pop('latency')
+        for section, values in stats.items():
+            for metric, value in values.items():
+                if isinstance(value, (int, float)):
+                    yield metric, {'section': section}, value
+        yield 'throughput_per_second', {'section': 'dispatcher'}, \
+            self.rates.rate('processed', stats['dispatcher']['messages_processed'])
+        yield 'throughput_per_second', {'section': 'writer'}, \
+            self.rates.rate('written', stats['writer']['records_written'])
+
     def _print_metrics(self):
         """Вывод метрик"""
-        logging.info("=== Performance Metrics ===")
-        for metric, value in self.metrics.items():
-            logging.info(f"{metric.replace('_', ' ').title()}: {value}")
+        stats = self.collect_stats()
+        for section, values in stats.items():
+            logging.info(f"=== {section.title()} Metrics ===")
+            for metric, value in values.items():
+                if isinstance(value, float):
+                    value = f"{value:.3f}"
+                logging.info(f"{metric.replace('_', ' ').title()}: {value}")
+
+        if MetricsConfig.FILE:
+            # Файл читает subscriber_cluster.py
+            dump_metrics_file(MetricsConfig.FILE, stats)
 
     def cleanup(self):
         """Очистка ресурсов"""
         self.mqtt_client.loop_stop()
         self.mqtt_client.disconnect()
+        self.dispatcher.stop()
+        if self.aggregator:
+            self.aggregator.stop()
+        self.writer.close()
+        if self.spool:
+            self.spool.close()
         self.influx_client.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
 
 
 if __name__ == "__main__":
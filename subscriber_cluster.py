@@ -0,0 +1,167 @@
+"""Локальный запуск нескольких subscriber.py в одной группе MQTT shared subscription.
+
+Брокер раздаёт сообщения каждого топика между участниками группы, поэтому
+N процессов делят нагрузку. Лаунчер перезапускает упавшие процессы с
+нарастающей задержкой и периодически суммирует их метрики.
+
+Пример с локальным mosquitto (docker compose --profile local up mosquitto):
+
+    MQTT_BROKER=localhost MQTT_PORT=1883 MQTT_TLS=0 \\
+        python subscriber_cluster.py --workers 4 --group collectors
+
+Гарантии порядка сообщений описаны в Readme, раздел «Skalowanie subskrybenta».
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# Метрики, которые не суммируются, а берутся максимальными по воркерам (как и квантили задержек)
+MAX_METRICS = ('last_batch_size', 'last_flush_latency', 'max_flush_latency',
+               'max_shard_depth', 'replay_lag')
+
+
+class Worker:
+    """Один процесс subscriber.py под наблюдением лаунчера"""
+
+    def __init__(self, index: int, args):
+        self.index = index
+        self.args = args
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.backoff = args.min_backoff
+        self.next_start = 0.0
+        self.started_at = 0.0
+
+    @property
+    def metrics_file(self) -> str:
+        return os.path.join(self.args.run_dir, f"worker-{self.index}.json")
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            'MQTT_SHARE_GROUP': self.args.group,
+            'MQTT_CLIENT_ID': f"{self.args.group}-{self.index}",
+            'METRICS_FILE': self.metrics_file,
+            'METRICS_INTERVAL': str(self.args.report_interval),
+            # У каждого воркера свой дисковый журнал
+            'SPOOL_DIR': os.path.join(self.args.run_dir, f"spool-{self.index}"),
+            # Один порт на всех не поделить: свой порт на воркер или endpoint отключён
+            'METRICS_PORT': str(self.args.metrics_base_port + self.index) if self.args.metrics_base_port else "0",
+        })
+        return env
+
+    def start(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subscriber.py')
+        self.process = subprocess.Popen([sys.executable, script], env=self.env())
+        self.started_at = time.monotonic()
+        logging.info(f"Worker {self.index} started (pid {self.process.pid})")
+
+    def check(self):
+        """Перезапуск завершившегося процесса с экспоненциальной задержкой"""
+        now = time.monotonic()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                # Проработал достаточно долго - сбрасываем задержку
+                if now - self.started_at > self.args.max_backoff:
+                    self.backoff = self.args.min_backoff
+                return
+            logging.warning(f"Worker {self.index} exited with code {code}, restart in {self.backoff:.0f}s")
+            self.process = None
+            self.restarts += 1
+            self.next_start = now + self.backoff
+            self.backoff = min(self.backoff * 2, self.args.max_backoff)
+
+        if now >= self.next_start:
+            self.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def read_metrics(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.metrics_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def merge_stats(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Суммирование метрик воркеров по разделам"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for stats in snapshots:
+        for section, values in stats.items():
+            target = merged.setdefault(section, {})
+            for metric, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if metric in MAX_METRICS or section == 'latency':
+                    target[metric] = max(target.get(metric, 0), value)
+                else:
+                    target[metric] = target.get(metric, 0) + value
+    return merged
+
+
+def report(workers: List[Worker], stale_after: float):
+    snapshots = []
+    now = time.time()
+    for worker in workers:
+        data = worker.read_metrics()
+        if data and now - data['timestamp'] <= stale_after:
+            snapshots.append(data['stats'])
+
+    merged = merge_stats(snapshots)
+    alive = sum(1 for w in workers if w.process is not None and w.process.poll() is None)
+    logging.info(f"=== Cluster: {alive}/{len(workers)} alive, {len(snapshots)} reporting, "
+                 f"{sum(w.restarts for w in workers)} restarts ===")
+    for section, values in merged.items():
+        summary = ', '.join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in values.items())
+        logging.info(f"{section}: {summary}")
+    return merged
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--group', default=os.getenv('MQTT_SHARE_GROUP') or "collectors")
+    parser.add_argument('--run-dir', default="cluster", help="каталог для метрик и журналов воркеров")
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    parser.add_argument('--min-backoff', type=float, default=1.0)
+    parser.add_argument('--max-backoff', type=float, default=60.0)
+    parser.add_argument('--metrics-base-port', type=int, default=0,
+                        help="HTTP /metrics воркера i на порту base + i, 0 - без HTTP endpoint")
+    args = parser.parse_args()
+
+    os.makedirs(args.run_dir, exist_ok=True)
+    workers = [Worker(i, args) for i in range(args.workers)]
+    next_report = time.monotonic() + args.report_interval
+
+    try:
+        while True:
+            for worker in workers:
+                worker.check()
+            if time.monotonic() >= next_report:
+                report(workers, stale_after=3 * args.report_interval)
+                next_report = time.monotonic() + args.report_interval
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        logging.info("Stopping workers...")
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == "__main__":
+    main()
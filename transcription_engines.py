@@ -0,0 +1,144 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Type
+
+import numpy as np
+
+# Локальная копия faster-whisper medium (CTranslate2), загружается без сети
+FASTER_WHISPER_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "models", "models--Systran--faster-whisper-medium", "snapshots",
+    "08e178d48790749d25932bbc082711ddcfdfbc4f",
+)
+
+# Движок распознавания: whisper (PyTorch) или faster-whisper (CTranslate2, локальная модель)
+TRANSCRIPTION_ENGINE = os.getenv('TRANSCRIPTION_ENGINE', "whisper")
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', "base")
+FASTER_WHISPER_MODEL = os.getenv('FASTER_WHISPER_MODEL', FASTER_WHISPER_MODEL_PATH)
+WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', "int8")  # int8, int8_float16, float32
+WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', "0"))  # 0 - по умолчанию движка
+WHISPER_BEAM_SIZE = int(os.getenv('WHISPER_BEAM_SIZE', "1"))
+
+
+class TranscriptionEngine(ABC):
+    """Движок распознавания: float32 16 кГц моно -> текст.
+
+    Библиотеки импортируются в конструкторе конкретного движка: torch не
+    попадает в процесс с faster-whisper и наоборот (важно для памяти).
+    """
+    name = 'base'
+
+    @abstractmethod
+    def transcribe(self, audio: np.ndarray, language: str = "pl",
+                   initial_prompt: Optional[str] = None) -> str:
+        """Текст фразы; initial_prompt - предыдущий текст для связности"""
+
+    def describe(self) -> str:
+        return self.name
+
+
+class WhisperEngine(TranscriptionEngine):
+    """Исходный движок: openai-whisper на PyTorch"""
+    name = 'whisper'
+
+    def __init__(self, model_name: str = "base", temperature: float = 0.2, cpu_threads: int = 0,
+                 beam_size: int = 1, **_):
+        import torch
+        import whisper
+
+        self.model_name = model_name
+        self.temperature = temperature
+        self.cpu_threads = cpu_threads
+        self.beam_size = beam_size
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if cpu_threads > 0:
+            # Бюджет потоков супервизора (WHISPER_CPU_THREADS) - для intra-op потоков torch
+            torch.set_num_threads(cpu_threads)
+        if beam_size > 1 and temperature > 0:
+            logging.warning(f"Whisper ищет лучом только при temperature=0, beam_size={beam_size} "
+                            f"при temperature={temperature} не используется")
+        logging.info(f"Загрузка модели Whisper {model_name} ({self.device})...")
+        self.model = whisper.load_model(model_name, device=self.device)
+
+    def transcribe(self, audio: np.ndarray, language: str = "pl",
+                   initial_prompt: Optional[str] = None) -> str:
+        result = self.model.transcribe(
+            audio,
+            language=language,
+            fp16=(self.device == "cuda"),
+            temperature=self.temperature,
+            initial_prompt=initial_prompt,
+            # None - жадное декодирование, как beam_size=1 у faster-whisper
+            beam_size=self.beam_size if self.beam_size > 1 else None,
+        )
+        return result["text"]
+
+    def describe(self) -> str:
+        return (f"{self.name}:{self.model_name} ({self.device}, "
+                f"threads={self.cpu_threads or 'auto'}, beam={self.beam_size})")
+
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """faster-whisper (CTranslate2) с квантованием int8 / int8_float16"""
+    name = 'faster-whisper'
+
+    def __init__(self, model_path: str = FASTER_WHISPER_MODEL_PATH, compute_type: str = "int8",
+                 cpu_threads: int = 0, beam_size: int = 1, device: str = "auto", **_):
+        from faster_whisper import WhisperModel
+
+        if not os.path.exists(os.path.join(model_path, "model.bin")):
+            raise FileNotFoundError(f"No CTranslate2 weights (model.bin) in {model_path}")
+
+        self.model_path = model_path
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.beam_size = beam_size
+        logging.info(f"Загрузка модели faster-whisper из {model_path} ({compute_type})...")
+        # cpu_threads=0 - значение по умолчанию CTranslate2 (4 потока)
+        self.model = WhisperModel(model_path, device=device, compute_type=compute_type,
+                                  cpu_threads=cpu_threads, local_files_only=True)
+
+    def transcribe(self, audio: np.ndarray, language: str = "pl",
+                   initial_prompt: Optional[str] = None) -> str:
+        segments, _ = self.model.transcribe(
+            audio,
+            language=language,
+            beam_size=self.beam_size,
+            initial_prompt=initial_prompt,
+            condition_on_previous_text=False,
+        )
+        # segments - генератор, декодирование идёт при итерации
+        return ''.join(segment.text for segment in segments)
+
+    def describe(self) -> str:
+        return (f"{self.name} ({self.compute_type}, "
+                f"threads={self.cpu_threads or 'auto'}, beam={self.beam_size})")
+
+
+ENGINES: Dict[str, Type[TranscriptionEngine]] = {
+    WhisperEngine.name: WhisperEngine,
+    FasterWhisperEngine.name: FasterWhisperEngine,
+}
+
+
+def create_engine(name: str, **options) -> TranscriptionEngine:
+    """Создание движка по имени; лишние параметры другого движка игнорируются"""
+    engine_class = ENGINES.get(name)
+    if engine_class is None:
+        raise ValueError(f"Unknown transcription engine: {name}")
+    return engine_class(**options)
+
+
+def create_engine_from_env(**overrides) -> TranscriptionEngine:
+    """Движок с параметрами из окружения (TRANSCRIPTION_ENGINE, WHISPER_*)"""
+    options = {
+        'name': TRANSCRIPTION_ENGINE,
+        'model_name': WHISPER_MODEL,
+        'model_path': FASTER_WHISPER_MODEL,
+        'compute_type': WHISPER_COMPUTE_TYPE,
+        'cpu_threads': WHISPER_CPU_THREADS,
+        'beam_size': WHISPER_BEAM_SIZE,
+    }
+    options.update(overrides)
+    return create_engine(options.pop('name'), **options)
@@ -0,0 +1,197 @@
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Параметры нарезки - общие для живого потока и пакетной обработки файлов
+VAD_THRESHOLD_RATIO = float(os.getenv('VAD_THRESHOLD_RATIO', "3.0"))  # Порог относительно уровня шума
+VAD_HANGOVER_MS = int(os.getenv('VAD_HANGOVER_MS', "500"))  # Тишина, завершающая фразу
+VAD_PRE_ROLL_MS = int(os.getenv('VAD_PRE_ROLL_MS', "300"))  # Звук до начала речи
+VAD_MAX_SEGMENT_SECONDS = float(os.getenv('VAD_MAX_SEGMENT_SECONDS', "15"))
+
+
+class EnergyVAD:
+    """Детектор речи по энергии кадра (RMS) с адаптивным уровнем шума.
+
+    Уровень шума быстро опускается к тихим кадрам и медленно поднимается,
+    поэтому постоянный шум вентилятора со временем перестаёт считаться речью.
+    """
+
+    def __init__(self, threshold_ratio: float = 3.0, min_energy: float = 0.003,
+                 floor_rise: float = 0.01, floor_fall: float = 0.2, initial_floor: float = 0.001):
+        self.threshold_ratio = threshold_ratio
+        self.min_energy = min_energy
+        self.floor_rise = floor_rise
+        self.floor_fall = floor_fall
+        self.noise_floor = initial_floor
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        energy = float(np.sqrt(np.dot(frame, frame) / len(frame)))
+        speech = energy > max(self.noise_floor * self.threshold_ratio, self.min_energy)
+
+        # В паузах между слогами энергия речи падает и уровень шума сбрасывается,
+        # у постоянного шума пауз нет - уровень дорастает до него за секунды
+        alpha = self.floor_fall if energy < self.noise_floor else self.floor_rise
+        self.noise_floor += alpha * (energy - self.noise_floor)
+        return speech
+
+
+class Utterance:
+    """Фраза: аудио, границы в отсчётах потока и моменты начала и окончания речи"""
+    __slots__ = ('audio', 'start', 'end', 'speech_start', 'speech_end', 'forced')
+
+    def __init__(self, audio: np.ndarray, start: int, end: int, speech_start: float,
+                 speech_end: float, forced: bool):
+        self.audio = audio
+        self.start = start
+        self.end = end
+        # time.monotonic() срабатывания VAD и последнего кадра с речью - для задержек публикации
+        self.speech_start = speech_start
+        self.speech_end = speech_end
+        # Фраза обрезана по max_segment, а не по паузе
+        self.forced = forced
+
+
+class UtteranceSegmenter:
+    """Нарезка потока кадров на фразы переменной длины.
+
+    Начало - start_ms речи подряд, конец - hangover_ms тишины после речи,
+    длинная речь режется по max_segment_s. К началу фразы добавляется
+    pre_roll_ms звука до срабатывания, чтобы не терять первый слог.
+    Фразы короче min_speech_ms речи (щелчки, стуки) отбрасываются.
+    """
+
+    def __init__(self, vad: EnergyVAD, rate: int, frame_ms: int = 30, start_ms: int = 90,
+                 hangover_ms: int = 500, pre_roll_ms: int = 300, max_segment_s: float = 15.0,
+                 min_speech_ms: int = 250):
+        self.vad = vad
+        self.rate = rate
+        self.frame_size = rate * frame_ms // 1000
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self._pre_roll = deque(maxlen=max(self.start_frames, pre_roll_ms // frame_ms))
+        # Фраза собирается в заранее выделенном массиве
+        self._segment = np.empty(int(rate * max_segment_s), dtype=np.float32)
+        self._length = 0
+        self._start = 0
+        self._in_speech = False
+        self._run = 0
+        self._silence = 0
+        self._speech_frames = 0
+        self._speech_end = 0.0
+        self.speech_start = 0.0
+        self.position = 0
+        self.metrics = {
+            'frames': 0,
+            'speech_frames': 0,
+            'utterances': 0,
+            'forced_cuts': 0,
+            'dropped_short': 0,
+            'samples_in': 0,
+            'samples_out': 0,
+        }
+
+    def _append(self, frame: np.ndarray):
+        size = min(len(frame), len(self._segment) - self._length)
+        self._segment[self._length:self._length + size] = frame[:size]
+        self._length += size
+
+    def _begin(self, start: int, with_pre_roll: bool):
+        self._in_speech = True
+        self._length = 0
+        self._silence = 0
+        self._speech_frames = 0
+        self._start = start
+        if with_pre_roll:
+            for frame in self._pre_roll:
+                self._append(frame)
+            self._start -= self._length
+            self._speech_frames = self._run
+        self._pre_roll.clear()
+
+    def _finish(self, forced: bool) -> Optional[Utterance]:
+        self._in_speech = False
+        if self._speech_frames < self.min_speech_frames:
+            self.metrics['dropped_short'] += 1
+            return None
+        self.metrics['utterances'] += 1
+        self.metrics['samples_out'] += self._length
+        if forced:
+            self.metrics['forced_cuts'] += 1
+        return Utterance(self._segment[:self._length].copy(), self._start,
+                         self._start + self._length, self.speech_start, self._speech_end, forced)
+
+    @property
+    def in_speech(self) -> bool:
+        return self._in_speech
+
+    def current_audio(self) -> np.ndarray:
+        """Незаконченная фраза (представление внутреннего буфера, без копирования)"""
+        return self._segment[:self._length]
+
+    def push(self, frame: np.ndarray, now: Optional[float] = None) -> Optional[Utterance]:
+        """Обработка одного кадра; возвращает фразу, если она закончилась на нём"""
+        now = time.monotonic() if now is None else now
+        speech = self.vad.is_speech(frame)
+        position = self.position
+        self.position += len(frame)
+        self.metrics['frames'] += 1
+        self.metrics['samples_in'] += len(frame)
+        if speech:
+            self.metrics['speech_frames'] += 1
+
+        if not self._in_speech:
+            self._run = self._run + 1 if speech else 0
+            self._pre_roll.append(frame.copy())
+            if self._run >= self.start_frames:
+                self.speech_start = self._speech_end = now
+                self._begin(position + len(frame), with_pre_roll=True)
+            return None
+
+        self._append(frame)
+        if speech:
+            self._silence = 0
+            self._speech_frames += 1
+            self._speech_end = now
+        else:
+            self._silence += 1
+            if self._silence >= self.hangover_frames:
+                self._run = 0
+                return self._finish(forced=False)
+
+        if self._length >= len(self._segment):
+            utterance = self._finish(forced=True)
+            # Речь продолжается - следующая фраза начинается сразу
+            self.speech_start = now
+            self._begin(self.position, with_pre_roll=False)
+            return utterance
+        return None
+
+    def flush(self) -> Optional[Utterance]:
+        """Завершение незаконченной фразы в конце потока"""
+        if not self._in_speech:
+            return None
+        self._run = 0
+        return self._finish(forced=False)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self.metrics)
+        samples_in = stats['samples_in']
+        # Доля аудио, не отправленная в распознавание
+        stats['skipped_ratio'] = 1 - stats['samples_out'] / samples_in if samples_in else 0.0
+        stats['audio_seconds'] = samples_in / self.rate
+        return stats
+
+
+def create_segmenter(rate: int) -> UtteranceSegmenter:
+    """Нарезчик с параметрами VAD_* из окружения"""
+    return UtteranceSegmenter(
+        EnergyVAD(threshold_ratio=VAD_THRESHOLD_RATIO),
+        rate,
+        hangover_ms=VAD_HANGOVER_MS,
+        pre_roll_ms=VAD_PRE_ROLL_MS,
+        max_segment_s=VAD_MAX_SEGMENT_SECONDS,
+    )
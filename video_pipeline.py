@@ -0,0 +1,175 @@
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from metrics import Histogram
+
+
+class LatestSlot:
+    """Одноместный буфер между стадиями: новое значение вытесняет непрочитанное.
+
+    Потребитель всегда получает самый свежий кадр, а не очередь устаревших;
+    вытесненные значения считаются в dropped.
+    """
+
+    def __init__(self):
+        self._value: Any = None
+        self._full = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, value: Any):
+        with self._cond:
+            if self._full:
+                self.dropped += 1
+            self._value = value
+            self._full = True
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Последнее значение или None по таймауту / после close()"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._full or self._closed, timeout):
+                return None
+            if not self._full:
+                return None
+            value, self._value, self._full = self._value, None, False
+            return value
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class BatchSlot:
+    """LatestSlot с местом на каждый источник; читатель забирает кадры пакетом.
+
+    Пакет отдаётся, когда свежие значения есть у всех активных источников (или
+    набралось max_batch), либо когда с прихода первого из них прошло deadline
+    секунд - медленный источник не задерживает остальные дольше дедлайна.
+    При deadline=0 отдаётся всё, что есть на момент чтения.
+    """
+
+    def __init__(self, deadline: float = 0.0, max_batch: int = 0):
+        self.deadline = deadline
+        self.max_batch = max_batch
+        self._values: Dict[Hashable, Any] = {}
+        self._active = set()
+        self._first = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.put_count = 0
+        self.dropped = 0
+        self.dropped_by_key: Dict[Hashable, int] = {}
+        self.batches = 0
+        self.batched = 0
+        self.deadline_hits = 0
+
+    def add_source(self, key: Hashable):
+        with self._cond:
+            self._active.add(key)
+
+    def remove_source(self, key: Hashable):
+        """Источник закончился - пакеты его больше не ждут"""
+        with self._cond:
+            self._active.discard(key)
+            self._cond.notify_all()
+
+    def put(self, key: Hashable, value: Any):
+        with self._cond:
+            if key in self._values:
+                self.dropped += 1
+                self.dropped_by_key[key] = self.dropped_by_key.get(key, 0) + 1
+            elif not self._values:
+                self._first = time.monotonic()
+            self._values[key] = value
+            self.put_count += 1
+            self._cond.notify_all()
+
+    def _limit(self) -> int:
+        limit = max(len(self._active), 1)
+        return min(limit, self.max_batch) if self.max_batch else limit
+
+    def get_batch(self, timeout: Optional[float] = None) -> List[Tuple[Hashable, Any]]:
+        """Пары (источник, значение) в порядке прихода; пустой список по таймауту / после close()"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._values or self._closed, timeout):
+                return []
+            if self.deadline > 0:
+                def ready():
+                    return self._closed or len(self._values) >= self._limit()
+
+                if not ready():
+                    remaining = self._first + self.deadline - time.monotonic()
+                    if not self._cond.wait_for(ready, max(remaining, 0.0)):
+                        self.deadline_hits += 1
+            if not self._values:
+                return []
+            count = min(len(self._values), self.max_batch or len(self._values))
+            batch = []
+            for key in list(self._values)[:count]:
+                batch.append((key, self._values.pop(key)))
+            # Оставшиеся значения ждут следующего пакета с новым отсчётом дедлайна
+            self._first = time.monotonic()
+            self.batches += 1
+            self.batched += len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def wait_taken(self, key: Hashable, timeout: Optional[float] = None) -> bool:
+        """Ожидание, пока значение источника заберут (подача кадров без потерь)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: key not in self._values or self._closed, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class StageTimings:
+    """Время стадий конвейера (гистограммы) и частота обработанных кадров"""
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._last_frames = 0
+        self._last_time = time.monotonic()
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def frame_done(self):
+        with self._lock:
+            self._frames += 1
+
+    def fps(self) -> float:
+        """Кадров в секунду с прошлого вызова"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_time
+            rate = (self._frames - self._last_frames) / elapsed if elapsed > 0 else 0.0
+            self._last_frames, self._last_time = self._frames, now
+            return rate
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95 (верхние границы корзин) и среднее по стадиям, мс"""
+        result = {}
+        for stage, histogram in list(self.stages.items()):
+            _, total, count = histogram.snapshot()
+            if count:
+                result[stage] = {
+                    'p50_ms': histogram.quantile(0.5) * 1000,
+                    'p95_ms': histogram.quantile(0.95) * 1000,
+                    'mean_ms': total / count * 1000,
+                }
+        return result
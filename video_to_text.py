@@ -1,78 +1,223 @@
 import json
+import os
+import re
 import cv2
-from ultralytics import YOLO
 import numpy as np
 import time
 from collections import deque
 import logging
-import paho.mqtt.client as mqtt
+import sys
+import threading
+
+from detector_backends import create_detector_from_env
+from metrics import dump_metrics_file
+from mqtt_publisher import CoalescingPublisher, connect_client
+from video_pipeline import BatchSlot, StageTimings
+from video_tracking import IoUTracker, MotionGate, summarize_predictions
+
+# Источники через запятую: номер камеры, RTSP-адрес или видеофайл, имя можно задать как имя=адрес
+VIDEO_SOURCES = os.getenv('VIDEO_SOURCES', "0")
+# Сколько ждать кадров остальных камер после первого кадра пакета
+BATCH_DEADLINE_MS = float(os.getenv('VIDEO_BATCH_DEADLINE_MS', "30"))
+# Ограничение размера пакета, 0 - все камеры
+MAX_BATCH = int(os.getenv('VIDEO_MAX_BATCH', "0"))
+# Без отрисовки и окна (серверы без монитора)
+HEADLESS = os.getenv('VIDEO_HEADLESS', "0") == "1"
+STATS_INTERVAL = float(os.getenv('VIDEO_STATS_INTERVAL', "10"))
+# Файл метрик для супервизора main.py (пусто - не писать)
+METRICS_FILE = os.getenv('METRICS_FILE', "")
+
+
+def parse_source(spec, index=0):
+    """(имя, адрес) из 0, rtsp://..., video.mp4 или имя=адрес"""
+    if isinstance(spec, int):
+        return f"cam{spec}", spec
+    spec = spec.strip()
+    match = re.match(r"^([\w-]+)=(.+)$", spec)
+    if match:
+        name, uri = match.group(1), match.group(2)
+    else:
+        name, uri = None, spec
+    if uri.isdigit():
+        uri = int(uri)
+        name = name or f"cam{uri}"
+    elif name is None:
+        stem = os.path.splitext(os.path.basename(uri))[0]
+        name = stem if os.path.exists(uri) and stem else f"cam{index}"
+    # Имя становится частью топика: без / + #
+    return re.sub(r"[^\w-]", "_", name), uri
+
+
+class VideoSource:
+    """Камера или файл: свой захват, детектор движения, треки и состояние публикации"""
+
+    def __init__(self, name, uri, topic, motion_gate=True, max_detect_interval=2.0, tracking=True):
+        self.name = name
+        self.uri = uri
+        self.topic = topic
+        self.is_file = isinstance(uri, str) and os.path.isfile(uri)
+        self.video = cv2.VideoCapture(uri)
+        if isinstance(uri, int):
+            self.video.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            self.video.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+
+        self.gate = MotionGate(max_interval=max_detect_interval) if motion_gate else None
+        self.tracker = IoUTracker() if tracking else None
+        self.last_result = ({}, [])
+        self.last_update = 0
+        self.prev_data = {}
+        self.frames = 0
+        self.active = True
+        # Камера перестала отдавать кадры (для файла конец ролика - не сбой)
+        self.failed = False
 
 
 class VideoAnalyzer:
-    def __init__(self, model_file='yolov8n.pt', min_score=0.5):
-        self.detector = YOLO(model_file)
+    def __init__(self, model_file='yolov8n.pt', min_score=0.5, client=None, stats_interval=STATS_INTERVAL,
+                 motion_gate=True, max_detect_interval=2.0, tracking=True, sources=None,
+                 batch_deadline=None, max_batch=None, headless=None, detector=None, display=True):
+        # Один детектор на все камеры: модель загружается один раз, кадры идут пакетами.
+        # Бэкенд (torch/onnx/openvino), размер входа и int8 - DETECTOR_* из окружения
+        self.detector = detector if detector is not None else create_detector_from_env(model_file)
         self.min_score = min_score
+        self.headless = HEADLESS if headless is None else headless
+        # display=False - кадры рисуются, но окна нет (бенчмарк)
+        self.display = display and not self.headless
+        # Рамки нужны только для отрисовки и трекера
+        self.need_boxes = not self.headless or tracking
         self.perf_metrics = deque(maxlen=30)
 
-        # Сетевое подключение
-        self.client = mqtt.Client()
-        self.client.username_pw_set("mqtt_user", "mqtt_pass")
-        self.client.tls_set()
-        self.client.connect("jcddef63.ala.eu-central-1.emqxsl.com", 8883)
-        self.client.loop_start()
+        # Сетевое подключение (готовый клиент можно передать извне, например заглушку).
+        # Публикация - из потока публикатора: мигающие детекции сливаются в последнее
+        # значение, частота на топик - PUBLISH_RATE (столько успевает показать LCD)
+        if client is None:
+            client = connect_client("video")
+        self.client = client
+        self.publisher = CoalescingPublisher(client)
 
         self.data_channel = "vision/objects"
         self.visual_styles = {}
 
-        # Инициализация видео
-        self.video = cv2.VideoCapture(0)
-        self.video.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.video.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # Инициализация видео: у каждого источника свой подтопик vision/objects/<имя>.
+        # Детектор движения запускает инференс только при изменениях в кадре или раз
+        # в max_detect_interval секунд
+        if sources is None:
+            sources = VIDEO_SOURCES.split(',')
+        self.sources = []
+        for index, spec in enumerate(sources):
+            name, uri = parse_source(spec, index)
+            if any(source.name == name for source in self.sources):
+                name = f"{name}_{index}"
+            self.sources.append(VideoSource(name, uri, f"{self.data_channel}/{name}",
+                                            motion_gate, max_detect_interval, tracking))
 
-        self.last_update = 0
         self.update_freq = 2.0
-        self.prev_data = {}
+
+        # Конвейер: захват (поток на источник) -> пакетный инференс -> (публикатор, отрисовка),
+        # между стадиями - последний кадр каждого источника
+        self.timings = StageTimings()
+        self.stats_interval = stats_interval
+        deadline = BATCH_DEADLINE_MS / 1000 if batch_deadline is None else batch_deadline
+        self.frame_slot = BatchSlot(deadline, MAX_BATCH if max_batch is None else max_batch)
+        self.render_slot = BatchSlot()
+        for source in self.sources:
+            self.frame_slot.add_source(source)
+        self.running = False
+
+    def detect_batch(self, frames):
+        """Цветовое преобразование, инференс одним пакетом и подсчёт по каждому кадру.
+
+        Время стадий учитывается на кадр (время пакета / размер пакета), полное
+        время инференса пакета - в стадии batch.
+        """
+        start = time.perf_counter()
+        rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        converted = time.perf_counter()
+        predictions = self.detector(rgb_frames, verbose=False)
+        inferred = time.perf_counter()
+        results = [self.process_predictions([pred]) for pred in predictions]
+        done = time.perf_counter()
+
+        count = len(frames)
+        self.timings.observe('batch', inferred - converted)
+        for _ in range(count):
+            self.timings.observe('convert', (converted - start) / count)
+            self.timings.observe('inference', (inferred - converted) / count)
+            self.timings.observe('postprocess', (done - inferred) / count)
+        return results
+
+    def detect(self, frame):
+        """Цветовое преобразование, инференс и подсчёт - без отрисовки и публикации"""
+        return self.detect_batch([frame])[0]
+
+    def _needs_detection(self, source, frame):
+        return source.gate is None or source.gate.should_detect(frame)
+
+    def _held_result(self, source):
+        """Результат для кадра без изменений: текущие треки или последняя детекция.
+
+        Рамки не сдвигаются: кадр почти не отличается от кадра последней детекции.
+        """
+        if source.tracker is not None:
+            return source.tracker.current()
+        return source.last_result
+
+    def _update_result(self, source, data, detections):
+        if source.tracker is not None:
+            data, detections = source.tracker.update(detections)
+        source.last_result = (data, detections)
+        return data, detections
+
+    def process_frame(self, frame, source=None):
+        """Детекция с пропуском кадров без изменений; между детекциями - треки"""
+        source = source or self.sources[0]
+        if not self._needs_detection(source, frame):
+            return self._held_result(source)
+        data, detections = self.detect(frame)
+        return self._update_result(source, data, detections)
+
+    def process_batch(self, frames):
+        """Кадры [(источник, кадр)] -> [(data, detections)]; детектор - один пакет на все изменившиеся кадры"""
+        results = [None] * len(frames)
+        pending = []
+        for i, (source, frame) in enumerate(frames):
+            if self._needs_detection(source, frame):
+                pending.append(i)
+            else:
+                results[i] = self._held_result(source)
+        if pending:
+            detected = self.detect_batch([frames[i][1] for i in pending])
+            for i, (data, detections) in zip(pending, detected):
+                results[i] = self._update_result(frames[i][0], data, detections)
+        return results
 
     def analyze_frame(self, frame):
+        """Синхронная обработка одного кадра (без потоков конвейера)"""
         start = time.time()
 
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            predictions = self.detector(rgb_frame, stream=True)
-            data = self.process_predictions(frame, predictions)
+            data, detections = self.process_frame(frame)
+            if not self.headless:
+                self.draw(frame, detections)
 
             rate = 1.0 / max(time.time() - start, 0.001)
             self.perf_metrics.append(rate)
 
-            self.show_metrics(frame, data)
+            if not self.headless:
+                self.show_metrics(frame, data)
+            self.send_data(data)
             return frame, np.mean(self.perf_metrics), data
 
         except Exception as e:
             logging.error(f"Analysis error: {e}")
             return frame, 0, {}
 
-    def process_predictions(self, frame, predictions):
-        data = {}
-
-        for pred in predictions:
-            boxes = pred.boxes
-            for box in boxes:
-                score = float(box.conf[0])
-                if score < self.min_score:
-                    continue
+    def process_predictions(self, predictions):
+        return summarize_predictions(predictions, self.min_score, boxes=self.need_boxes)
 
-                coords = map(int, box.xyxy[0])
-                x1, y1, x2, y2 = coords
-                class_id = int(box.cls[0])
-                label = pred.names[class_id]
-
-                data[label] = data.get(label, 0) + 1
-
-                style = self.get_style(class_id)
-                self.draw_box(frame, x1, y1, x2, y2, label, score, style)
-
-        self.send_data(data)
-        return data
+    def draw(self, frame, detections):
+        for x1, y1, x2, y2, class_id, label, score in detections:
+            self.draw_box(frame, x1, y1, x2, y2, label, score, self.get_style(class_id))
 
     def get_style(self, class_id):
         if class_id not in self.visual_styles:
@@ -87,9 +232,10 @@ class VideoAnalyzer:
         cv2.putText(frame, text, (x1, y1 - 5),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
 
-    def show_metrics(self, frame, data):
+    def show_metrics(self, frame, data, fps=None):
         y = 30
-        cv2.putText(frame, f"FPS: {np.mean(self.perf_metrics):.1f}",
+        fps = np.mean(self.perf_metrics) if fps is None else fps
+        cv2.putText(frame, f"FPS: {fps:.1f}",
                     (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
         for name, count in data.items():
@@ -97,38 +243,163 @@ class VideoAnalyzer:
             cv2.putText(frame, f"{name}: {count}",
                         (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
-    def send_data(self, data):
+    def send_data(self, data, source=None):
+        source = source or self.sources[0]
         now = time.time()
-        if now - self.last_update >= self.update_freq or data != self.prev_data:
+        if now - source.last_update >= self.update_freq or data != source.prev_data:
             if data:
-                try:
-                    self.client.publish(
-                        self.data_channel,
-                        json.dumps({"objects": data}),
-                        qos=1
-                    )
-                    self.last_update = now
-                    self.prev_data = data.copy()
-                except Exception as e:
-                    logging.error(f"Data transmission error: {e}")
+                if self.publisher.publish(source.topic, json.dumps({"objects": data, "source": source.name}), qos=1):
+                    source.last_update = now
+                    source.prev_data = data.copy()
+                else:
+                    logging.error("Data transmission error: publish queue is full")
+
+    def _capture_loop(self, source):
+        while self.running:
+            start = time.perf_counter()
+            success, frame = source.video.read()
+            if not success:
+                if source.is_file:
+                    logging.info(f"End of video: {source.name}")
+                else:
+                    logging.error(f"Video capture failed: {source.name}")
+                    source.failed = True
+                break
+            self.timings.observe('capture', time.perf_counter() - start)
+            # Непрочитанный кадр вытесняется - инференс не отстаёт от камеры
+            self.frame_slot.put(source, (frame, time.monotonic()))
+        # Пакеты больше не ждут этот источник; без источников конвейер останавливается
+        source.active = False
+        self.frame_slot.remove_source(source)
+        if not any(s.active for s in self.sources):
+            self.running = False
+
+    def _inference_loop(self):
+        while self.running:
+            batch = self.frame_slot.get_batch(timeout=0.5)
+            if not batch:
+                continue
+            try:
+                results = self.process_batch([(source, frame) for source, (frame, _) in batch])
+            except Exception as e:
+                logging.error(f"Analysis error: {e}")
+                continue
+            now = time.monotonic()
+            for (source, (frame, captured)), (data, detections) in zip(batch, results):
+                self.timings.observe('frame_age', now - captured)
+                self.timings.frame_done()
+                source.frames += 1
+                start = time.perf_counter()
+                self.send_data(data, source)
+                self.timings.observe('publish', time.perf_counter() - start)
+                if not self.headless:
+                    self.render_slot.put(source, (frame, detections, data))
+
+    def stats(self):
+        stats = {
+            'fps': self.timings.fps(),
+            'frames_captured': self.frame_slot.put_count,
+            'frames_dropped': self.frame_slot.dropped,
+            'renders_dropped': self.render_slot.dropped,
+            'mqtt': self.publisher.stats(),
+            'batch_size': self.frame_slot.batched / self.frame_slot.batches if self.frame_slot.batches else 0.0,
+            'batch_deadline_hits': self.frame_slot.deadline_hits,
+            'sources': {
+                source.name: {
+                    'frames': source.frames,
+                    'dropped': self.frame_slot.dropped_by_key.get(source, 0),
+                    'active': source.active,
+                }
+                for source in self.sources
+            },
+            'stages': self.timings.summary(),
+        }
+        gates = [source.gate.stats() for source in self.sources if source.gate is not None]
+        if gates:
+            gate = {key: sum(g[key] for g in gates) for key in ('frames', 'detections', 'skipped', 'gate_seconds')}
+            gate['skipped_ratio'] = gate['skipped'] / gate['frames'] if gate['frames'] else 0.0
+            # Оценка сэкономленного CPU: пропущенные кадры * средняя стоимость детекции - стоимость проверок
+            detect_cost = sum(stats['stages'].get(name, {}).get('mean_ms', 0.0)
+                              for name in ('convert', 'inference', 'postprocess')) / 1000
+            full_cost = gate['frames'] * detect_cost
+            saved = gate['skipped'] * detect_cost - gate['gate_seconds']
+            stats['gate'] = dict(gate, cpu_saved_seconds=saved,
+                                 cpu_saved_ratio=saved / full_cost if full_cost else 0.0)
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        captured = max(stats['frames_captured'], 1)
+        stages = ', '.join(f"{name} p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms"
+                           for name, s in stats['stages'].items())
+        logging.info(f"Pipeline: {stats['fps']:.1f} FPS from {len(self.sources)} sources, "
+                     f"batch {stats['batch_size']:.1f} frames, dropped frames {stats['frames_dropped']} "
+                     f"({stats['frames_dropped'] / captured:.0%}), dropped renders {stats['renders_dropped']}; "
+                     f"{stages}")
+        if 'gate' in stats:
+            gate = stats['gate']
+            logging.info(f"Motion gate: skipped inference on {gate['skipped_ratio']:.0%} of frames, "
+                         f"CPU saved ~{gate['cpu_saved_seconds']:.1f}s ({gate['cpu_saved_ratio']:.0%})")
+        mqtt_stats = stats['mqtt']
+        logging.info(f"MQTT: published {mqtt_stats['published']}, coalesced {mqtt_stats['coalesced']}, "
+                     f"dropped {mqtt_stats['dropped']}, queue latency p50={mqtt_stats['latency_p50'] * 1000:.0f}ms "
+                     f"p95={mqtt_stats['latency_p95'] * 1000:.0f}ms")
+        if METRICS_FILE:
+            dump_metrics_file(METRICS_FILE, {'video': {
+                'fps': stats['fps'],
+                'frames_processed': sum(source['frames'] for source in stats['sources'].values()),
+                'frames_captured': stats['frames_captured'],
+                'frames_dropped': stats['frames_dropped'],
+                'batch_size': stats['batch_size'],
+            }})
+        return stats
 
     def run(self):
+        self.running = True
+        threads = [
+            threading.Thread(target=self._capture_loop, args=(source,), name=f"capture-{source.name}", daemon=True)
+            for source in self.sources
+        ]
+        threads.append(threading.Thread(target=self._inference_loop, name="inference", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        next_stats = time.monotonic() + self.stats_interval
+        fps = 0.0
         try:
-            while True:
-                success, frame = self.video.read()
-                if not success:
-                    logging.error("Video capture failed")
-                    break
+            # Отрисовка и imshow - в главном потоке (требование GUI OpenCV)
+            while self.running:
+                if self.headless:
+                    time.sleep(0.1)
+                else:
+                    for source, (frame, detections, data) in self.render_slot.get_batch(timeout=0.1):
+                        start = time.perf_counter()
+                        self.draw(frame, detections)
+                        self.show_metrics(frame, data, fps)
+                        drawn = time.perf_counter()
+                        self.timings.observe('draw', drawn - start)
+                        if self.display:
+                            cv2.imshow(f'Analysis {source.name}' if len(self.sources) > 1 else 'Analysis', frame)
+                            self.timings.observe('render', time.perf_counter() - drawn)
 
-                frame, _, _ = self.analyze_frame(frame)
-                cv2.imshow('Analysis', frame)
+                    if self.display and cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
 
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                if time.monotonic() >= next_stats:
+                    fps = self.log_stats()['fps']
+                    next_stats = time.monotonic() + self.stats_interval
 
         finally:
-            self.video.release()
-            cv2.destroyAllWindows()
+            self.running = False
+            for slot in (self.frame_slot, self.render_slot):
+                slot.close()
+            for thread in threads:
+                thread.join(timeout=2)
+            for source in self.sources:
+                source.video.release()
+            if self.display:
+                cv2.destroyAllWindows()
+            self.publisher.close()
             self.client.loop_stop()
             self.client.disconnect()
 
@@ -137,3 +408,6 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     analyzer = VideoAnalyzer()
     analyzer.run()
+    # Ненулевой код: супервизор (main.py) перезапускает сбой с задержкой, а не сразу
+    if any(source.failed for source in analyzer.sources):
+        sys.exit(1)
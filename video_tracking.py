@@ -0,0 +1,184 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# (x1, y1, x2, y2, class_id, label, score)
+Detection = Tuple[int, int, int, int, int, str, float]
+
+
+def _numpy(values) -> np.ndarray:
+    """Тензор torch (в т.ч. на GPU) или массив -> numpy"""
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def summarize_predictions(predictions, min_score: float, boxes: bool = True):
+    """Порог и подсчёт по меткам векторно по всем рамкам кадра.
+
+    conf/cls/xyxy переводятся в numpy целиком (без обращения к тензору на каждую
+    рамку), счётчики - np.bincount по номерам классов. Рамки собираются только
+    для прошедших порог; boxes=False - только счётчики.
+    """
+    data: Dict[str, int] = {}
+    detections: List[Detection] = []
+    for pred in predictions:
+        result = pred.boxes
+        if result is None or not len(result):
+            continue
+        scores = _numpy(result.conf)
+        keep = scores >= min_score
+        if not keep.any():
+            continue
+        class_ids = _numpy(result.cls)[keep].astype(np.int64)
+        counts = np.bincount(class_ids)
+        for class_id in np.flatnonzero(counts).tolist():
+            label = pred.names[class_id]
+            data[label] = data.get(label, 0) + int(counts[class_id])
+        if boxes:
+            coords = _numpy(result.xyxy)[keep].astype(np.int64).tolist()
+            for (x1, y1, x2, y2), class_id, score in zip(coords, class_ids.tolist(), scores[keep].tolist()):
+                detections.append((x1, y1, x2, y2, class_id, pred.names[class_id], score))
+    return data, detections
+
+
+class MotionGate:
+    """Дешёвая проверка изменений в кадре перед запуском детектора.
+
+    Кадр уменьшается до width пикселей по ширине, переводится в серый и
+    сравнивается с кадром последней детекции (а не с предыдущим - так
+    медленные изменения тоже накапливаются). Детектор запускается, если
+    изменилось больше min_changed доли пикселей или прошло max_interval секунд.
+    """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25, min_changed: float = 0.01,
+                 max_interval: float = 2.0):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.max_interval = max_interval
+        self._reference: Optional[np.ndarray] = None
+        self._last_detect = 0.0
+        self.metrics = {
+            'frames': 0,
+            'detections': 0,
+            'skipped': 0,
+            'gate_seconds': 0.0,
+        }
+
+    def _small(self, frame: np.ndarray) -> np.ndarray:
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_detect(self, frame: np.ndarray, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        start = time.perf_counter()
+        small = self._small(frame)
+        detect = self._reference is None or now - self._last_detect >= self.max_interval
+        if not detect:
+            diff = cv2.absdiff(small, self._reference)
+            changed = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            detect = changed >= self.min_changed
+        if detect:
+            self._reference = small
+            self._last_detect = now
+            self.metrics['detections'] += 1
+        else:
+            self.metrics['skipped'] += 1
+        self.metrics['frames'] += 1
+        self.metrics['gate_seconds'] += time.perf_counter() - start
+        return detect
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self.metrics)
+        stats['skipped_ratio'] = stats['skipped'] / stats['frames'] if stats['frames'] else 0.0
+        return stats
+
+
+def iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class _Track:
+    __slots__ = ('box', 'velocity', 'class_id', 'label', 'score', 'misses', 'updated')
+
+    def __init__(self, detection: Detection, now: float):
+        self.box = np.array(detection[:4], dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.class_id, self.label, self.score = detection[4], detection[5], detection[6]
+        self.misses = 0
+        self.updated = now
+
+    def predict(self, now: float) -> np.ndarray:
+        return self.box + self.velocity * (now - self.updated)
+
+
+class IoUTracker:
+    """Сопоставление детекций с треками по IoU (жадно, внутри одного класса).
+
+    Между запусками детектора рамки треков остаются на месте (current() не
+    экстраполирует их по скорости): MotionGate пропускает только кадры, почти не
+    отличающиеся от кадра последней детекции, то есть объекты на них там же, где
+    были; сдвинутая по скорости рамка уехала бы с остановившегося объекта.
+    Скорость учитывается только при сопоставлении с новыми детекциями. Трек без
+    совпадений живёт max_misses запусков детектора - короткие пропуски
+    детекции не меняют счётчики.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_misses: int = 2):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks: List[_Track] = []
+
+    def update(self, detections: List[Detection], now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            predicted = track.predict(now)
+            for d, detection in enumerate(detections):
+                if detection[4] == track.class_id:
+                    overlap = iou(predicted, detection)
+                    if overlap >= self.iou_threshold:
+                        pairs.append((overlap, t, d))
+
+        matched_tracks, matched_detections = set(), set()
+        for _, t, d in sorted(pairs, reverse=True):
+            if t in matched_tracks or d in matched_detections:
+                continue
+            matched_tracks.add(t)
+            matched_detections.add(d)
+            track = self.tracks[t]
+            box = np.array(detections[d][:4], dtype=np.float32)
+            elapsed = now - track.updated
+            if elapsed > 0:
+                track.velocity = (box - track.box) / elapsed
+            track.box, track.updated = box, now
+            track.score = detections[d][6]
+            track.misses = 0
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                track.velocity[:] = 0
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        self.tracks.extend(_Track(detection, now) for d, detection in enumerate(detections)
+                           if d not in matched_detections)
+        return self.current()
+
+    def current(self):
+        """Счётчики по меткам и рамки активных треков (положения с последней детекции)"""
+        data: Dict[str, int] = {}
+        detections = []
+        for track in self.tracks:
+            data[track.label] = data.get(track.label, 0) + 1
+            x1, y1, x2, y2 = (int(v) for v in track.box)
+            detections.append((x1, y1, x2, y2, track.class_id, track.label, track.score))
+        return data, detections